@@ -1,11 +1,26 @@
-from flask import Flask, render_template, request, redirect, url_for, abort
-from models import db, Transacao, Usuario, Banco, MovimentacaoBanco, CartaoCredito, CompraCartao, Categoria, Recorrencia, Orcamento, FaturaCartao, TransacaoFatura, PagamentoFatura
+from flask import Flask, render_template, request, redirect, url_for, abort, jsonify, Response, stream_with_context
+from models import db, CENTAVO, CATEGORIA_PADRAO, inserir_ignorando_duplicados, ids_categorias, Transacao, Usuario, Banco, MovimentacaoBanco, CartaoCredito, CompraCartao, Categoria, Recorrencia, Orcamento, NotificacaoOrcamento, FaturaCartao, TransacaoFatura, PagamentoFatura, ExecucaoRecorrencia, ResumoMensal, TarefaRelatorio
 from datetime import datetime, date, timedelta
-from dateutil.relativedelta import relativedelta
-from sqlalchemy import extract, func
+from regras_recorrencia import proxima_ocorrencia, ocorrencias_entre, quantidade_no_mes
+from faturas import competencia_fatura, somar_nas_faturas, lancar_parcelas, estornar_parcelas
+from busca import buscar_descricoes, LIMITE_PADRAO
+from resumos import resumos_cli, somar_transacoes_no_resumo
+from cache_relatorios import em_cache
+from tendencias import calcular_tendencias, ANOS_PADRAO, ANOS_MAXIMO
+from tarefas import (
+    worker_cli, enfileirar, devolver_a_fila, nome_arquivo, partes_do_arquivo,
+    FORMATOS_TAREFA
+)
+from orcamentos import situacao_orcamento, visao_orcamentos
+from migracoes import db_cli, aplicar_migracoes
+from exportacao import linhas_em_streaming, gerar_csv, gerar_ofx, formatar_valor
+from importacao import ler_csv, ler_ofx, HashImportacao, ErroImportacao, TAMANHO_LOTE_IMPORTACAO
+from sqlalchemy import func
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 from calendar import monthrange
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 import os
+import io
 from itsdangerous import URLSafeTimedSerializer
 from datetime import datetime, timedelta
 import secrets
@@ -14,54 +29,37 @@ from itsdangerous import URLSafeTimedSerializer
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail, Email, To, Content
 import logging
+import time
+import click
 from flask import flash
+from flask.cli import AppGroup
+from flask.json.provider import DefaultJSONProvider
 
-app = Flask(__name__)
 
-# ✅ AUTO-MIGRATION: Adicionar colunas na inicialização
-def create_missing_columns():
-    """Cria colunas faltantes na tabela transacoes"""
-    with app.app_context():
-        try:
-            from sqlalchemy import text
-
-            with db.engine.connect() as connection:
-                # Verificar e adicionar cartao_id
-                try:
-                    connection.execute(text(
-                        'ALTER TABLE transacoes ADD COLUMN cartao_id INTEGER REFERENCES cartoes_credito(id);'
-                    ))
-                    connection.commit()
-                    print("✅ Coluna cartao_id adicionada!")
-                except Exception as e:
-                    if 'already exists' in str(e).lower() or 'column' in str(e).lower():
-                        pass
-                    else:
-                        print(f"⚠️ Erro em cartao_id: {e}")
-
-                # Verificar e adicionar recorrencia_id
-                try:
-                    connection.execute(text(
-                        'ALTER TABLE transacoes ADD COLUMN recorrencia_id INTEGER REFERENCES recorrencias(id);'
-                    ))
-                    connection.commit()
-                    print("✅ Coluna recorrencia_id adicionada!")
-                except Exception as e:
-                    if 'already exists' in str(e).lower() or 'column' in str(e).lower():
-                        pass
-                    else:
-                        print(f"⚠️ Erro em recorrencia_id: {e}")
-        except Exception as e:
-            print(f"❌ Erro na migration: {e}")
+class JSONProviderDinheiro(DefaultJSONProvider):
+    """Valores monetários (Decimal) vão para o JSON como número, não como texto"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Decimal):
+            return float(o)
+        return DefaultJSONProvider.default(o)
+
+
+app = Flask(__name__)
+app.json = JSONProviderDinheiro(app)
 
-# Chamar a função para criar colunas faltantes
-create_missing_columns()
 # ===== FUNÇÃO PARA CONVERTER VALORES COM VÍRGULA OU PONTO =====
 
 def parse_valor(valor_str):
-    """Converte string com vírgula ou ponto para float"""
+    """
+    Converte string com vírgula ou ponto para Decimal com 2 casas.
+
+    Decimal (e não float) para o valor chegar exato à coluna em centavos:
+    float('0.1') + float('0.2') != 0.3, Decimal não tem esse problema.
+    """
     if not valor_str or not str(valor_str).strip():
-        return 0.0
+        return Decimal('0.00')
 
     valor_str = str(valor_str).strip()
 
@@ -75,75 +73,162 @@ def parse_valor(valor_str):
         valor_str = valor_str.replace(',', '')
 
     try:
-        return float(valor_str)
-    except ValueError:
-        return 0.0
+        valor = Decimal(valor_str)
+    except (InvalidOperation, ValueError):
+        return Decimal('0.00')
+
+    # NaN e infinito não viram centavos
+    if not valor.is_finite():
+        return Decimal('0.00')
+    return valor.quantize(CENTAVO, rounding=ROUND_HALF_UP)
 
 # ===== FIM DA FUNÇÃO =====
-def criar_transacao_de_recorrencia(recorrencia):
+def dados_ocorrencia(recorrencia, data, descricao=None):
+    """Monta a linha de Transacao de uma ocorrência da recorrência"""
+    return {
+        'usuario_id': recorrencia.usuario_id,
+        'descricao': descricao or recorrencia.descricao,
+        'valor': recorrencia.valor,
+        'tipo': recorrencia.tipo,
+        'categoria_id': recorrencia.categoria_id,
+        'forma_pagamento': recorrencia.forma_pagamento,
+        'banco_id': recorrencia.banco_id,
+        'cartao_id': recorrencia.cartao_id,
+        'data': data,
+        'recorrencia_id': recorrencia.id,  # Link para recorrência
+        'data_criacao': datetime.utcnow()
+    }
+
+
+def inserir_ocorrencias(linhas):
     """
-    Cria uma transação automaticamente quando uma recorrência é criada.
-    Mas APENAS se a data_inicio é HOJE ou ANTES.
+    Grava ocorrências de recorrências no livro (recorrencia_id, data).
+
+    Um único INSERT ... ON CONFLICT DO NOTHING: ocorrências já geradas
+    (por este ou por outro worker) são ignoradas pelo índice único.
+    As inseridas entram no resumo mensal na mesma transação.
+    Retorna as linhas efetivamente inseridas.
     """
+    inseridas = inserir_ignorando_duplicados(
+        Transacao, linhas, ['recorrencia_id', 'data'],
+        retornar=['id', 'usuario_id', 'banco_id', 'categoria_id', 'tipo',
+                  'forma_pagamento', 'valor', 'descricao', 'data'])
+    somar_transacoes_no_resumo(inseridas)
+    return inseridas
 
-    from datetime import datetime
 
-    # Verificar se JÁ existe transação para esta recorrência de hoje
-    ja_existe = Transacao.query.filter_by(
-        recorrencia_id=recorrencia.id,
-        data=datetime.now().date()
-    ).first()
+def movimento_da_transacao(linha):
+    """(sinal no saldo, movimentação) de uma transação com banco, ou None"""
+    if not linha.banco_id:
+        return None
 
-    # Se já existe, não cria novamente (evita duplicatas)
-    if ja_existe:
-        print(f"✓ Transação já existe para recorrência {recorrencia.id}")
-        return ja_existe
+    tipo = linha.tipo.lower()
+    if tipo == 'saída' or tipo == 'despesa':
+        sinal, tipo_movimento, rotulo = -1, 'saida', 'Despesa'
+    elif tipo == 'entrada' or tipo == 'receita':
+        sinal, tipo_movimento, rotulo = 1, 'entrada', 'Receita'
+    else:
+        return None
 
-    # SE a recorrência começa HOJE ou ANTES, cria a transação
-    if recorrencia.data_inicio <= datetime.now().date():
+    return sinal, {
+        'banco_id': linha.banco_id,
+        'transacao_id': linha.id,
+        'tipo_movimento': tipo_movimento,
+        'valor': linha.valor,
+        'descricao': f'{rotulo}: {linha.descricao}',
+        'data': linha.data
+    }
 
-        try:
-            # Criar a transação
-            transacao = Transacao(
-                usuario_id=recorrencia.usuario_id,
-                descricao=recorrencia.descricao,
-                valor=recorrencia.valor,
-                tipo=recorrencia.tipo,
-                categoria=recorrencia.categoria,
-                forma_pagamento=recorrencia.forma_pagamento,
-                banco_id=recorrencia.banco_id,
-                cartao_id=recorrencia.cartao_id,
-                data=datetime.now().date(),  # HOJE
-                recorrencia_id=recorrencia.id  # Link para recorrência
-            )
 
-            db.session.add(transacao)
-            db.session.commit()
+def _somar_nos_saldos(deltas):
+    # Um único UPDATE atômico (saldo = saldo + delta) por banco
+    for banco_id, delta in deltas.items():
+        db.session.execute(db.update(Banco).where(
+            Banco.id == banco_id).values(saldo=Banco.saldo + delta))
 
-            print(f"✅ Transação criada: {recorrencia.descricao}")
 
-            # ✅ Atualizar saldo do banco se banco_id foi fornecido
-            if recorrencia.banco_id:
-                banco = Banco.query.get(recorrencia.banco_id)
-                if banco:
-                    if recorrencia.tipo.lower() == 'saída' or recorrencia.tipo.lower() == 'despesa':
-                        banco.saldo -= recorrencia.valor
-                    elif recorrencia.tipo.lower() == 'entrada' or recorrencia.tipo.lower() == 'receita':
-                        banco.saldo += recorrencia.valor
-                    db.session.commit()
-                    print(f"✅ Saldo do banco atualizado: {banco.nome}")
+def aplicar_transacoes_nos_bancos(inseridas):
+    """
+    Atualiza saldos e registra as movimentações de transações inseridas em
+    lote (ocorrências de recorrências, extratos importados).
 
-            return transacao
+    Os movimentos são inseridos de uma vez e cada banco recebe um único
+    UPDATE atômico (saldo = saldo + delta), na mesma transação do lote.
+    """
+    deltas = {}
+    movimentos = []
 
-        except Exception as e:
-            print(f"❌ Erro ao criar transação: {e}")
-            db.session.rollback()
-            return None
+    for linha in inseridas:
+        movimento = movimento_da_transacao(linha)
+        if not movimento:
+            continue
 
-    else:
+        sinal, dados = movimento
+        deltas[linha.banco_id] = deltas.get(
+            linha.banco_id, 0) + sinal * linha.valor
+        movimentos.append({**dados, 'data_criacao': datetime.utcnow()})
+
+    if movimentos:
+        db.session.execute(db.insert(MovimentacaoBanco.__table__), movimentos)
+
+    _somar_nos_saldos(deltas)
+
+
+def estornar_transacoes_nos_bancos(transacoes):
+    """
+    Desfaz aplicar_transacoes_nos_bancos: devolve o valor aos saldos e
+    apaga as movimentações das transações (um DELETE por transacao_id).
+    """
+    deltas = {}
+    for transacao in transacoes:
+        movimento = movimento_da_transacao(transacao)
+        if movimento:
+            sinal, _ = movimento
+            deltas[transacao.banco_id] = deltas.get(
+                transacao.banco_id, 0) - sinal * transacao.valor
+
+    ids = [transacao.id for transacao in transacoes]
+    if ids:
+        MovimentacaoBanco.query.filter(MovimentacaoBanco.transacao_id.in_(ids)).delete(
+            synchronize_session=False)
+
+    _somar_nos_saldos(deltas)
+
+
+def criar_transacao_de_recorrencia(recorrencia):
+    """
+    Cria uma transação automaticamente quando uma recorrência é criada.
+    Mas APENAS se a data_inicio é HOJE ou ANTES.
+    """
+    hoje = date.today()
+
+    # SE a recorrência começa depois de hoje, não cria nada
+    if recorrencia.data_inicio > hoje:
         print(f"ℹ Recorrência começa em {recorrencia.data_inicio}, não é hoje")
         return None
 
+    try:
+        # O índice único (recorrencia_id, data) evita duplicatas
+        inseridas = inserir_ocorrencias([dados_ocorrencia(recorrencia, hoje)])
+
+        if not inseridas:
+            print(f"✓ Transação já existe para recorrência {recorrencia.id}")
+        else:
+            print(f"✅ Transação criada: {recorrencia.descricao}")
+
+            # ✅ Saldo e movimentação do banco, como nas ocorrências agendadas
+            aplicar_transacoes_nos_bancos(inseridas)
+
+        db.session.commit()
+
+        return Transacao.query.filter_by(
+            recorrencia_id=recorrencia.id, data=hoje).first()
+
+    except Exception as e:
+        print(f"❌ Erro ao criar transação: {e}")
+        db.session.rollback()
+        return None
+
 # ===== FUNÇÃO PARA GERENCIAR FATURAS =====
 
 
@@ -158,8 +243,12 @@ def criar_ou_atualizar_fatura(usuario_id, cartao_id, data_compra, valor):
     Exemplo com fechamento dia 24:
     - Compra em 18/11 (ANTES) → Fatura de NOVEMBRO (fecha 24/11, vence 05/12)
     - Compra em 25/11 (DEPOIS) → Fatura de DEZEMBRO (fecha 24/12, vence 05/01)
+
+    O valor é somado com um upsert atômico (faturas.somar_nas_faturas),
+    seguro com vários workers lançando no mesmo cartão.
     """
-    cartao = CartaoCredito.query.get(cartao_id)
+    cartao = CartaoCredito.query.filter_by(
+        id=cartao_id, usuario_id=usuario_id).first()
 
     if not cartao:
         print(f"❌ Cartão com ID {cartao_id} não encontrado!")
@@ -168,79 +257,13 @@ def criar_ou_atualizar_fatura(usuario_id, cartao_id, data_compra, valor):
     # ✅ LÓGICA CORRIGIDA FINAL:
     # Se compra é ANTES ou NO dia de fechamento = fatura DESTE MÊS
     # Se compra é DEPOIS do dia de fechamento = fatura do PRÓXIMO MÊS
-    if data_compra.day <= cartao.dia_fechamento:
-        # Compra ANTES ou NO fechamento = fatura DESTE MÊS
-        mes = data_compra.month
-        ano = data_compra.year
-    else:
-        # Compra DEPOIS do fechamento = fatura do PRÓXIMO MÊS
-        proximo_mes = data_compra + relativedelta(months=1)
-        mes = proximo_mes.month
-        ano = proximo_mes.year
-
-    # Calcular datas da fatura
-    _, ultimo_dia = monthrange(ano, mes)
-    dia_fechamento = min(cartao.dia_fechamento, ultimo_dia)
-
-    data_fechamento = date(ano, mes, dia_fechamento)
-
-    # ✅ Data de vencimento = MÊS SEGUINTE após o fechamento
-    # Exemplo: Se fecha em 24/11, vence em 05/12
-    mes_vencimento = mes + 1 if mes < 12 else 1
-    ano_vencimento = ano if mes < 12 else ano + 1
-    _, ultimo_dia_venc = monthrange(ano_vencimento, mes_vencimento)
-    dia_vencimento_calc = min(cartao.dia_vencimento, ultimo_dia_venc)
-    data_vencimento = date(ano_vencimento, mes_vencimento, dia_vencimento_calc)
-
-    print(f"DEBUG: Fatura {mes}/{ano}")
-    print(f"       Fecha: {data_fechamento}")
-    print(
-        f"       Vence em: {mes_vencimento}/{ano_vencimento}, dia {dia_vencimento_calc}")
-    print(f"       Data Vencimento: {data_vencimento}")
-
-    # Procurar ou criar fatura
-    fatura = FaturaCartao.query.filter_by(
-        usuario_id=usuario_id,
-        cartao_id=cartao_id,
-        mes=mes,
-        ano=ano
-    ).first()
-
-    if not fatura:
-        # ✅ Criar nova fatura
-        fatura = FaturaCartao(
-            usuario_id=usuario_id,
-            cartao_id=cartao_id,
-            mes=mes,
-            ano=ano,
-            data_fechamento=data_fechamento,
-            data_vencimento=data_vencimento,
-            valor_total=valor,
-            valor_pago=0,
-            valor_restante=valor,
-            status='aberta'
-        )
-        db.session.add(fatura)
-        db.session.flush()
-        print(f"✅ Fatura criada: {mes:02d}/{ano}")
-        print(f"   Fecha: {data_fechamento.strftime('%d/%m/%Y')}")
-        print(f"   Vence: {data_vencimento.strftime('%d/%m/%Y')}")
-        print(f"   Valor: R$ {valor}")
-    else:
-        # Atualizar valores da fatura existente
-        fatura.valor_total += valor
-        fatura.valor_restante = fatura.valor_total - fatura.valor_pago
-        print(f"✅ Fatura atualizada: {mes:02d}/{ano}")
-        print(f"   Total: R$ {fatura.valor_total}")
-
-    # Verificar se está atrasada
-    if fatura.data_vencimento < date.today() and fatura.status == 'aberta':
-        fatura.status = 'atrasada'
-        print(f"⚠️  Fatura {mes:02d}/{ano} marcada como ATRASADA")
+    mes, ano = competencia_fatura(cartao, data_compra)
 
     try:
+        fatura = somar_nas_faturas(cartao, {(mes, ano): valor}).get((mes, ano))
         db.session.commit()
-        print(f"✅ Fatura {mes:02d}/{ano} salva com sucesso!")
+        if fatura:
+            print(f"✅ Fatura {mes:02d}/{ano} salva: R$ {fatura.valor_total}")
         return fatura
     except Exception as e:
         print(f"❌ Erro ao salvar fatura: {e}")
@@ -297,6 +320,258 @@ def pagar_fatura(fatura_id, valor_pagamento, banco_id):
 
 # ===== FIM DAS FUNÇÕES DE FATURA =====
 
+# ===== FUNÇÕES DO DASHBOARD =====
+
+
+def resumo_dashboard(usuario_id):
+    """
+    Calcula os totais do dashboard direto no banco de dados.
+
+    Uma única consulta agrupada por tipo, carteira (banco_id nulo) e
+    cartão de crédito devolve poucas linhas, independente do tamanho
+    do histórico do usuário.
+    """
+    eh_carteira = Transacao.banco_id.is_(None)
+    eh_cartao = Transacao.forma_pagamento == 'Cartão de Crédito'
+
+    grupos = db.session.query(
+        Transacao.tipo,
+        eh_carteira,
+        eh_cartao,
+        func.sum(Transacao.valor),
+        func.count(Transacao.id)
+    ).filter(
+        Transacao.usuario_id == usuario_id
+    ).group_by(Transacao.tipo, eh_carteira, eh_cartao).all()
+
+    resumo = {
+        'total_receitas': 0,
+        'total_despesas': 0,
+        'saldo_carteira': 0,
+        'quantidade_transacoes': 0
+    }
+
+    for tipo, carteira, cartao, soma, quantidade in grupos:
+        soma = soma or 0
+        resumo['quantidade_transacoes'] += quantidade
+
+        # ✅ BUG 4 FIX: NÃO contar transações de CARTÃO no total de receitas/despesas
+        if cartao:
+            continue
+
+        if tipo == 'Receita':
+            resumo['total_receitas'] += soma
+            if carteira:
+                resumo['saldo_carteira'] += soma
+        elif tipo == 'Despesa':
+            resumo['total_despesas'] += soma
+            if carteira:
+                resumo['saldo_carteira'] -= soma
+
+    return resumo
+
+
+def saldo_total_bancos(usuario_id):
+    """Soma o saldo de todos os bancos do usuário"""
+    total = db.session.query(func.sum(Banco.saldo)).filter(
+        Banco.usuario_id == usuario_id).scalar()
+    return total or 0
+
+# ===== FIM DAS FUNÇÕES DO DASHBOARD =====
+
+# ===== PAGINAÇÃO DE TRANSAÇÕES =====
+
+POR_PAGINA_PADRAO = 50
+POR_PAGINA_MAXIMO = 200
+
+
+def ler_por_pagina():
+    """Lê o parâmetro por_pagina da URL, limitado a POR_PAGINA_MAXIMO"""
+    por_pagina = request.args.get('por_pagina', type=int) or POR_PAGINA_PADRAO
+    return max(1, min(por_pagina, POR_PAGINA_MAXIMO))
+
+
+def codificar_cursor(data, id):
+    """Cursor de paginação no formato AAAA-MM-DD_id"""
+    return f"{data.isoformat()}_{id}"
+
+
+def decodificar_cursor(cursor):
+    """Converte o cursor AAAA-MM-DD_id de volta para (data, id)"""
+    try:
+        data_str, id_str = cursor.split('_', 1)
+        return datetime.strptime(data_str, '%Y-%m-%d').date(), int(id_str)
+    except (ValueError, AttributeError):
+        abort(400)
+
+
+def condicao_cursor(cursor, entidade=Transacao):
+    """Condição de seek: linhas depois do cursor na ordem (data DESC, id DESC)"""
+    data_cursor, id_cursor = decodificar_cursor(cursor)
+    return db.tuple_(entidade.data, entidade.id) < (data_cursor, id_cursor)
+
+
+def paginar_transacoes(query, cursor, por_pagina):
+    """
+    Paginação por keyset (seek) ordenada por (data DESC, id DESC).
+
+    Em vez de OFFSET, cada página começa logo depois do cursor da página
+    anterior, usando o índice (usuario_id, data, id). O custo é o mesmo
+    na primeira ou na milésima página.
+    Retorna (transacoes, proximo_cursor), com proximo_cursor None na última página.
+    """
+    if cursor:
+        query = query.filter(condicao_cursor(cursor))
+
+    transacoes = query.order_by(
+        Transacao.data.desc(), Transacao.id.desc()
+    ).limit(por_pagina + 1).all()
+
+    proximo_cursor = None
+    if len(transacoes) > por_pagina:
+        transacoes = transacoes[:por_pagina]
+        ultima = transacoes[-1]
+        proximo_cursor = codificar_cursor(ultima.data, ultima.id)
+
+    return transacoes, proximo_cursor
+
+# ===== FIM DA PAGINAÇÃO DE TRANSAÇÕES =====
+
+# ===== FILTROS E BUSCA DE TRANSAÇÕES =====
+
+FILTROS_TRANSACAO = ('data_inicio', 'data_fim', 'categoria', 'tipo',
+                     'banco_id', 'forma_pagamento', 'q')
+
+
+def ler_filtros_transacoes(fonte):
+    """
+    Lê os filtros de transação da URL/formulário.
+    Valores vazios, 'Todas' e 'Todos' significam sem filtro.
+    """
+    filtros = {}
+    for nome in FILTROS_TRANSACAO:
+        valor = (fonte.get(nome) or '').strip()
+        if valor and valor not in ('Todas', 'Todos'):
+            filtros[nome] = valor
+    return filtros
+
+
+def condicoes_filtro_transacoes(usuario_id, filtros):
+    """
+    Monta as condições WHERE dos filtros de transação.
+
+    Os filtros usam os índices (usuario_id, data, id),
+    (usuario_id, categoria_id, data) e (usuario_id, banco_id, data).
+    A categoria chega pelo nome e é traduzida para os ids do usuário.
+    """
+    condicoes = [Transacao.usuario_id == usuario_id]
+
+    try:
+        if 'data_inicio' in filtros:
+            condicoes.append(Transacao.data >= datetime.strptime(
+                filtros['data_inicio'], '%Y-%m-%d').date())
+        if 'data_fim' in filtros:
+            # Intervalo semiaberto: data_fim inclusive = antes do dia seguinte
+            condicoes.append(Transacao.data < datetime.strptime(
+                filtros['data_fim'], '%Y-%m-%d').date() + timedelta(days=1))
+        if 'banco_id' in filtros:
+            condicoes.append(Transacao.banco_id == int(filtros['banco_id']))
+    except ValueError:
+        abort(400)
+
+    if 'categoria' in filtros:
+        condicoes.append(Transacao.categoria_id.in_(
+            db.select(Categoria.id).where(
+                Categoria.usuario_id == usuario_id,
+                Categoria.nome == filtros['categoria'])))
+    if 'tipo' in filtros:
+        condicoes.append(Transacao.tipo == filtros['tipo'])
+    if 'forma_pagamento' in filtros:
+        condicoes.append(Transacao.forma_pagamento ==
+                         filtros['forma_pagamento'])
+    if 'q' in filtros:
+        termo = filtros['q'].replace('\\', '\\\\').replace(
+            '%', '\\%').replace('_', '\\_')
+        condicoes.append(Transacao.descricao.ilike(
+            f'%{termo}%', escape='\\'))
+
+    return condicoes
+
+
+def buscar_transacoes(usuario_id, filtros, cursor, por_pagina):
+    """
+    Busca paginada de transações com resumo (COUNT/SUM) na mesma consulta.
+
+    O resumo de todo o conjunto filtrado é uma subconsulta de uma linha,
+    unida (LEFT JOIN) à página de transações; assim uma única ida ao
+    banco devolve a página e os totais, mesmo quando a página vem vazia.
+    Retorna (transacoes, resumo, proximo_cursor).
+    """
+    condicoes = condicoes_filtro_transacoes(usuario_id, filtros)
+
+    resumo = db.select(
+        func.count(Transacao.id).label('quantidade'),
+        func.sum(db.case((Transacao.tipo == 'Receita', Transacao.valor),
+                         else_=0)).label('total_receitas'),
+        func.sum(db.case((Transacao.tipo == 'Despesa', Transacao.valor),
+                         else_=0)).label('total_despesas')
+    ).where(*condicoes).subquery('resumo')
+
+    condicoes_pagina = list(condicoes)
+    if cursor:
+        condicoes_pagina.append(condicao_cursor(cursor))
+
+    pagina = db.select(Transacao).where(*condicoes_pagina).order_by(
+        Transacao.data.desc(), Transacao.id.desc()
+    ).limit(por_pagina + 1).subquery('pagina')
+    transacao_pagina = db.aliased(Transacao, pagina)
+
+    linhas = db.session.execute(
+        db.select(resumo.c.quantidade, resumo.c.total_receitas,
+                  resumo.c.total_despesas, transacao_pagina)
+        .select_from(resumo)
+        .outerjoin(pagina, db.true())
+        .order_by(pagina.c.data.desc(), pagina.c.id.desc())
+    ).all()
+
+    primeira = linhas[0]
+    total_receitas = primeira.total_receitas or 0
+    total_despesas = primeira.total_despesas or 0
+    resumo_busca = {
+        'quantidade': primeira.quantidade,
+        'total_receitas': total_receitas,
+        'total_despesas': total_despesas,
+        'saldo': total_receitas - total_despesas
+    }
+
+    transacoes = [linha[3] for linha in linhas if linha[3] is not None]
+
+    proximo_cursor = None
+    if len(transacoes) > por_pagina:
+        transacoes = transacoes[:por_pagina]
+        ultima = transacoes[-1]
+        proximo_cursor = codificar_cursor(ultima.data, ultima.id)
+
+    return transacoes, resumo_busca, proximo_cursor
+
+
+def transacao_para_dict(transacao):
+    """Representação JSON de uma transação"""
+    return {
+        'id': transacao.id,
+        'data': transacao.data.isoformat(),
+        'descricao': transacao.descricao,
+        'valor': transacao.valor,
+        'categoria': transacao.categoria,
+        'tipo': transacao.tipo,
+        'forma_pagamento': transacao.forma_pagamento,
+        'banco_id': transacao.banco_id,
+        'cartao_id': transacao.cartao_id,
+        'recorrencia_id': transacao.recorrencia_id
+    }
+
+# ===== FIM DOS FILTROS E BUSCA DE TRANSAÇÕES =====
+
 # Filtro para formatar valores monetários
 
 
@@ -305,8 +580,10 @@ def format_decimal(value):
     if value is None:
         return '0.00'
     try:
-        return "{:.2f}".format(float(value)).replace('.', ',')
-    except (ValueError, TypeError):
+        if not isinstance(value, Decimal):
+            value = Decimal(str(value))
+        return "{:.2f}".format(value).replace('.', ',')
+    except (InvalidOperation, ValueError, TypeError):
         return '0.00'
 
 # Filtro para converter para valor correto
@@ -647,138 +924,281 @@ def recuperar_senha(token):
 
 # ===== FIM DAS ROTAS =====
 
-# ===== ROTAS PRINCIPAIS =====
+# ===== PROCESSAMENTO DE RECORRÊNCIAS =====
 
 
-@app.route('/')
-def processar_recorrencias():
+def processar_lote_recorrencias(usuario_id, recorrencias, hoje):
+    """
+    Gera as transações de um lote de recorrências do mesmo usuário.
+
+    As ocorrências são gravadas com um único INSERT ... ON CONFLICT DO
+    NOTHING e o lote tem um único commit. Cada recorrência tem a
+    proxima_ocorrencia avançada para depois de hoje.
+    """
+    a_processar = []
+    amanha = hoje + timedelta(days=1)
+
+    for rec in recorrencias:
+        # Ocorrências anteriores a hoje que não foram geradas são puladas
+        if proxima_ocorrencia(rec, hoje) == hoje:
+            a_processar.append(rec)
+        rec.proxima_ocorrencia = proxima_ocorrencia(rec, amanha)
+
+    # Marca como recorrência; o livro (recorrencia_id, data) evita duplicatas
+    inseridas = inserir_ocorrencias([
+        dados_ocorrencia(rec, hoje, descricao=f"[REC] {rec.descricao}")
+        for rec in a_processar
+    ])
+    aplicar_transacoes_nos_bancos(inseridas)
+    db.session.commit()
+
+    return len(inseridas)
+
+
+def processar_recorrencias(hoje=None):
     """
     ✅ Processa recorrências e gera transações automaticamente
     Esta função deve ser chamada regularmente (diariamente recomendado)
+    pelo comando `flask recorrencias run`, fora das requisições web.
+
+    Só são lidas as recorrências com proxima_ocorrencia <= hoje (coluna
+    indexada), processadas em lotes por usuário, com inserção em massa e
+    um commit por lote. Retorna a quantidade de transações geradas.
     """
-    from datetime import date, timedelta
+    hoje = hoje or date.today()
 
-    recorrencias_ativas = Recorrencia.query.filter_by(ativa=True).all()
-    hoje = date.today()
+    vencidas = db.and_(
+        Recorrencia.ativa.is_(True),
+        Recorrencia.proxima_ocorrencia <= hoje
+    )
 
-    for rec in recorrencias_ativas:
-        # ✅ Verificar se a recorrência deve gerar transação hoje
-        # Regra simples: se o dia do vencimento é hoje ou passou
+    usuarios = [usuario_id for (usuario_id,) in db.session.query(
+        Recorrencia.usuario_id
+    ).filter(vencidas).distinct().order_by(Recorrencia.usuario_id)]
 
-        # Se data_fim existe e já passou, não processar
-        if rec.data_fim and hoje > rec.data_fim:
-            continue
+    total_gerado = 0
+    for usuario_id in usuarios:
+        lote = Recorrencia.query.filter(
+            Recorrencia.usuario_id == usuario_id, vencidas).all()
+        total_gerado += processar_lote_recorrencias(usuario_id, lote, hoje)
 
-        # Se data_inicio ainda não chegou, não processar
-        if hoje < rec.data_inicio:
-            continue
+    return total_gerado
 
-        # Verificar se a transação já foi criada hoje
-        transacao_hoje = Transacao.query.filter_by(
-            usuario_id=rec.usuario_id,
-            descricao=f"[REC] {rec.descricao}",
-            data=hoje
-        ).first()
 
-        if transacao_hoje:
-            continue  # Já foi processada hoje
-
-        # Verificar frequência e se deve gerar transação
-        dias_desde_inicio = (hoje - rec.data_inicio).days
-
-        deve_processar = False
-        if rec.frequencia == 'Diária':
-            deve_processar = True
-        elif rec.frequencia == 'Semanal':
-            deve_processar = dias_desde_inicio % 7 == 0
-        elif rec.frequencia == 'Quinzenal':
-            deve_processar = dias_desde_inicio % 15 == 0
-        elif rec.frequencia == 'Mensal':
-            deve_processar = hoje.day == rec.dia_vencimento
-        elif rec.frequencia == 'Bimestral':
-            meses_desde = (hoje.year - rec.data_inicio.year) * \
-                12 + (hoje.month - rec.data_inicio.month)
-            deve_processar = meses_desde % 2 == 0 and hoje.day == rec.dia_vencimento
-        elif rec.frequencia == 'Trimestral':
-            meses_desde = (hoje.year - rec.data_inicio.year) * \
-                12 + (hoje.month - rec.data_inicio.month)
-            deve_processar = meses_desde % 3 == 0 and hoje.day == rec.dia_vencimento
-        elif rec.frequencia == 'Semestral':
-            meses_desde = (hoje.year - rec.data_inicio.year) * \
-                12 + (hoje.month - rec.data_inicio.month)
-            deve_processar = meses_desde % 6 == 0 and hoje.day == rec.dia_vencimento
-        elif rec.frequencia == 'Anual':
-            deve_processar = (hoje.month == rec.data_inicio.month and
-                              hoje.day == rec.dia_vencimento)
-
-        if deve_processar:
-            # ✅ Criar transação automática
-            nova_transacao = Transacao(
-                usuario_id=rec.usuario_id,
-                descricao=f"[REC] {rec.descricao}",  # Marca como recorrência
-                valor=rec.valor,
-                tipo=rec.tipo,
-                categoria=rec.categoria,
-                forma_pagamento=rec.forma_pagamento,
-                banco_id=rec.banco_id,  # Usa o banco da recorrência
-                data=hoje,
-                data_criacao=datetime.utcnow()
-            )
+def recorrencias_em_paginas(desde, ate, tamanho_pagina=500):
+    """
+    Percorre as recorrências ativas no período em páginas (keyset pelo id).
+
+    Os objetos são desanexados da sessão para que os commits dos lotes
+    não os expirem, mantendo a memória limitada a uma página.
+    """
+    ultimo_id = 0
+    while True:
+        pagina = Recorrencia.query.filter(
+            Recorrencia.ativa.is_(True),
+            Recorrencia.id > ultimo_id,
+            Recorrencia.data_inicio <= ate,
+            db.or_(Recorrencia.data_fim.is_(None),
+                   Recorrencia.data_fim >= desde)
+        ).order_by(Recorrencia.id).limit(tamanho_pagina).all()
+
+        if not pagina:
+            return
+
+        for rec in pagina:
+            db.session.expunge(rec)
+            yield rec
+
+        ultimo_id = pagina[-1].id
+
+
+def gravar_lote_ocorrencias(linhas, proximas):
+    """Grava um lote de ocorrências, saldos e próximas ocorrências com um commit"""
+    inseridas = inserir_ocorrencias(linhas)
+    aplicar_transacoes_nos_bancos(inseridas)
+    if proximas:
+        db.session.execute(db.update(Recorrencia), proximas)
+    db.session.commit()
+    return len(inseridas)
+
+
+def processar_recorrencias_atrasadas(desde, ate=None, tamanho_lote=1000):
+    """
+    Modo catch-up: gera todas as ocorrências entre `desde` e `ate` (inclusive).
+
+    As ocorrências são geradas de forma preguiçosa pelo motor de regras e
+    gravadas em lotes de tamanho fixo, então um atraso de vários dias é
+    recuperado com memória limitada. Ocorrências já existentes são
+    ignoradas pelo livro (recorrencia_id, data).
+    """
+    ate = ate or date.today()
+    depois = ate + timedelta(days=1)
+
+    if desde > ate:
+        return 0
+
+    total_gerado = 0
+    linhas = []
+    proximas = []
+
+    for rec in recorrencias_em_paginas(desde, ate):
+        for data in ocorrencias_entre(rec, desde, ate):
+            linhas.append(dados_ocorrencia(
+                rec, data, descricao=f"[REC] {rec.descricao}"))
+
+            if len(linhas) >= tamanho_lote:
+                total_gerado += gravar_lote_ocorrencias(linhas, proximas)
+                linhas, proximas = [], []
+
+        proximas.append({'id': rec.id,
+                         'proxima_ocorrencia': proxima_ocorrencia(rec, depois)})
+
+    total_gerado += gravar_lote_ocorrencias(linhas, proximas)
+    return total_gerado
+
+
+def ultima_execucao_recorrencias():
+    """Data de referência da última execução registrada (marca d'água)"""
+    return db.session.query(
+        func.max(ExecucaoRecorrencia.data_referencia)).scalar()
+
+
+recorrencias_cli = AppGroup(
+    'recorrencias', help='Processamento das transações recorrentes.')
+
+
+@recorrencias_cli.command('run')
+@click.option('--data', 'data_str', default=None,
+              help='Data de referência (AAAA-MM-DD). Padrão: hoje.')
+@click.option('--catch-up', 'catch_up', is_flag=True,
+              help='Gera também as ocorrências perdidas desde a última execução.')
+@click.option('--desde', 'desde_str', default=None,
+              help='Início do catch-up (AAAA-MM-DD). Padrão: dia seguinte à última execução.')
+@click.option('--lote', 'tamanho_lote', default=1000, show_default=True,
+              help='Quantidade de transações gravadas por commit no catch-up.')
+def recorrencias_run(data_str, catch_up, desde_str, tamanho_lote):
+    """Gera as transações das recorrências que vencem na data."""
+    hoje = datetime.strptime(
+        data_str, '%Y-%m-%d').date() if data_str else date.today()
 
-            db.session.add(nova_transacao)
-            print(f"✅ Recorrência processada: {rec.descricao} ({hoje})")
+    inicio = time.perf_counter()
 
+    if catch_up or desde_str:
+        if desde_str:
+            desde = datetime.strptime(desde_str, '%Y-%m-%d').date()
+        else:
+            ultima = ultima_execucao_recorrencias()
+            desde = ultima + timedelta(days=1) if ultima else hoje
+
+        modo = 'catch-up'
+        click.echo(
+            f"🔄 Catch-up de {desde.strftime('%d/%m/%Y')} até {hoje.strftime('%d/%m/%Y')}...")
+        gerados = processar_recorrencias_atrasadas(desde, hoje, tamanho_lote)
+    else:
+        modo = 'diario'
+        gerados = processar_recorrencias(hoje)
+
+    duracao = time.perf_counter() - inicio
+
+    db.session.add(ExecucaoRecorrencia(
+        data_referencia=hoje,
+        modo=modo,
+        transacoes_geradas=gerados,
+        duracao_segundos=duracao
+    ))
     db.session.commit()
 
+    click.echo(
+        f"✅ Recorrências processadas para {hoje.strftime('%d/%m/%Y')}: "
+        f"{gerados} transações geradas em {duracao:.2f}s")
+
+
+app.cli.add_command(recorrencias_cli)
+
+# ===== FIM DO PROCESSAMENTO DE RECORRÊNCIAS =====
+
+# ===== ROTAS PRINCIPAIS =====
+
+
+@app.route('/')
+def index():
+    """Redireciona para o dashboard"""
+    return redirect(url_for('home'))
+
 
 @app.route('/home', methods=['GET'])
 @login_required
 def home():
     """Página inicial com resumo financeiro"""
 
-    # ✅ Processar recorrências antes de mostrar o dashboard
-    processar_recorrencias()
+    # ✅ Totais calculados no banco (SUM/COUNT agrupados), sem carregar o histórico
+    resumo = resumo_dashboard(current_user.id)
+    saldo_bancos = saldo_total_bancos(current_user.id)
 
-    transacoes = Transacao.query.filter_by(usuario_id=current_user.id).all()
+    saldo_total = saldo_bancos + resumo['saldo_carteira']
 
-    # ✅ BUG 4 FIX: NÃO contar transações de CARTÃO no total de receitas/despesas
-    # Apenas contar transações de BANCO
-    total_receitas = sum(t.valor for t in transacoes if t.tipo ==
-                         'Receita' and t.forma_pagamento != 'Cartão de Crédito')
-    total_despesas = sum(t.valor for t in transacoes if t.tipo ==
-                         'Despesa' and t.forma_pagamento != 'Cartão de Crédito')
+    return render_template('index.html',
+                           total_receitas=resumo['total_receitas'],
+                           total_despesas=resumo['total_despesas'],
+                           saldo=saldo_total,
+                           quantidade_transacoes=resumo['quantidade_transacoes'])
+
+
+@app.route('/transacoes')
+@login_required
+def lista_transacoes():
+    cursor = request.args.get('cursor')
+    por_pagina = ler_por_pagina()
+    filtros = ler_filtros_transacoes(request.args)
 
+    transacoes, resumo, proximo_cursor = buscar_transacoes(
+        current_user.id, filtros, cursor, por_pagina)
+
+    categorias = Categoria.query.filter_by(
+        usuario_id=current_user.id).order_by(Categoria.nome).all()
     bancos = Banco.query.filter_by(usuario_id=current_user.id).all()
-    saldo_bancos = sum(banco.saldo for banco in bancos)
 
-    # ✅ BUG 4 FIX: Carteira = apenas transações sem banco_id E que NÃO sejam cartão
-    transacoes_carteira = Transacao.query.filter_by(
-        usuario_id=current_user.id, banco_id=None).all()
-    # Excluir transações de CARTÃO DE CRÉDITO
-    transacoes_carteira = [
-        t for t in transacoes_carteira if t.forma_pagamento != 'Cartão de Crédito']
+    return render_template('transacoes.html',
+                           transacoes=transacoes,
+                           resumo=resumo,
+                           filtros=filtros,
+                           categorias=categorias,
+                           bancos=bancos,
+                           cursor=cursor,
+                           proximo_cursor=proximo_cursor,
+                           por_pagina=por_pagina)
 
-    receitas_carteira = sum(
-        t.valor for t in transacoes_carteira if t.tipo == 'Receita')
-    despesas_carteira = sum(
-        t.valor for t in transacoes_carteira if t.tipo == 'Despesa')
-    saldo_carteira = receitas_carteira - despesas_carteira
 
-    saldo_total = saldo_bancos + saldo_carteira
-    quantidade_transacoes = len(transacoes)
+@app.route('/api/transacoes', methods=['GET'])
+@login_required
+def api_transacoes():
+    """Busca de transações em JSON (mesmos filtros de /transacoes)"""
+    cursor = request.args.get('cursor')
+    por_pagina = ler_por_pagina()
+    filtros = ler_filtros_transacoes(request.args)
 
-    return render_template('index.html',
-                           total_receitas=total_receitas,
-                           total_despesas=total_despesas,
-                           saldo=saldo_total,
-                           quantidade_transacoes=quantidade_transacoes)
+    transacoes, resumo, proximo_cursor = buscar_transacoes(
+        current_user.id, filtros, cursor, por_pagina)
 
+    return jsonify({
+        'transacoes': [transacao_para_dict(t) for t in transacoes],
+        'resumo': resumo,
+        'filtros': filtros,
+        'proximo_cursor': proximo_cursor
+    })
 
-@app.route('/transacoes')
+
+@app.route('/api/busca', methods=['GET'])
 @login_required
-def lista_transacoes():
-    transacoes = Transacao.query.filter_by(usuario_id=current_user.id).all()
-    return render_template('transacoes.html', transacoes=transacoes)
+def api_busca():
+    """Busca textual ranqueada em transações, compras no cartão e movimentações"""
+    consulta = request.args.get('q', '')
+    limite = request.args.get('limite', LIMITE_PADRAO, type=int)
+
+    return jsonify({
+        'consulta': consulta,
+        'resultados': buscar_descricoes(current_user.id, consulta, limite)
+    })
 
 
 @app.route('/adicionar', methods=['GET', 'POST'])
@@ -839,7 +1259,8 @@ def adicionar():
                     tipo_movimento='saida',
                     valor=valor,
                     descricao=f'Despesa: {descricao}',
-                    data=data
+                    data=data,
+                    transacao_id=nova_transacao.id
                 )
                 db.session.add(movimento)
 
@@ -852,7 +1273,8 @@ def adicionar():
                     tipo_movimento='entrada',
                     valor=valor,
                     descricao=f'Receita: {descricao}',
-                    data=data
+                    data=data,
+                    transacao_id=nova_transacao.id
                 )
                 db.session.add(movimento)
 
@@ -898,21 +1320,12 @@ def adicionar():
                 forma_pagamento=forma_pagamento
             )
             db.session.add(nova_compra)
+            nova_transacao.compra_cartao = nova_compra
             db.session.flush()  # ✅ Garantir que a compra seja salva
 
-            # ✅ CRIAR/ATUALIZAR A FATURA
-            fatura = criar_ou_atualizar_fatura(
-                usuario_id=current_user.id,
-                cartao_id=cartao_id,
-                data_compra=data,
-                valor=valor
-            )
-
-            if fatura:
-                print(
-                    f"✅ Fatura criada para compra: {fatura.mes:02d}/{fatura.ano}")
-            else:
-                print(f"❌ Erro ao criar fatura para a compra!")
+            # ✅ LANÇAR AS PARCELAS NAS FATURAS
+            lancar_parcelas(cartao, [nova_compra])
+            print(f"✅ {nova_compra.quantidade_parcelas} parcela(s) lançada(s) nas faturas")
 
         db.session.commit()
         return redirect(url_for('lista_transacoes'))
@@ -931,7 +1344,6 @@ def editar(id):
             # ✅ Guardar valores antigos para sincronização
             valor_antigo = transacao.valor
             forma_pagamento_antiga = transacao.forma_pagamento
-            data_antiga = transacao.data
 
             # Atualizar transação
             transacao.descricao = request.form.get('descricao')
@@ -959,47 +1371,13 @@ def editar(id):
                 if forma_pagamento_antiga == 'Cartão de Crédito' and transacao.forma_pagamento != 'Cartão de Crédito':
                     print(f"   ❌ Removendo de Compras do Cartão...")
 
-                    compra = CompraCartao.query.filter_by(
-                        usuario_id=transacao.usuario_id,
-                        descricao=transacao.descricao,
-                        data_compra=data_antiga
-                    ).first()
+                    compra = transacao.compra_cartao
 
                     if compra:
                         print(f"   ✅ Compra encontrada, deletando...")
-                        valor_compra = compra.valor_total
-                        cartao_id = compra.cartao_id
-
-                        # Atualizar fatura
-                        cartao = CartaoCredito.query.get(cartao_id)
-                        if cartao:
-                            if compra.data_compra.day <= cartao.dia_fechamento:
-                                mes_fatura = compra.data_compra.month
-                                ano_fatura = compra.data_compra.year
-                            else:
-                                if compra.data_compra.month == 12:
-                                    mes_fatura = 1
-                                    ano_fatura = compra.data_compra.year + 1
-                                else:
-                                    mes_fatura = compra.data_compra.month + 1
-                                    ano_fatura = compra.data_compra.year
-
-                            fatura = FaturaCartao.query.filter_by(
-                                usuario_id=transacao.usuario_id,
-                                cartao_id=cartao_id,
-                                mes=mes_fatura,
-                                ano=ano_fatura
-                            ).first()
-
-                            if fatura:
-                                fatura.valor_total -= valor_compra
-                                fatura.valor_restante = fatura.valor_total - fatura.valor_pago
-
-                                if fatura.valor_total <= 0:
-                                    db.session.delete(fatura)
-
-                                db.session.commit()
-                                print(f"   ✅ Fatura atualizada!")
+
+                        # Retirar as parcelas das faturas
+                        estornar_parcelas(compra)
 
                         db.session.delete(compra)
                         db.session.commit()
@@ -1023,72 +1401,17 @@ def editar(id):
                             descricao=transacao.descricao,
                             valor_total=transacao.valor,
                             quantidade_parcelas=1,
-                            categoria=transacao.categoria,
+                            categoria_id=transacao.categoria_id,
                             data_compra=transacao.data,
                             forma_pagamento='Cartão de Crédito',  # ✅ ADICIONAR FORMA DE PAGAMENTO!
                             status='pendente'
                         )
                         db.session.add(nova_compra)
-                        db.session.commit()
+                        transacao.compra_cartao = nova_compra
+                        db.session.flush()
 
-                        # Atualizar/Criar fatura
-                        if transacao.data.day <= cartao.dia_fechamento:
-                            mes_fatura = transacao.data.month
-                            ano_fatura = transacao.data.year
-                        else:
-                            if transacao.data.month == 12:
-                                mes_fatura = 1
-                                ano_fatura = transacao.data.year + 1
-                            else:
-                                mes_fatura = transacao.data.month + 1
-                                ano_fatura = transacao.data.year
-
-                        fatura = FaturaCartao.query.filter_by(
-                            usuario_id=transacao.usuario_id,
-                            cartao_id=cartao.id,
-                            mes=mes_fatura,
-                            ano=ano_fatura
-                        ).first()
-
-                        if not fatura:
-                            # ✅ Calcular data de fechamento baseada no cartão
-                            if mes_fatura == 12:
-                                proximo_mes = 1
-                                proximo_ano = ano_fatura + 1
-                            else:
-                                proximo_mes = mes_fatura + 1
-                                proximo_ano = ano_fatura
-
-                            try:
-                                data_fechamento = datetime(
-                                    proximo_ano, proximo_mes, cartao.dia_fechamento).date()
-                            except:
-                                # Se dia não existe no mês, usar último dia do mês
-                                if proximo_mes == 2:
-                                    data_fechamento = datetime(
-                                        proximo_ano, 3, 1).date() - timedelta(days=1)
-                                else:
-                                    data_fechamento = datetime(
-                                        proximo_ano, proximo_mes + 1, 1).date() - timedelta(days=1)
-
-                            fatura = FaturaCartao(
-                                usuario_id=transacao.usuario_id,
-                                cartao_id=cartao.id,
-                                mes=mes_fatura,
-                                ano=ano_fatura,
-                                valor_total=transacao.valor,
-                                valor_pago=0,
-                                valor_restante=transacao.valor,
-                                data_fechamento=data_fechamento,
-                                data_vencimento=data_fechamento +
-                                # Vencimento 10 dias depois
-                                timedelta(days=10),
-                                status='aberta'
-                            )
-                            db.session.add(fatura)
-                        else:
-                            fatura.valor_total += transacao.valor
-                            fatura.valor_restante = fatura.valor_total - fatura.valor_pago
+                        # Lançar as parcelas nas faturas
+                        lancar_parcelas(cartao, [nova_compra])
 
                         db.session.commit()
                         print(f"   ✅ Compra criada e fatura atualizada!")
@@ -1109,43 +1432,18 @@ def editar(id):
                         f"✏️ Editando transação de cartão: {transacao.descricao}")
                     print(f"   Diferença: R$ {diferenca:.2f}")
 
-                    compra = CompraCartao.query.filter_by(
-                        usuario_id=transacao.usuario_id,
-                        descricao=transacao.descricao,
-                        data_compra=data_antiga
-                    ).first()
+                    compra = transacao.compra_cartao
 
                     if compra:
+                        # Estornar as parcelas antigas e relançar com o novo valor
+                        estornar_parcelas(compra)
                         compra.valor_total = valor_novo
                         compra.data_compra = transacao.data
-                        db.session.commit()
+                        db.session.flush()
 
-                        cartao = CartaoCredito.query.get(compra.cartao_id)
-
-                        if cartao:
-                            if compra.data_compra.day <= cartao.dia_fechamento:
-                                mes_fatura = compra.data_compra.month
-                                ano_fatura = compra.data_compra.year
-                            else:
-                                if compra.data_compra.month == 12:
-                                    mes_fatura = 1
-                                    ano_fatura = compra.data_compra.year + 1
-                                else:
-                                    mes_fatura = compra.data_compra.month + 1
-                                    ano_fatura = compra.data_compra.year
-
-                            fatura = FaturaCartao.query.filter_by(
-                                usuario_id=transacao.usuario_id,
-                                cartao_id=compra.cartao_id,
-                                mes=mes_fatura,
-                                ano=ano_fatura
-                            ).first()
-
-                            if fatura:
-                                fatura.valor_total += diferenca
-                                fatura.valor_restante = fatura.valor_total - fatura.valor_pago
-                                db.session.commit()
-                                print(f"✅ Fatura atualizada!")
+                        lancar_parcelas(compra.cartao, [compra])
+                        db.session.commit()
+                        print(f"✅ Fatura atualizada!")
 
             return redirect(url_for('lista_transacoes'))
 
@@ -1171,81 +1469,30 @@ def deletar(id):
     if transacao.forma_pagamento == 'Cartão de Crédito':
         print(f"🗑️ Deletando transação cartão: {transacao.descricao}")
 
-        # Procurar a CompraCartao relacionada
-        compra = CompraCartao.query.filter_by(
-            usuario_id=transacao.usuario_id,
-            descricao=transacao.descricao,
-            valor_total=transacao.valor,
-            data_compra=transacao.data
-        ).first()
+        # CompraCartao relacionada (pela chave compra_cartao_id)
+        compra = transacao.compra_cartao
 
         if compra:
             print(f"✅ Compra encontrada, atualizando fatura...")
-            valor_compra = compra.valor_total
-            cartao_id = compra.cartao_id
-
-            # ✅ ATUALIZAR A FATURA
-            cartao = CartaoCredito.query.get(cartao_id)
-
-            if cartao:
-                if compra.data_compra.day <= cartao.dia_fechamento:
-                    mes_fatura = compra.data_compra.month
-                    ano_fatura = compra.data_compra.year
-                else:
-                    if compra.data_compra.month == 12:
-                        mes_fatura = 1
-                        ano_fatura = compra.data_compra.year + 1
-                    else:
-                        mes_fatura = compra.data_compra.month + 1
-                        ano_fatura = compra.data_compra.year
-
-                # Procurar a fatura
-                fatura = FaturaCartao.query.filter_by(
-                    usuario_id=transacao.usuario_id,
-                    cartao_id=cartao_id,
-                    mes=mes_fatura,
-                    ano=ano_fatura
-                ).first()
-
-                if fatura:
-                    print(
-                        f"✅ Fatura encontrada: {mes_fatura:02d}/{ano_fatura}")
-                    print(f"   Valor anterior: R$ {fatura.valor_total}")
-
-                    # SUBTRAIR O VALOR DA FATURA
-                    fatura.valor_total -= valor_compra
-                    fatura.valor_restante = fatura.valor_total - fatura.valor_pago
-
-                    print(f"   Valor novo: R$ {fatura.valor_total}")
-
-                    # SE FATURA FICAR COM VALOR 0, DELETAR
-                    if fatura.valor_total <= 0:
-                        print(f"   Fatura com valor 0, deletando...")
-                        db.session.delete(fatura)
 
-                    print(f"✅ Fatura atualizada!")
+            # ✅ RETIRAR AS PARCELAS DAS FATURAS
+            estornar_parcelas(compra)
 
             # DELETAR A COMPRA
             db.session.delete(compra)
 
-    # ✅ Restaurar saldo do banco se transação tem banco_id
-    if transacao.banco_id:
-        banco = Banco.query.get(transacao.banco_id)
-        if banco:
-            # Se era SAÍDA, RESTAURA (adiciona de volta)
-            if transacao.tipo.lower() == 'saída' or transacao.tipo.lower() == 'despesa':
-                banco.saldo += transacao.valor
-                print(f"✅ Saldo restaurado ao deletar: +R$ {transacao.valor}")
-            # Se era ENTRADA, REMOVE (tira de volta)
-            elif transacao.tipo.lower() == 'entrada' or transacao.tipo.lower() == 'receita':
-                banco.saldo -= transacao.valor
-                print(f"✅ Saldo ajustado ao deletar: -R$ {transacao.valor}")
-            db.session.commit()
+    # ✅ Restaurar o saldo do banco e apagar a movimentação da transação
+    estornar_transacoes_nos_bancos([transacao])
 
     # ✅ Se transação tem recorrencia_id, deletar recorrência também
+    # (apenas se esta for a única ocorrência gerada por ela)
     if transacao.recorrencia_id:
         recorrencia = Recorrencia.query.get(transacao.recorrencia_id)
-        if recorrencia:
+        outras_ocorrencias = Transacao.query.filter(
+            Transacao.recorrencia_id == transacao.recorrencia_id,
+            Transacao.id != transacao.id
+        ).first()
+        if recorrencia and not outras_ocorrencias:
             print(f"✅ Deletando recorrência vinculada: {recorrencia.descricao}")
             db.session.delete(recorrencia)
 
@@ -1257,114 +1504,670 @@ def deletar(id):
 # ===== ROTAS DE RELATÓRIOS =====
 
 
+# Filtros que o resumo mensal também tem (as demais exigem ler as transações)
+FILTROS_DO_RESUMO = {'data_inicio', 'data_fim', 'categoria', 'tipo', 'forma_pagamento'}
+
+
+def indice_mes(dia):
+    """Mês como número contínuo (ano * 12 + mes - 1), para intervalos de meses"""
+    return dia.year * 12 + dia.month - 1
+
+
+def inicio_do_mes(indice):
+    return date(indice // 12, indice % 12 + 1, 1)
+
+
+def meses_inteiros_do_periodo(filtros):
+    """
+    Divide o período dos filtros em meses inteiros e pontas.
+
+    Retorna ((primeiro, último), pontas): o primeiro e o último mês
+    inteiramente dentro do período, como indice_mes (None num lado sem
+    limite), e a condição de data de cada mês incompleto nas pontas.
+    Se nenhum mês inteiro couber no período, retorna None.
+    """
+    try:
+        inicio = datetime.strptime(filtros['data_inicio'], '%Y-%m-%d').date() \
+            if 'data_inicio' in filtros else None
+        fim = datetime.strptime(filtros['data_fim'], '%Y-%m-%d').date() \
+            if 'data_fim' in filtros else None
+    except ValueError:
+        abort(400)
+
+    primeiro = None if inicio is None else (
+        indice_mes(inicio) + (0 if inicio.day == 1 else 1))
+    ultimo = None if fim is None else (
+        indice_mes(fim) - (0 if fim.day == monthrange(fim.year, fim.month)[1] else 1))
+
+    if primeiro is not None and ultimo is not None and primeiro > ultimo:
+        return None
+
+    pontas = []
+    if inicio is not None and inicio.day != 1:
+        pontas.append(Transacao.data < inicio_do_mes(primeiro))
+    if fim is not None and ultimo < indice_mes(fim):
+        pontas.append(Transacao.data >= inicio_do_mes(ultimo + 1))
+    return (primeiro, ultimo), pontas
+
+
+def totais_categoria_tipo(usuario_id, filtros):
+    """
+    [(categoria, tipo, soma, quantidade)] do período filtrado.
+
+    Os meses inteiros do período vêm do resumo mensal (poucas linhas por
+    mês); só as pontas (meses incompletos) são somadas das transações.
+    Filtros que o resumo não tem (banco, busca) somam tudo das transações.
+    """
+    condicoes = condicoes_filtro_transacoes(usuario_id, filtros)
+    divisao = meses_inteiros_do_periodo(filtros) \
+        if FILTROS_DO_RESUMO.issuperset(filtros) else None
+
+    def somar_transacoes(*extra):
+        return db.session.query(
+            Transacao.categoria_id, Transacao.tipo,
+            func.sum(Transacao.valor), func.count(Transacao.id)
+        ).filter(*condicoes, *extra).group_by(
+            Transacao.categoria_id, Transacao.tipo)
+
+    if divisao is None:
+        consultas = [somar_transacoes()]
+    else:
+        (primeiro, ultimo), pontas = divisao
+        mes_resumo = ResumoMensal.ano * 12 + ResumoMensal.mes - 1
+        condicoes_resumo = [ResumoMensal.usuario_id == usuario_id]
+        if primeiro is not None:
+            condicoes_resumo.append(mes_resumo >= primeiro)
+        if ultimo is not None:
+            condicoes_resumo.append(mes_resumo <= ultimo)
+        if 'categoria' in filtros:
+            condicoes_resumo.append(ResumoMensal.categoria_id.in_(
+                db.select(Categoria.id).where(
+                    Categoria.usuario_id == usuario_id,
+                    Categoria.nome == filtros['categoria'])))
+        if 'tipo' in filtros:
+            condicoes_resumo.append(ResumoMensal.tipo == filtros['tipo'])
+        if 'forma_pagamento' in filtros:
+            condicoes_resumo.append(
+                ResumoMensal.forma_pagamento == filtros['forma_pagamento'])
+
+        consultas = [db.session.query(
+            ResumoMensal.categoria_id, ResumoMensal.tipo,
+            func.sum(ResumoMensal.total), func.sum(ResumoMensal.quantidade)
+        ).filter(*condicoes_resumo).group_by(
+            ResumoMensal.categoria_id, ResumoMensal.tipo)]
+
+        # Uma consulta por ponta, cada uma num intervalo do índice de datas
+        consultas += [somar_transacoes(ponta) for ponta in pontas]
+
+    somados = {}
+    for consulta in consultas:
+        for categoria_id, tipo, soma, quantidade in consulta:
+            total, qtd = somados.get((categoria_id, tipo), (0, 0))
+            somados[(categoria_id, tipo)] = (total + soma, qtd + quantidade)
+
+    nomes = dict(db.session.query(Categoria.id, Categoria.nome).filter(
+        Categoria.usuario_id == usuario_id))
+    return sorted((nomes.get(categoria_id, CATEGORIA_PADRAO), tipo, soma, quantidade)
+                  for (categoria_id, tipo), (soma, quantidade) in somados.items())
+
+
+def series_relatorio(usuario_id, filtros):
+    """
+    Totais e séries dos gráficos do relatório, calculados no banco.
+
+    Os totais por categoria × tipo vêm de totais_categoria_tipo (resumo
+    mensal + pontas do período) e a série diária de um GROUP BY data, tipo
+    servido pelo índice de cobertura (usuario_id, data, tipo, categoria_id,
+    valor), já na ordem das datas. Nada é reordenado em Python.
+    """
+    por_categoria = totais_categoria_tipo(usuario_id, filtros)
+
+    por_dia = db.session.query(
+        Transacao.data, Transacao.tipo, func.sum(Transacao.valor)
+    ).filter(
+        *condicoes_filtro_transacoes(usuario_id, filtros)
+    ).group_by(
+        Transacao.data, Transacao.tipo
+    ).order_by(Transacao.data).all()
+
+    total_receitas = total_despesas = Decimal('0.00')
+    quantidade_transacoes = 0
+    categoria_totais = {}
+
+    for nome, tipo, soma, quantidade in por_categoria:
+        quantidade_transacoes += quantidade
+        if tipo == 'Receita':
+            total_receitas += soma
+        elif tipo == 'Despesa':
+            total_despesas += soma
+
+        # Nos gráficos, tudo que não é receita conta como despesa
+        totais = categoria_totais.setdefault(nome, {'receita': 0, 'despesa': 0})
+        totais['receita' if tipo == 'Receita' else 'despesa'] += soma
+
+    dias_totais = {}
+    for dia, tipo, soma in por_dia:
+        totais = dias_totais.setdefault(dia, {'receita': 0, 'despesa': 0})
+        totais['receita' if tipo == 'Receita' else 'despesa'] += soma
+
+    return {
+        'total_receitas': total_receitas,
+        'total_despesas': total_despesas,
+        'saldo': total_receitas - total_despesas,
+        'quantidade_transacoes': quantidade_transacoes,
+        'grafico_pizza': {
+            'labels': ['Receitas', 'Despesas'],
+            'valores': [total_receitas, total_despesas],
+            'cores': ['#10b981', '#ef4444']
+        },
+        'grafico_barras': {
+            'labels': list(categoria_totais),
+            'receitas': [t['receita'] for t in categoria_totais.values()],
+            'despesas': [t['despesa'] for t in categoria_totais.values()]
+        },
+        'grafico_linha': {
+            'labels': [dia.strftime('%d/%m/%Y') for dia in dias_totais],
+            'receitas': [t['receita'] for t in dias_totais.values()],
+            'despesas': [t['despesa'] for t in dias_totais.values()]
+        },
+    }
+
+
 @app.route('/relatorios', methods=['GET', 'POST'])
 @login_required
 def relatorios():
-    data_inicio = request.args.get(
-        'data_inicio') or request.form.get('data_inicio')
-    data_fim = request.args.get('data_fim') or request.form.get('data_fim')
-    categoria_filtro = request.args.get(
-        'categoria') or request.form.get('categoria')
-    tipo_filtro = request.args.get('tipo') or request.form.get('tipo')
+    """
+    Página dos relatórios: só o formulário de filtros. Os totais, os
+    gráficos e a tabela são buscados em paralelo pela página em
+    /api/relatorios/series e /api/relatorios/transacoes.
+    """
+    filtros = ler_filtros_transacoes(request.values)
 
-    query = Transacao.query.filter_by(usuario_id=current_user.id)
+    return render_template('relatorios.html',
+                           data_inicio=filtros.get('data_inicio'),
+                           data_fim=filtros.get('data_fim'),
+                           categoria_selecionada=filtros.get('categoria'),
+                           tipo_selecionado=filtros.get('tipo'),
+                           categorias=nomes_categorias(current_user.id),
+                           filtros=filtros)
 
-    if data_inicio:
-        data_inicio_obj = datetime.strptime(data_inicio, '%Y-%m-%d').date()
-        query = query.filter(Transacao.data >= data_inicio_obj)
 
-    if data_fim:
-        data_fim_obj = datetime.strptime(data_fim, '%Y-%m-%d').date()
-        query = query.filter(Transacao.data <= data_fim_obj)
+@app.route('/api/relatorios/series', methods=['GET'])
+@login_required
+def api_relatorios_series():
+    """Totais e dados dos gráficos do relatório (mesmos filtros de /relatorios)"""
+    filtros = ler_filtros_transacoes(request.args)
+    series = em_cache('series_relatorio', current_user.id, filtros,
+                      lambda: series_relatorio(current_user.id, filtros))
+    return jsonify(filtros=filtros, **series)
 
-    if categoria_filtro and categoria_filtro != 'Todas':
-        query = query.filter(Transacao.categoria == categoria_filtro)
 
-    if tipo_filtro and tipo_filtro != 'Todos':
-        query = query.filter(Transacao.tipo == tipo_filtro)
+@app.route('/api/relatorios/transacoes', methods=['GET'])
+@login_required
+def api_relatorios_transacoes():
+    """Página (keyset) das transações do relatório, da mais recente para a mais antiga"""
+    cursor = request.args.get('cursor')
+    por_pagina = ler_por_pagina()
+    filtros = ler_filtros_transacoes(request.args)
 
-    transacoes = query.order_by(Transacao.data.desc()).all()
+    query = Transacao.query.options(
+        db.joinedload(Transacao.categoria_modelo)
+    ).filter(*condicoes_filtro_transacoes(current_user.id, filtros))
+    transacoes, proximo_cursor = paginar_transacoes(query, cursor, por_pagina)
 
-    total_receitas = sum(t.valor for t in transacoes if t.tipo == 'Receita')
-    total_despesas = sum(t.valor for t in transacoes if t.tipo == 'Despesa')
-    saldo = total_receitas - total_despesas
-    quantidade_transacoes = len(transacoes)
+    return jsonify({
+        'transacoes': [transacao_para_dict(t) for t in transacoes],
+        'filtros': filtros,
+        'proximo_cursor': proximo_cursor
+    })
 
-    todas_as_categorias = db.session.query(Transacao.categoria).filter_by(
-        usuario_id=current_user.id).distinct().all()
-    categorias = sorted([cat[0] for cat in todas_as_categorias])
 
-    grafico_pizza = {
-        'labels': ['Receitas', 'Despesas'],
-        'valores': [total_receitas, total_despesas],
-        'cores': ['#10b981', '#ef4444']
-    }
+@app.route('/relatorios/tendencias', methods=['GET'])
+@login_required
+def tendencias():
+    """Página das tendências de vários anos (dados em /api/relatorios/tendencias)"""
+    anos = request.args.get('anos', ANOS_PADRAO, type=int)
+    return render_template('tendencias.html',
+                           anos=max(1, min(anos, ANOS_MAXIMO)),
+                           anos_maximo=ANOS_MAXIMO)
 
-    categoria_totais = {}
-    for transacao in transacoes:
-        if transacao.categoria not in categoria_totais:
-            categoria_totais[transacao.categoria] = {
-                'receita': 0, 'despesa': 0}
 
-        if transacao.tipo == 'Receita':
-            categoria_totais[transacao.categoria]['receita'] += transacao.valor
-        else:
-            categoria_totais[transacao.categoria]['despesa'] += transacao.valor
-
-    categorias_labels = list(categoria_totais.keys())
-    categorias_receitas = [categoria_totais[cat]['receita']
-                           for cat in categorias_labels]
-    categorias_despesas = [categoria_totais[cat]['despesa']
-                           for cat in categorias_labels]
-
-    grafico_barras = {
-        'labels': categorias_labels,
-        'receitas': categorias_receitas,
-        'despesas': categorias_despesas
-    }
+@app.route('/api/relatorios/tendencias', methods=['GET'])
+@login_required
+def api_relatorios_tendencias():
+    """Variações, médias móveis por categoria e taxa de poupança mês a mês"""
+    anos = request.args.get('anos', ANOS_PADRAO, type=int)
+    hoje = date.today()
 
-    dias_totais = {}
-    for transacao in transacoes:
-        data_str = transacao.data.strftime('%d/%m/%Y')
-        if data_str not in dias_totais:
-            dias_totais[data_str] = {'receita': 0, 'despesa': 0}
+    # A janela anda com o mês atual, então ele também faz parte da chave
+    return jsonify(em_cache(
+        'tendencias', current_user.id,
+        {'anos': anos, 'ano': hoje.year, 'mes': hoje.month},
+        lambda: calcular_tendencias(current_user.id, anos, hoje)))
 
-        if transacao.tipo == 'Receita':
-            dias_totais[data_str]['receita'] += transacao.valor
-        else:
-            dias_totais[data_str]['despesa'] += transacao.valor
+# ===== EXPORTAÇÃO (CSV / OFX) =====
+
+FORMATOS_EXPORTACAO = {
+    'csv': 'text/csv; charset=utf-8',
+    'ofx': 'application/x-ofx',
+}
 
-    dias_ordenados = sorted(dias_totais.items(),
-                            key=lambda x: datetime.strptime(x[0], '%d/%m/%Y'))
 
-    dias_labels = [item[0] for item in dias_ordenados]
-    dias_receitas = [item[1]['receita'] for item in dias_ordenados]
-    dias_despesas = [item[1]['despesa'] for item in dias_ordenados]
+def condicoes_filtro_movimentacoes(usuario_id, filtros):
+    """Condições WHERE das movimentações bancárias (período e banco)"""
+    condicoes = [MovimentacaoBanco.banco_id == Banco.id,
+                 Banco.usuario_id == usuario_id]
+
+    try:
+        if 'data_inicio' in filtros:
+            condicoes.append(MovimentacaoBanco.data >= datetime.strptime(
+                filtros['data_inicio'], '%Y-%m-%d').date())
+        if 'data_fim' in filtros:
+            condicoes.append(MovimentacaoBanco.data < datetime.strptime(
+                filtros['data_fim'], '%Y-%m-%d').date() + timedelta(days=1))
+        if 'banco_id' in filtros:
+            condicoes.append(Banco.id == int(filtros['banco_id']))
+    except ValueError:
+        abort(400)
 
-    grafico_linha = {
-        'labels': dias_labels,
-        'receitas': dias_receitas,
-        'despesas': dias_despesas
+    return condicoes
+
+
+def periodo_exportacao(coluna_data, condicoes):
+    """Primeira e última data do conjunto exportado (para o cabeçalho OFX)"""
+    inicio, fim = db.session.query(
+        func.min(coluna_data), func.max(coluna_data)).filter(*condicoes).one()
+    hoje = date.today()
+    return inicio or hoje, fim or hoje
+
+
+def exportacao_transacoes(usuario_id, filtros, formato):
+    condicoes = condicoes_filtro_transacoes(usuario_id, filtros)
+    stmt = db.select(
+        Transacao.id, Transacao.data, Transacao.descricao,
+        Categoria.nome.label('categoria'), Transacao.tipo,
+        Transacao.forma_pagamento, Transacao.valor, Banco.nome
+    ).join(Categoria, Transacao.categoria_id == Categoria.id).outerjoin(
+        Banco, Transacao.banco_id == Banco.id).where(
+        *condicoes).order_by(Transacao.data, Transacao.id)
+
+    if formato == 'csv':
+        return gerar_csv(
+            ['Data', 'Descrição', 'Categoria', 'Tipo', 'Forma de Pagamento',
+             'Valor', 'Banco'],
+            ([t.data.strftime('%d/%m/%Y'), t.descricao, t.categoria, t.tipo,
+              t.forma_pagamento, formatar_valor(t.valor), t.nome or '']
+             for t in linhas_em_streaming(stmt)))
+
+    inicio, fim = periodo_exportacao(Transacao.data, condicoes)
+    return gerar_ofx(
+        ((f'T{t.id}', t.data,
+          t.valor if t.tipo == 'Receita' else -t.valor, t.descricao)
+         for t in linhas_em_streaming(stmt)),
+        inicio, fim, conta='TRANSACOES')
+
+
+def exportacao_movimentacoes(usuario_id, filtros, formato):
+    condicoes = condicoes_filtro_movimentacoes(usuario_id, filtros)
+    stmt = db.select(
+        MovimentacaoBanco.id, MovimentacaoBanco.data,
+        MovimentacaoBanco.descricao, MovimentacaoBanco.tipo_movimento,
+        MovimentacaoBanco.valor, Banco.nome
+    ).where(*condicoes).order_by(MovimentacaoBanco.data, MovimentacaoBanco.id)
+
+    if formato == 'csv':
+        return gerar_csv(
+            ['Data', 'Banco', 'Movimento', 'Descrição', 'Valor'],
+            ([m.data.strftime('%d/%m/%Y'), m.nome, m.tipo_movimento,
+              m.descricao, formatar_valor(m.valor)]
+             for m in linhas_em_streaming(stmt)))
+
+    conta = 'BANCOS'
+    if 'banco_id' in filtros:
+        banco = Banco.query.filter_by(
+            id=int(filtros['banco_id']), usuario_id=usuario_id).first()
+        conta = banco.nome if banco else conta
+
+    inicio, fim = periodo_exportacao(MovimentacaoBanco.data, condicoes)
+    return gerar_ofx(
+        ((f'M{m.id}', m.data,
+          m.valor if m.tipo_movimento == 'entrada' else -m.valor, m.descricao)
+         for m in linhas_em_streaming(stmt)),
+        inicio, fim, conta=conta)
+
+
+@app.route('/relatorios/exportar/<formato>', methods=['GET'])
+@login_required
+def exportar_relatorio(formato):
+    """
+    Exporta transações (padrão) ou movimentações bancárias
+    (?origem=movimentacoes) com os mesmos filtros de /relatorios.
+    A resposta é enviada em streaming, sem carregar tudo na memória.
+    """
+    if formato not in FORMATOS_EXPORTACAO:
+        abort(404)
+
+    origem = request.args.get('origem', 'transacoes')
+    filtros = ler_filtros_transacoes(request.args)
+
+    if origem == 'transacoes':
+        conteudo = exportacao_transacoes(current_user.id, filtros, formato)
+    elif origem == 'movimentacoes':
+        conteudo = exportacao_movimentacoes(current_user.id, filtros, formato)
+    else:
+        abort(400)
+
+    nome_arquivo = f'{origem}_{date.today():%Y%m%d}.{formato}'
+    return Response(
+        stream_with_context(conteudo),
+        mimetype=FORMATOS_EXPORTACAO[formato],
+        headers={'Content-Disposition':
+                 f'attachment; filename="{nome_arquivo}"'})
+
+# ===== FIM DA EXPORTAÇÃO =====
+
+# ===== RELATÓRIOS EM ARQUIVO (FILA) =====
+
+def tarefa_para_dict(tarefa):
+    """Situação de uma tarefa de relatório em JSON"""
+    return {
+        'id': tarefa.id,
+        'tipo': tarefa.tipo,
+        'formato': tarefa.formato,
+        'parametros': tarefa.parametros,
+        'status': tarefa.status,
+        'tentativas': tarefa.tentativas,
+        'erro': tarefa.erro,
+        'criada_em': tarefa.criada_em.isoformat() if tarefa.criada_em else None,
+        'download': url_for('baixar_relatorio_arquivo', id=tarefa.id)
+        if tarefa.status == 'concluida' else None
     }
 
-    return render_template('relatorios.html',
-                           transacoes=transacoes,
-                           total_receitas=total_receitas,
-                           total_despesas=total_despesas,
-                           saldo=saldo,
-                           quantidade_transacoes=quantidade_transacoes,
-                           data_inicio=data_inicio,
-                           data_fim=data_fim,
-                           categoria_selecionada=categoria_filtro,
-                           tipo_selecionado=tipo_filtro,
-                           categorias=categorias,
-                           grafico_pizza=grafico_pizza,
-                           grafico_barras=grafico_barras,
-                           grafico_linha=grafico_linha)
+
+def buscar_tarefa_do_usuario(id):
+    return TarefaRelatorio.query.filter_by(
+        id=id, usuario_id=current_user.id).first_or_404()
+
+
+@app.route('/relatorios/arquivos', methods=['GET', 'POST'])
+@login_required
+def relatorios_arquivos():
+    """
+    Pede um extrato anual em PDF/XLSX. A requisição só enfileira a tarefa;
+    o arquivo é gerado pelo `flask worker` e a página acompanha a situação.
+    """
+    if request.method == 'POST':
+        ano = request.form.get('ano', type=int)
+        formato = request.form.get('formato')
+        if not ano or formato not in FORMATOS_TAREFA:
+            flash('❌ Informe o ano e o formato do extrato.', 'danger')
+            return redirect(url_for('relatorios_arquivos'))
+
+        enfileirar(current_user.id, 'extrato_anual', formato, {'ano': ano})
+        db.session.commit()
+        flash(f'⏳ Extrato de {ano} ({formato.upper()}) na fila. '
+              'Ele aparece aqui para download quando ficar pronto.', 'info')
+        return redirect(url_for('relatorios_arquivos'))
+
+    tarefas = TarefaRelatorio.query.filter_by(usuario_id=current_user.id).order_by(
+        TarefaRelatorio.criada_em.desc(), TarefaRelatorio.id.desc()).limit(20).all()
+
+    return render_template('relatorios_arquivos.html',
+                           tarefas=[tarefa_para_dict(t) for t in tarefas],
+                           ano_atual=date.today().year,
+                           formatos=FORMATOS_TAREFA)
+
+
+@app.route('/api/relatorios/tarefas/<int:id>', methods=['GET'])
+@login_required
+def api_relatorio_tarefa(id):
+    """Situação da tarefa (para a página consultar até ficar pronta)"""
+    return jsonify(tarefa_para_dict(buscar_tarefa_do_usuario(id)))
+
+
+@app.route('/relatorios/arquivos/<int:id>/download', methods=['GET'])
+@login_required
+def baixar_relatorio_arquivo(id):
+    tarefa = buscar_tarefa_do_usuario(id)
+    if tarefa.status != 'concluida':
+        abort(404)
+
+    partes = partes_do_arquivo(tarefa)
+    if partes is None:
+        # Arquivo perdido (ou de antes de ficar no banco): gerar de novo
+        devolver_a_fila(tarefa)
+        db.session.commit()
+        abort(404)
+
+    return Response(
+        stream_with_context(partes),
+        mimetype=FORMATOS_TAREFA[tarefa.formato],
+        headers={'Content-Disposition':
+                 f'attachment; filename="{nome_arquivo(tarefa)}"'})
+
+# ===== FIM DOS RELATÓRIOS EM ARQUIVO =====
+
+# ===== IMPORTAÇÃO DE EXTRATOS (CSV / OFX) =====
+
+LEITORES_EXTRATO = {
+    'csv': ler_csv,
+    'ofx': ler_ofx,
+}
+
+# Quantas mensagens de erro de linha são mostradas ao usuário
+MAXIMO_ERROS_EXIBIDOS = 20
+
+
+def gravar_lote_importacao(linhas, cartao=None):
+    """
+    Grava um lote de linhas importadas.
+
+    Um INSERT ... ON CONFLICT DO NOTHING descarta as linhas cujo hash já
+    existe; depois cada banco recebe um único UPDATE de saldo, o resumo
+    mensal recebe as linhas novas num único upsert e, para extratos de
+    cartão, as parcelas das compras vão para o livro de
+    faturas num único INSERT e cada fatura tocada é atualizada uma vez.
+    Retorna quantas linhas foram realmente inseridas.
+    """
+    inseridas = inserir_ignorando_duplicados(
+        Transacao, linhas, ['usuario_id', 'hash_importacao'],
+        retornar=['id', 'usuario_id', 'banco_id', 'tipo', 'valor',
+                  'descricao', 'categoria_id', 'forma_pagamento', 'data'])
+
+    aplicar_transacoes_nos_bancos(inseridas)
+    somar_transacoes_no_resumo(inseridas)
+
+    if cartao and inseridas:
+        agora = datetime.utcnow()
+        compras = []
+        transacoes_das_compras = []
+        creditos = {}
+
+        for linha in inseridas:
+            if linha.tipo != 'Despesa':
+                # Estornos/créditos abatem a fatura do mês, sem parcelas
+                competencia = competencia_fatura(cartao, linha.data)
+                creditos[competencia] = creditos.get(competencia, 0) - linha.valor
+            else:
+                transacoes_das_compras.append(linha.id)
+                compras.append({
+                    'usuario_id': linha.usuario_id,
+                    'cartao_id': cartao.id,
+                    'descricao': linha.descricao,
+                    'valor_total': linha.valor,
+                    'quantidade_parcelas': 1,
+                    'data_compra': linha.data,
+                    'categoria_id': linha.categoria_id,
+                    'forma_pagamento': 'Cartão de Crédito',
+                    'status': 'aberta',
+                    'data_criacao': agora
+                })
+
+        if compras:
+            compras_inseridas = db.session.execute(
+                db.insert(CompraCartao).returning(
+                    CompraCartao.id, CompraCartao.valor_total,
+                    CompraCartao.quantidade_parcelas, CompraCartao.data_compra,
+                    sort_by_parameter_order=True),
+                compras).all()
+            # Cada transação aponta para a sua compra (UPDATE em lote pelo id)
+            db.session.execute(db.update(Transacao), [
+                {'id': transacao_id, 'compra_cartao_id': compra.id}
+                for transacao_id, compra in zip(transacoes_das_compras, compras_inseridas)])
+
+            lancar_parcelas(cartao, compras_inseridas)
+
+        # Um único upsert para os créditos de todas as faturas do lote
+        somar_nas_faturas(cartao, creditos)
+
+    db.session.commit()
+    return len(inseridas)
+
+
+def importar_extrato(usuario_id, arquivo, formato, banco=None, cartao=None,
+                     categoria_padrao='Importado',
+                     tamanho_lote=TAMANHO_LOTE_IMPORTACAO):
+    """
+    Importa um extrato CSV/OFX (arquivo de texto já aberto) em lotes.
+
+    O arquivo é lido em streaming; a cada `tamanho_lote` linhas válidas é
+    feito um único INSERT em lote (gravar_lote_importacao). Linhas já
+    importadas antes são reconhecidas pelo hash de (data, valor, descrição,
+    conta) e ignoradas. Retorna um resumo com importadas, duplicadas e erros.
+    """
+    leitor = LEITORES_EXTRATO[formato]
+
+    if cartao:
+        conta = f'cartao:{cartao.id}'
+        forma_pagamento = 'Cartão de Crédito'
+    elif banco:
+        conta = f'banco:{banco.id}'
+        forma_pagamento = 'Débito'
+    else:
+        conta = 'carteira'
+        forma_pagamento = 'Dinheiro'
+
+    calcular_hash = HashImportacao(conta)
+    agora = datetime.utcnow()
+    resumo = {'importadas': 0, 'duplicadas': 0, 'erros': [], 'total_erros': 0}
+    lote = []
+    ids_categoria = {}
+
+    def gravar():
+        # Os nomes de categoria do lote viram categoria_id (uma consulta
+        # por lote só para os nomes ainda não vistos neste arquivo)
+        faltando = {linha['categoria'] for linha in lote} - ids_categoria.keys()
+        if faltando:
+            ids_categoria.update(ids_categorias(usuario_id, faltando))
+        for linha in lote:
+            linha['categoria_id'] = ids_categoria[linha.pop('categoria')]
+
+        inseridas = gravar_lote_importacao(lote, cartao)
+        resumo['importadas'] += inseridas
+        resumo['duplicadas'] += len(lote) - inseridas
+        lote.clear()
+
+    for linha in leitor(arquivo, parse_valor):
+        if isinstance(linha, str):
+            resumo['total_erros'] += 1
+            if len(resumo['erros']) < MAXIMO_ERROS_EXIBIDOS:
+                resumo['erros'].append(linha)
+            continue
+
+        lote.append({
+            'usuario_id': usuario_id,
+            'descricao': linha['descricao'],
+            'valor': linha['valor'],
+            'categoria': linha['categoria'] or categoria_padrao,
+            'tipo': linha['tipo'],
+            'forma_pagamento': forma_pagamento,
+            'data': linha['data'],
+            'banco_id': banco.id if banco else None,
+            'cartao_id': cartao.id if cartao else None,
+            'hash_importacao': calcular_hash(linha),
+            'data_criacao': agora
+        })
+
+        if len(lote) >= tamanho_lote:
+            gravar()
+
+    if lote:
+        gravar()
+
+    return resumo
+
+
+@app.route('/importar', methods=['GET', 'POST'])
+@login_required
+def importar():
+    """Importação de extratos bancários e de cartão (CSV ou OFX)"""
+    bancos = Banco.query.filter_by(usuario_id=current_user.id).all()
+    cartoes = CartaoCredito.query.filter_by(usuario_id=current_user.id).all()
+    categorias = Categoria.query.filter_by(usuario_id=current_user.id).all()
+
+    if request.method == 'POST':
+        arquivo = request.files.get('arquivo')
+        if not arquivo or not arquivo.filename:
+            flash('❌ Selecione um arquivo para importar!', 'danger')
+            return redirect(url_for('importar'))
+
+        formato = arquivo.filename.rsplit('.', 1)[-1].lower()
+        if formato not in LEITORES_EXTRATO:
+            flash('❌ Formato não suportado. Use CSV ou OFX.', 'danger')
+            return redirect(url_for('importar'))
+
+        # destino: "banco:<id>", "cartao:<id>" ou "carteira"
+        destino, _, destino_id = request.form.get(
+            'destino', 'carteira').partition(':')
+        banco = cartao = None
+        if destino in ('banco', 'cartao') and not destino_id.isdigit():
+            flash('❌ Conta de destino inválida!', 'danger')
+            return redirect(url_for('importar'))
+        if destino == 'banco':
+            banco = verificar_propriedade_banco(int(destino_id))
+        elif destino == 'cartao':
+            cartao = verificar_propriedade_cartao(int(destino_id))
+
+        codificacao = request.form.get('codificacao', 'utf-8-sig')
+        if codificacao not in ('utf-8-sig', 'latin-1'):
+            codificacao = 'utf-8-sig'
+
+        texto = io.TextIOWrapper(arquivo.stream, encoding=codificacao,
+                                 errors='replace', newline='')
+        try:
+            resumo = importar_extrato(
+                current_user.id, texto, formato, banco=banco, cartao=cartao,
+                categoria_padrao=request.form.get('categoria') or 'Importado')
+        except ErroImportacao as e:
+            db.session.rollback()
+            flash(f'❌ {e}', 'danger')
+            return redirect(url_for('importar'))
+
+        flash(f"✅ {resumo['importadas']} transações importadas, "
+              f"{resumo['duplicadas']} duplicadas ignoradas.", 'success')
+        if resumo['total_erros']:
+            flash(f"⚠️ {resumo['total_erros']} linhas com erro: "
+                  + '; '.join(resumo['erros']), 'warning')
+        return redirect(url_for('lista_transacoes'))
+
+    return render_template('importar.html', bancos=bancos, cartoes=cartoes,
+                           categorias=categorias)
+
+# ===== FIM DA IMPORTAÇÃO =====
 
 # ===== ROTAS DE ORÇAMENTOS =====
 
 
+def nomes_categorias(usuario_id):
+    """Nomes das categorias do usuário (da tabela de categorias, sem varrer transações)"""
+    return [nome for nome, in db.session.query(Categoria.nome).filter_by(
+        usuario_id=usuario_id).distinct().order_by(Categoria.nome)]
+
+
+# Alertas de orçamento exibidos de uma vez
+LIMITE_NOTIFICACOES = 20
+
+
 @app.route('/orcamentos', methods=['GET', 'POST'])
 @login_required
 def orcamentos():
@@ -1374,29 +2177,11 @@ def orcamentos():
     orcamentos_lista = Orcamento.query.filter_by(
         usuario_id=current_user.id, mes=mes_atual, ano=ano_atual).all()
 
-    gastos_por_categoria = db.session.query(
-        Transacao.categoria,
-        func.sum(Transacao.valor)
-    ).filter(
-        Transacao.usuario_id == current_user.id,
-        extract('month', Transacao.data) == mes_atual,
-        extract('year', Transacao.data) == ano_atual,
-        Transacao.tipo == 'Despesa'
-    ).group_by(Transacao.categoria).all()
-
-    gastos_dict = {cat: valor for cat, valor in gastos_por_categoria}
-
+    # O gasto de cada orçamento é mantido a cada escrita de despesa
     orcamentos_info = []
     for orc in orcamentos_lista:
-        gasto = gastos_dict.get(orc.categoria, 0)
-        percentual = (gasto / orc.limite_mensal *
-                      100) if orc.limite_mensal > 0 else 0
-        status = 'em_dia'
-
-        if percentual > 100:
-            status = 'excedido'
-        elif percentual > 80:
-            status = 'alerta'
+        gasto = orc.gasto
+        percentual, status = situacao_orcamento(gasto, orc.limite_mensal)
 
         orcamentos_info.append({
             'id': orc.id,
@@ -1409,15 +2194,23 @@ def orcamentos():
             'status': status
         })
 
-    todas_as_categorias = db.session.query(Transacao.categoria).filter_by(
-        usuario_id=current_user.id).distinct().all()
-    categorias = sorted([cat[0] for cat in todas_as_categorias])
+    categorias = nomes_categorias(current_user.id)
 
     total_limites = sum(orc['limite'] for orc in orcamentos_info)
     total_gasto = sum(orc['gasto'] for orc in orcamentos_info)
     total_restante = total_limites - total_gasto
 
+    visao = em_cache(
+        'visao_orcamentos', current_user.id, {'ano': ano_atual, 'mes': mes_atual},
+        lambda: visao_orcamentos(current_user.id, ano_atual, mes_atual))
+
+    notificacoes = NotificacaoOrcamento.query.filter_by(
+        usuario_id=current_user.id, lida=False).order_by(
+        NotificacaoOrcamento.criada_em.desc()).limit(LIMITE_NOTIFICACOES).all()
+
     return render_template('orcamentos.html',
+                           visao=visao,
+                           notificacoes=notificacoes,
                            orcamentos_info=orcamentos_info,
                            categorias=categorias,
                            mes_selecionado=mes_atual,
@@ -1427,6 +2220,46 @@ def orcamentos():
                            total_restante=total_restante)
 
 
+@app.route('/orcamentos/notificacoes/lidas', methods=['POST'])
+@login_required
+def marcar_notificacoes_lidas():
+    NotificacaoOrcamento.query.filter_by(
+        usuario_id=current_user.id, lida=False).update({'lida': True})
+    db.session.commit()
+
+    return redirect(url_for('orcamentos', mes=request.form.get('mes', type=int),
+                            ano=request.form.get('ano', type=int)))
+
+
+@app.route('/api/orcamentos/notificacoes', methods=['GET'])
+@login_required
+def api_notificacoes_orcamento():
+    """Alertas de orçamento ainda não lidos, mais recentes primeiro"""
+    notificacoes = NotificacaoOrcamento.query.filter_by(
+        usuario_id=current_user.id, lida=False).order_by(
+        NotificacaoOrcamento.criada_em.desc()).limit(LIMITE_NOTIFICACOES).all()
+
+    return jsonify([{
+        'id': n.id, 'categoria': n.orcamento.categoria,
+        'mes': n.orcamento.mes, 'ano': n.orcamento.ano, 'limiar': n.limiar,
+        'gasto': n.gasto, 'limite': n.limite, 'criada_em': n.criada_em.isoformat()
+    } for n in notificacoes])
+
+
+@app.route('/api/orcamentos/visao', methods=['GET'])
+@login_required
+def api_visao_orcamentos():
+    """Limite × gasto por categoria nos 12 meses que terminam em ?ano=&mes="""
+    mes = request.args.get('mes', type=int) or date.today().month
+    ano = request.args.get('ano', type=int) or date.today().year
+    if not 1 <= mes <= 12:
+        abort(400)
+
+    return jsonify(em_cache(
+        'visao_orcamentos', current_user.id, {'ano': ano, 'mes': mes},
+        lambda: visao_orcamentos(current_user.id, ano, mes)))
+
+
 @app.route('/orcamentos/criar', methods=['GET', 'POST'])
 @login_required
 def criar_orcamento():
@@ -1453,20 +2286,8 @@ def criar_orcamento():
     mes_atual = date.today().month
     ano_atual = date.today().year
 
-    # ✅ CORREÇÃO: Buscar categorias do modelo + transações
-    categorias_modelo = Categoria.query.filter_by(
-        usuario_id=current_user.id).all()
-    categorias_modelo_nomes = [cat.nome for cat in categorias_modelo]
-
-    # Adicionar também categorias de transações já criadas
-    categorias_transacao = db.session.query(Transacao.categoria).filter_by(
-        usuario_id=current_user.id).distinct().all()
-    categorias_transacao_nomes = [cat[0]
-                                  for cat in categorias_transacao if cat[0]]
-
-    # Combinar e remover duplicatas
-    todas_categorias = sorted(
-        set(categorias_modelo_nomes + categorias_transacao_nomes))
+    # Toda categoria usada em transações existe na tabela de categorias
+    todas_categorias = nomes_categorias(current_user.id)
 
     return render_template('criar_orcamento.html', categorias=todas_categorias, mes_padrao=mes_atual, ano_padrao=ano_atual)
 
@@ -1559,14 +2380,13 @@ def deletar_categoria(id):
     # SEGURANÇA: Verificar propriedade
     categoria = verificar_propriedade_categoria(id)
 
-    transacoes = Transacao.query.filter_by(
-        usuario_id=current_user.id, categoria=categoria.nome).first()
-    compras = CompraCartao.query.filter_by(
-        usuario_id=current_user.id, categoria=categoria.nome).first()
-    orcamentos = Orcamento.query.filter_by(
-        usuario_id=current_user.id, categoria=categoria.nome).first()
+    # Uma única consulta: algum registro ainda aponta para a categoria?
+    em_uso = db.session.query(db.or_(*(
+        db.exists().where(modelo.categoria_id == categoria.id)
+        for modelo in (Transacao, CompraCartao, Orcamento, Recorrencia)
+    ))).scalar()
 
-    if transacoes or compras or orcamentos:
+    if em_uso:
         return redirect(url_for('categorias'))
 
     db.session.delete(categoria)
@@ -1660,9 +2480,7 @@ def editar_recorrencia(id):
 
     if request.method == 'POST':
         recorrencia.descricao = request.form.get('descricao')
-        valor_str = request.form.get('valor', '0').strip()
-        valor_str = valor_str.replace('.', '').replace(',', '.')
-        recorrencia.valor = float(valor_str)
+        recorrencia.valor = parse_valor(request.form.get('valor', '0'))
         recorrencia.tipo = request.form.get('tipo')
         recorrencia.categoria = request.form.get('categoria')
         recorrencia.forma_pagamento = request.form.get('forma_pagamento')
@@ -1675,6 +2493,10 @@ def editar_recorrencia(id):
         recorrencia.data_fim = datetime.strptime(
             data_fim_str, '%Y-%m-%d').date() if data_fim_str else None
 
+        # ✅ Regras mudaram: recalcular a próxima ocorrência a partir de hoje
+        recorrencia.proxima_ocorrencia = proxima_ocorrencia(
+            recorrencia, date.today())
+
         db.session.commit()
 
         return redirect(url_for('recorrencias'))
@@ -1689,22 +2511,12 @@ def deletar_recorrencia(id):
     # SEGURANÇA: Verificar propriedade
     recorrencia = verificar_propriedade_recorrencia(id)
 
-    # ✅ Restaurar saldo do banco quando deleta recorrência
-    if recorrencia.banco_id:
-        banco = Banco.query.get(recorrencia.banco_id)
-        if banco:
-            # Se era SAÍDA, RESTAURA (adiciona de volta)
-            if recorrencia.tipo.lower() == 'saída' or recorrencia.tipo.lower() == 'despesa':
-                banco.saldo += recorrencia.valor
-                print(f"✅ Saldo restaurado: +R$ {recorrencia.valor}")
-            # Se era ENTRADA, REMOVE (tira de volta)
-            elif recorrencia.tipo.lower() == 'entrada' or recorrencia.tipo.lower() == 'receita':
-                banco.saldo -= recorrencia.valor
-                print(f"✅ Saldo ajustado: -R$ {recorrencia.valor}")
-            db.session.commit()
-
     # ✅ Deletar todas as transações vinculadas a esta recorrência
     transacoes_recorrencia = Transacao.query.filter_by(recorrencia_id=recorrencia.id).all()
+
+    # ✅ Restaurar o saldo e apagar as movimentações de cada ocorrência gerada
+    estornar_transacoes_nos_bancos(transacoes_recorrencia)
+
     for transacao in transacoes_recorrencia:
         print(f"✅ Deletando transação: {transacao.descricao}")
         db.session.delete(transacao)
@@ -1749,64 +2561,34 @@ def projecao():
             'mes_numero': mes_projecao,
             'receitas': [],
             'despesas': [],
-            'total_receitas': 0.0,
-            'total_despesas': 0.0,
-            'saldo': 0.0
+            'total_receitas': 0,
+            'total_despesas': 0,
+            'saldo': 0
         }
 
         for rec in recorrencias:
-            # ✅ CORRIGIR: Comparar data_inicio com o primeiro dia do mês
-            # Se data_inicio é depois do primeiro dia deste mês, não mostrar
-            if rec.data_inicio.year > ano_projecao or \
-               (rec.data_inicio.year == ano_projecao and rec.data_inicio.month > mes_projecao):
-                continue  # Ainda não chegou nesse mês
-
-            # Se data_fim passou, não mostrar mais
-            if rec.data_fim and (rec.data_fim.year < ano_projecao or
-               (rec.data_fim.year == ano_projecao and rec.data_fim.month < mes_projecao)):
-                continue  # Já terminou essa recorrência
-
-            meses_desde_inicio = (ano_projecao - rec.data_inicio.year) * \
-                12 + (mes_projecao - rec.data_inicio.month)
-
-            ocorre = False
-            freq_lower = rec.frequencia.lower()  # ✅ Converter para minúscula para comparar
-
-            if freq_lower == 'mensal':  # ✅ Mensal aparece todo mês
-                ocorre = True
-            elif freq_lower == 'diária':  # ✅ Diária aparece todo mês
-                ocorre = True
-            elif freq_lower == 'bimestral' and meses_desde_inicio >= 0 and meses_desde_inicio % 2 == 0:
-                ocorre = True
-            elif freq_lower == 'trimestral' and meses_desde_inicio >= 0 and meses_desde_inicio % 3 == 0:
-                ocorre = True
-            elif freq_lower == 'semestral' and meses_desde_inicio >= 0 and meses_desde_inicio % 6 == 0:
-                ocorre = True
-            elif freq_lower == 'anual' and meses_desde_inicio >= 0 and meses_desde_inicio % 12 == 0:
-                ocorre = True
-            elif freq_lower == 'semanal':  # ✅ Semanal: mostrar no mês de início
-                if meses_desde_inicio == 0:
-                    ocorre = True
-            elif freq_lower == 'quinzenal':  # ✅ Quinzenal: mostrar no mês de início
-                if meses_desde_inicio == 0:
-                    ocorre = True
-
-            if ocorre:
-                item = {
-                    'id': rec.id,
-                    'descricao': rec.descricao,
-                    'valor': rec.valor,
-                    'categoria': rec.categoria,
-                    'forma_pagamento': rec.forma_pagamento,
-                    'dia_vencimento': rec.dia_vencimento
-                }
-
-                if rec.tipo == 'Receita':
-                    projecao_meses[chave_mes]['receitas'].append(item)
-                    projecao_meses[chave_mes]['total_receitas'] += rec.valor
-                else:
-                    projecao_meses[chave_mes]['despesas'].append(item)
-                    projecao_meses[chave_mes]['total_despesas'] += rec.valor
+            # ✅ Mesmo motor de regras usado na geração das transações
+            ocorrencias = quantidade_no_mes(rec, ano_projecao, mes_projecao)
+            if not ocorrencias:
+                continue
+
+            valor_mes = rec.valor * ocorrencias
+            item = {
+                'id': rec.id,
+                'descricao': rec.descricao,
+                'valor': valor_mes,
+                'ocorrencias': ocorrencias,
+                'categoria': rec.categoria,
+                'forma_pagamento': rec.forma_pagamento,
+                'dia_vencimento': rec.dia_vencimento
+            }
+
+            if rec.tipo == 'Receita':
+                projecao_meses[chave_mes]['receitas'].append(item)
+                projecao_meses[chave_mes]['total_receitas'] += valor_mes
+            else:
+                projecao_meses[chave_mes]['despesas'].append(item)
+                projecao_meses[chave_mes]['total_despesas'] += valor_mes
 
         projecao_meses[chave_mes]['saldo'] = projecao_meses[chave_mes]['total_receitas'] - \
             projecao_meses[chave_mes]['total_despesas']
@@ -2073,16 +2855,7 @@ def editar_carteira():
     """Editar saldo da carteira (dinheiro físico)"""
 
     # Pegar saldo atual da carteira de transações
-    transacoes_carteira = Transacao.query.filter_by(
-        usuario_id=current_user.id, banco_id=None).all()
-    transacoes_carteira = [
-        t for t in transacoes_carteira if t.forma_pagamento != 'Cartão de Crédito']
-
-    receitas_carteira = sum(
-        t.valor for t in transacoes_carteira if t.tipo == 'Receita')
-    despesas_carteira = sum(
-        t.valor for t in transacoes_carteira if t.tipo == 'Despesa')
-    saldo_por_transacoes = receitas_carteira - despesas_carteira
+    saldo_por_transacoes = resumo_dashboard(current_user.id)['saldo_carteira']
 
     if request.method == 'POST':
         try:
@@ -2150,17 +2923,7 @@ def transferir_carteira():
     """Transferir saldo da carteira para um banco"""
 
     # ✅ Pegar saldo da carteira - MESMO CÁLCULO DE editar_carteira()
-    transacoes_carteira = Transacao.query.filter_by(
-        usuario_id=current_user.id, banco_id=None).all()
-    # ✅ IMPORTANTE: Excluir transações de CARTÃO DE CRÉDITO!
-    transacoes_carteira = [
-        t for t in transacoes_carteira if t.forma_pagamento != 'Cartão de Crédito']
-
-    receitas_carteira = sum(
-        t.valor for t in transacoes_carteira if t.tipo == 'Receita')
-    despesas_carteira = sum(
-        t.valor for t in transacoes_carteira if t.tipo == 'Despesa')
-    saldo_carteira = receitas_carteira - despesas_carteira
+    saldo_carteira = resumo_dashboard(current_user.id)['saldo_carteira']
 
     bancos = Banco.query.filter_by(usuario_id=current_user.id).all()
 
@@ -2370,25 +3133,13 @@ def criar_compra_cartao():
 
             print(f"✅ Compra criada: {descricao} - R$ {valor_total}")
 
-            # ✅ CRIAR/ATUALIZAR A FATURA
-            fatura = criar_ou_atualizar_fatura(
-                usuario_id=current_user.id,
-                cartao_id=cartao_id,
-                data_compra=data_compra,
-                valor=valor_total
-            )
+            # ✅ LANÇAR AS PARCELAS NAS FATURAS
+            lancar_parcelas(cartao, [nova_compra])
+            mes, ano = competencia_fatura(cartao, data_compra)
 
-            if fatura:
-                print(
-                    f"✅ Fatura criada/atualizada: {fatura.mes}/{fatura.ano} - R$ {fatura.valor_total}")
-                db.session.commit()
-                flash(
-                    f'✅ Compra lançada com sucesso! Fatura criada para {fatura.mes}/{fatura.ano}', 'success')
-            else:
-                print(f"❌ Erro ao criar fatura!")
-                db.session.rollback()
-                flash('❌ Erro ao criar fatura!', 'danger')
-                return render_template('criar_compra_cartao.html', cartoes=cartoes, categorias=categorias)
+            db.session.commit()
+            flash(
+                f'✅ Compra lançada com sucesso! 1ª parcela na fatura de {mes:02d}/{ano}', 'success')
 
             return redirect(url_for('compras_cartao'))
 
@@ -2411,10 +3162,8 @@ def editar_compra_cartao(id):
 
     if request.method == 'POST':
         try:
-            # ✅ Guardar valores antigos ANTES de mudar
-            valor_antigo = compra.valor_total
-            data_antiga = compra.data_compra
-            descricao_antiga = compra.descricao
+            # ✅ Retirar as parcelas antigas das faturas ANTES de mudar
+            estornar_parcelas(compra)
 
             # Atualizar compra
             compra.descricao = request.form.get('descricao')
@@ -2425,85 +3174,26 @@ def editar_compra_cartao(id):
             compra.categoria = request.form.get('categoria')
             compra.data_compra = datetime.strptime(
                 request.form.get('data_compra'), '%Y-%m-%d').date()
+            db.session.flush()
 
+            # ✅ Relançar as parcelas com os dados novos
+            lancar_parcelas(compra.cartao, [compra])
             db.session.commit()
 
             # ✅ SINCRONIZAÇÃO BIDIRECIONAL: Atualizar também em Minhas Transações
-            transacao = Transacao.query.filter_by(
-                usuario_id=current_user.id,
-                descricao=descricao_antiga,
-                data=data_antiga,
-                forma_pagamento='Cartão de Crédito'
-            ).first()
+            # (busca pelo índice de transacoes.compra_cartao_id)
+            transacao = compra.transacao
 
             if transacao:
                 print(f"🔄 Sincronizando com Minhas Transações...")
                 transacao.descricao = compra.descricao
                 transacao.valor = valor_novo
-                transacao.categoria = compra.categoria
+                transacao.categoria_id = compra.categoria_id
                 transacao.data = compra.data_compra
                 db.session.commit()
                 print(f"✅ Transação sincronizada!")
 
-            # ✅ Calcular diferença e atualizar fatura
-            diferenca = valor_novo - valor_antigo
-
-            if diferenca != 0:  # Só atualizar se o valor mudou
-                print(f"✏️ Editando compra de cartão: {compra.descricao}")
-                print(f"   Valor anterior: R$ {valor_antigo:.2f}")
-                print(f"   Valor novo: R$ {valor_novo:.2f}")
-                print(f"   Diferença: R$ {diferenca:.2f}")
-
-                # Procurar a fatura do cartão
-                cartao = CartaoCredito.query.get(compra.cartao_id)
-
-                if cartao:
-                    # Determinar qual mês a compra pertence
-                    if compra.data_compra.day <= cartao.dia_fechamento:
-                        mes_fatura = compra.data_compra.month
-                        ano_fatura = compra.data_compra.year
-                    else:
-                        if compra.data_compra.month == 12:
-                            mes_fatura = 1
-                            ano_fatura = compra.data_compra.year + 1
-                        else:
-                            mes_fatura = compra.data_compra.month + 1
-                            ano_fatura = compra.data_compra.year
-
-                    # Procurar a fatura
-                    fatura = FaturaCartao.query.filter_by(
-                        usuario_id=current_user.id,
-                        cartao_id=compra.cartao_id,
-                        mes=mes_fatura,
-                        ano=ano_fatura
-                    ).first()
-
-                    if fatura:
-                        print(
-                            f"✅ Fatura encontrada: {mes_fatura:02d}/{ano_fatura}")
-                        print(
-                            f"   Fatura anterior: R$ {fatura.valor_total:.2f}")
-
-                        # ✅ Atualizar fatura com a diferença
-                        fatura.valor_total += diferenca
-                        fatura.valor_restante = fatura.valor_total - fatura.valor_pago
-
-                        print(f"   Fatura nova: R$ {fatura.valor_total:.2f}")
-
-                        db.session.commit()
-                        print(f"✅ Fatura atualizada!")
-                        flash(
-                            f'✅ Compra editada! Minhas Transações sincronizadas! Fatura atualizada para R$ {fatura.valor_total:.2f}', 'success')
-                    else:
-                        print(
-                            f"⚠️ Fatura não encontrada para {mes_fatura:02d}/{ano_fatura}")
-                        flash(
-                            f'✅ Compra editada e sincronizada mas fatura não encontrada', 'info')
-                else:
-                    print(f"⚠️ Cartão não encontrado")
-            else:
-                flash(f'✅ Compra editada e sincronizada com sucesso!', 'success')
-
+            flash(f'✅ Compra editada e sincronizada com sucesso!', 'success')
             return redirect(url_for('compras_cartao'))
 
         except Exception as e:
@@ -2528,51 +3218,8 @@ def deletar_compra_cartao(id):
 
     print(f"🗑️ Deletando compra cartão: {compra.descricao}")
 
-    valor_compra = compra.valor_total
-    cartao_id = compra.cartao_id
-    data_compra = compra.data_compra
-    usuario_id = compra.usuario_id
-
-    # ✅ ATUALIZAR A FATURA ANTES DE DELETAR
-    cartao = CartaoCredito.query.get(cartao_id)
-
-    if cartao:
-        # Determinar qual mês a compra pertencia
-        if data_compra.day <= cartao.dia_fechamento:
-            mes_fatura = data_compra.month
-            ano_fatura = data_compra.year
-        else:
-            if data_compra.month == 12:
-                mes_fatura = 1
-                ano_fatura = data_compra.year + 1
-            else:
-                mes_fatura = data_compra.month + 1
-                ano_fatura = data_compra.year
-
-        # Procurar a fatura
-        fatura = FaturaCartao.query.filter_by(
-            usuario_id=usuario_id,
-            cartao_id=cartao_id,
-            mes=mes_fatura,
-            ano=ano_fatura
-        ).first()
-
-        if fatura:
-            print(f"✅ Fatura encontrada: {mes_fatura:02d}/{ano_fatura}")
-            print(f"   Valor anterior: R$ {fatura.valor_total}")
-
-            # SUBTRAIR O VALOR DA FATURA
-            fatura.valor_total -= valor_compra
-            fatura.valor_restante = fatura.valor_total - fatura.valor_pago
-
-            print(f"   Valor novo: R$ {fatura.valor_total}")
-
-            # SE FATURA FICAR COM VALOR 0, DELETAR
-            if fatura.valor_total <= 0:
-                print(f"   Fatura com valor 0, deletando...")
-                db.session.delete(fatura)
-
-            print(f"✅ Fatura atualizada!")
+    # ✅ RETIRAR AS PARCELAS DAS FATURAS ANTES DE DELETAR
+    estornar_parcelas(compra)
 
     # DELETAR A COMPRA
     db.session.delete(compra)
@@ -2587,87 +3234,74 @@ def dividas_parceladas():
     mes_selecionado = request.args.get('mes', type=int) or date.today().month
     ano_selecionado = request.args.get('ano', type=int) or date.today().year
 
-    compras = CompraCartao.query.filter_by(
-        usuario_id=current_user.id, status='aberta').all()
+    # Parcelas vêm do livro TransacaoFatura, já presas à fatura de cada mês
+    parceladas = db.session.query(TransacaoFatura).join(
+        FaturaCartao, TransacaoFatura.fatura_id == FaturaCartao.id
+    ).join(
+        CompraCartao, TransacaoFatura.compra_cartao_id == CompraCartao.id
+    ).filter(
+        FaturaCartao.usuario_id == current_user.id,
+        CompraCartao.status == 'aberta',
+        CompraCartao.quantidade_parcelas > 1
+    )
+
+    meses_disponiveis = [
+        f"{ano}-{mes:02d}" for ano, mes in parceladas.with_entities(
+            FaturaCartao.ano, FaturaCartao.mes
+        ).distinct().order_by(FaturaCartao.ano, FaturaCartao.mes)
+    ]
 
     # Verificar se tem dívidas parceladas
-    if not compras:
+    if not meses_disponiveis:
         flash('ℹ️ Você não tem dívidas parceladas no momento.', 'info')
         return redirect(url_for('cartoes'))
 
-    dividas_por_mes = {}
-
-    for compra in compras:
-        if compra.quantidade_parcelas == 1:
-            continue
-
-        cartao = compra.cartao
-        valor_parcela = compra.valor_total / compra.quantidade_parcelas
-
-        for num_parcela in range(1, compra.quantidade_parcelas + 1):
-            meses_adiante = num_parcela
-
-            ano_parcela = compra.data_compra.year
-            mes_parcela = compra.data_compra.month + meses_adiante
-
-            while mes_parcela > 12:
-                mes_parcela -= 12
-                ano_parcela += 1
-
-            dia_fechamento = cartao.dia_fechamento
-            _, ultimo_dia_mes = monthrange(ano_parcela, mes_parcela)
-            dia_fechamento = min(dia_fechamento, ultimo_dia_mes)
-
-            dia_vencimento = cartao.dia_vencimento
-            dia_vencimento = min(dia_vencimento, ultimo_dia_mes)
-
-            data_fechamento = date(ano_parcela, mes_parcela, dia_fechamento)
-            data_vencimento = date(ano_parcela, mes_parcela, dia_vencimento)
+    parcelas_do_mes = parceladas.options(
+        db.contains_eager(TransacaoFatura.fatura).joinedload(FaturaCartao.cartao),
+        db.contains_eager(TransacaoFatura.compra)
+    ).filter(
+        FaturaCartao.mes == mes_selecionado,
+        FaturaCartao.ano == ano_selecionado
+    ).order_by(FaturaCartao.data_vencimento, CompraCartao.data_compra).all()
 
-            chave_mes = f"{ano_parcela}-{mes_parcela:02d}"
-            mes_nomes = ['Janeiro', 'Fevereiro', 'Março', 'Abril', 'Maio', 'Junho',
-                         'Julho', 'Agosto', 'Setembro', 'Outubro', 'Novembro', 'Dezembro']
-            mes_nome = mes_nomes[mes_parcela - 1]
+    mes_selecionado_data = None
+    total_dividas = 0
+    total_parcelas = len(parcelas_do_mes)
 
-            if chave_mes not in dividas_por_mes:
-                dividas_por_mes[chave_mes] = {
-                    'mes': mes_nome,
-                    'mes_numero': mes_parcela,
-                    'ano': ano_parcela,
-                    'data_fechamento': data_fechamento,
-                    'data_vencimento': data_vencimento,
-                    'parcelas': [],
-                    'total_mes': 0
-                }
+    if parcelas_do_mes:
+        mes_nomes = ['Janeiro', 'Fevereiro', 'Março', 'Abril', 'Maio', 'Junho',
+                     'Julho', 'Agosto', 'Setembro', 'Outubro', 'Novembro', 'Dezembro']
+        primeira_fatura = parcelas_do_mes[0].fatura
+
+        mes_selecionado_data = {
+            'mes': mes_nomes[mes_selecionado - 1],
+            'mes_numero': mes_selecionado,
+            'ano': ano_selecionado,
+            'data_fechamento': primeira_fatura.data_fechamento,
+            'data_vencimento': primeira_fatura.data_vencimento,
+            'parcelas': [],
+            'total_mes': 0
+        }
 
-            divida = {
+        for parcela in parcelas_do_mes:
+            compra = parcela.compra
+            fatura = parcela.fatura
+            mes_selecionado_data['parcelas'].append({
                 'id': compra.id,
                 'descricao': compra.descricao,
-                'cartao': compra.cartao.nome,
-                'numero_parcela': num_parcela,
+                'cartao': fatura.cartao.nome,
+                'numero_parcela': parcela.numero_parcela,
                 'quantidade_parcelas': compra.quantidade_parcelas,
-                'parcelas_faltando': compra.quantidade_parcelas - num_parcela,
-                'valor_parcela': valor_parcela,
+                'parcelas_faltando': compra.quantidade_parcelas - parcela.numero_parcela,
+                'valor_parcela': parcela.valor_parcela,
                 'data_compra': compra.data_compra,
                 'categoria': compra.categoria,
-                'data_fechamento': data_fechamento,
-                'data_vencimento': data_vencimento
-            }
-
-            dividas_por_mes[chave_mes]['parcelas'].append(divida)
-            dividas_por_mes[chave_mes]['total_mes'] += valor_parcela
-
-    chave_selecionada = f"{ano_selecionado}-{mes_selecionado:02d}"
-    mes_selecionado_data = dividas_por_mes.get(chave_selecionada, None)
+                'data_fechamento': fatura.data_fechamento,
+                'data_vencimento': fatura.data_vencimento
+            })
+            mes_selecionado_data['total_mes'] += parcela.valor_parcela
 
-    if mes_selecionado_data:
         total_dividas = mes_selecionado_data['total_mes']
-        total_parcelas = len(mes_selecionado_data['parcelas'])
-    else:
-        total_dividas = 0
-        total_parcelas = 0
-
-    meses_disponiveis = sorted(dividas_por_mes.keys())
 
     return render_template('dividas_parceladas.html',
                            mes_selecionado_data=mes_selecionado_data,
@@ -2763,7 +3397,9 @@ def detalhar_fatura(fatura_id):
         abort(403)
 
     # Pegar transações da fatura
-    transacoes = TransacaoFatura.query.filter_by(fatura_id=fatura_id).all()
+    transacoes = TransacaoFatura.query.options(
+        db.joinedload(TransacaoFatura.compra)
+    ).filter_by(fatura_id=fatura_id).order_by(TransacaoFatura.id).all()
 
     # Pegar pagamentos registrados
     pagamentos = PagamentoFatura.query.filter_by(fatura_id=fatura_id).all()
@@ -2808,9 +3444,14 @@ def pagar_fatura_route(fatura_id):
 # ===== FIM DAS ROTAS DE FATURAS ====
 
 
-# Criar as tabelas na inicialização
-with app.app_context():
-    db.create_all()
+# O esquema do banco é criado/atualizado por `flask db upgrade` (migracoes.py);
+# importar este módulo não executa nenhum DDL.
+app.cli.add_command(db_cli)
+app.cli.add_command(resumos_cli)
+app.cli.add_command(worker_cli)
 
 if __name__ == '__main__':
+    # Execução local: garante o esquema antes de subir o servidor
+    with app.app_context():
+        aplicar_migracoes()
     app.run(debug=False, port=5000)
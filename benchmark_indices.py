@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Benchmark dos índices compostos por usuário.
+
+Gera uma massa sintética (por padrão 1.000.000 de transações), mede as
+consultas mais usadas pelas rotas SEM os índices secundários dos modelos
+e depois COM eles, mostrando o plano de execução e a latência mediana de
+cada consulta.
+
+Uso:
+    python benchmark_indices.py                      # SQLite em /tmp
+    python benchmark_indices.py --linhas 100000      # massa menor
+    python benchmark_indices.py --url postgresql://...   # banco vazio!
+
+ATENÇÃO: o banco indicado em --url é APAGADO e recriado.
+"""
+
+import argparse
+import random
+import statistics
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, func, select, text, tuple_
+
+from models import (
+    db, Usuario, Transacao, Banco, MovimentacaoBanco, CartaoCredito,
+    CompraCartao, FaturaCartao, Recorrencia, Orcamento, Categoria,
+    para_centavos
+)
+
+CATEGORIAS = ['Alimentação', 'Transporte', 'Moradia', 'Saúde', 'Lazer',
+              'Educação', 'Salário', 'Mercado', 'Serviços', 'Outros']
+DATA_INICIAL = date(2023, 1, 1)
+DIAS = 3 * 365
+
+
+# ===== MASSA DE DADOS =====
+
+def _categoria_id(usuario_id, nome):
+    """Id fixo da categoria `nome` do usuário na massa sintética"""
+    return (usuario_id - 1) * len(CATEGORIAS) + CATEGORIAS.index(nome) + 1
+
+
+def _inserir(conexao, tabela, linhas):
+    """
+    INSERT em lote direto no driver (bem mais rápido que o ORM).
+    Os valores vão crus: dinheiro já em centavos, categoria já como id.
+    """
+    if not linhas:
+        return
+    colunas = list(linhas[0].keys())
+    marcador = '?' if conexao.dialect.paramstyle == 'qmark' else '%s'
+    sql = (f"INSERT INTO {tabela.name} ({', '.join(colunas)}) "
+           f"VALUES ({', '.join([marcador] * len(colunas))})")
+    conexao.exec_driver_sql(sql, [tuple(l[c] for c in colunas) for l in linhas])
+
+
+def gerar_massa(engine, linhas, usuarios, lote=50000):
+    rnd = random.Random(7508)
+    por_usuario = max(1, linhas // usuarios)
+
+    with engine.begin() as conexao:
+        _inserir(conexao, Usuario.__table__, [
+            {'id': u, 'nome': f'Usuário {u}', 'email': f'u{u}@bench.local',
+             'senha': 'x'} for u in range(1, usuarios + 1)])
+        _inserir(conexao, Banco.__table__, [
+            {'id': (u - 1) * 3 + b, 'usuario_id': u, 'nome': f'Banco {b}',
+             'saldo': 0, 'tipo': 'Corrente'}
+            for u in range(1, usuarios + 1) for b in range(1, 4)])
+        _inserir(conexao, CartaoCredito.__table__, [
+            {'id': (u - 1) * 2 + c, 'usuario_id': u, 'nome': f'Cartão {c}',
+             'dia_fechamento': 10, 'dia_vencimento': 20}
+            for u in range(1, usuarios + 1) for c in range(1, 3)])
+        _inserir(conexao, Categoria.__table__, [
+            {'id': _categoria_id(u, nome), 'usuario_id': u, 'nome': nome}
+            for u in range(1, usuarios + 1) for nome in CATEGORIAS])
+        _inserir(conexao, Recorrencia.__table__, [
+            {'usuario_id': u, 'descricao': f'Conta {r}', 'valor': 10000,
+             'tipo': 'Despesa', 'categoria_id': _categoria_id(u, 'Moradia'),
+             'forma_pagamento': 'Dinheiro', 'frequencia': 'mensal',
+             'dia_vencimento': 5, 'data_inicio': DATA_INICIAL,
+             'ativa': r % 3 != 0}
+            for u in range(1, usuarios + 1) for r in range(10)])
+        _inserir(conexao, Orcamento.__table__, [
+            {'usuario_id': u, 'categoria_id': _categoria_id(u, cat),
+             'limite_mensal': 50000,
+             'mes': m, 'ano': a}
+            for u in range(1, usuarios + 1) for a in (2023, 2024, 2025)
+            for m in range(1, 13) for cat in CATEGORIAS[:3]])
+        _inserir(conexao, FaturaCartao.__table__, [
+            {'usuario_id': u, 'cartao_id': (u - 1) * 2 + c, 'mes': m, 'ano': a,
+             'valor_total': 0, 'valor_pago': 0, 'valor_restante': 0,
+             'data_fechamento': date(a, m, 10), 'data_vencimento': date(a, m, 20),
+             'status': 'paga' if (a, m) < (2025, 10) else 'aberta'}
+            for u in range(1, usuarios + 1) for c in (1, 2)
+            for a in (2023, 2024, 2025) for m in range(1, 13)])
+
+    for inicio in range(0, linhas, lote):
+        transacoes, movimentos, compras = [], [], []
+        for i in range(inicio, min(inicio + lote, linhas)):
+            u = i // por_usuario % usuarios + 1
+            data = DATA_INICIAL + timedelta(days=rnd.randrange(DIAS))
+            banco = (u - 1) * 3 + rnd.randint(1, 3)
+            valor = para_centavos(round(rnd.uniform(5, 500), 2))
+            tipo = 'Receita' if rnd.random() < 0.2 else 'Despesa'
+            transacoes.append({
+                'usuario_id': u, 'descricao': f'Lançamento {i}', 'valor': valor,
+                'categoria_id': _categoria_id(u, rnd.choice(CATEGORIAS)),
+                'tipo': tipo,
+                'forma_pagamento': 'Débito', 'data': data, 'banco_id': banco})
+            if i % 2 == 0:
+                movimentos.append({
+                    'banco_id': banco, 'valor': valor, 'data': data,
+                    'tipo_movimento': 'entrada' if tipo == 'Receita' else 'saida',
+                    'descricao': f'{tipo}: Lançamento {i}'})
+            if i % 5 == 0:
+                compras.append({
+                    'usuario_id': u, 'cartao_id': (u - 1) * 2 + rnd.randint(1, 2),
+                    'descricao': f'Compra {i}', 'valor_total': valor,
+                    'quantidade_parcelas': rnd.choice([1, 1, 3, 12]),
+                    'data_compra': data,
+                    'categoria_id': _categoria_id(u, rnd.choice(CATEGORIAS)),
+                    'forma_pagamento': 'Cartão de Crédito',
+                    'status': 'aberta' if rnd.random() < 0.1 else 'fechada'})
+
+        with engine.begin() as conexao:
+            _inserir(conexao, Transacao.__table__, transacoes)
+            _inserir(conexao, MovimentacaoBanco.__table__, movimentos)
+            _inserir(conexao, CompraCartao.__table__, compras)
+        print(f"   ... {min(inicio + lote, linhas):,} transações")
+
+
+# ===== CONSULTAS =====
+
+def consultas(usuario_id):
+    """As consultas das rotas mais acessadas, para um usuário"""
+    t = Transacao.__table__.c
+    m = MovimentacaoBanco.__table__.c
+    c = CompraCartao.__table__.c
+    f = FaturaCartao.__table__.c
+    r = Recorrencia.__table__.c
+    o = Orcamento.__table__.c
+    banco_id = (usuario_id - 1) * 3 + 1
+    cartao_id = (usuario_id - 1) * 2 + 1
+    inicio, fim = date(2024, 3, 1), date(2024, 3, 31)
+
+    return [
+        ('Transações: 1ª página', select(Transacao.__table__).where(
+            t.usuario_id == usuario_id).order_by(
+            t.data.desc(), t.id.desc()).limit(50)),
+        ('Transações: página seguinte (cursor)', select(Transacao.__table__).where(
+            t.usuario_id == usuario_id,
+            tuple_(t.data, t.id) < (date(2024, 6, 1), 10 ** 9)).order_by(
+            t.data.desc(), t.id.desc()).limit(50)),
+        ('Transações: período', select(Transacao.__table__).where(
+            t.usuario_id == usuario_id, t.data >= inicio, t.data <= fim)),
+        ('Transações: categoria no período', select(Transacao.__table__).where(
+            t.usuario_id == usuario_id,
+            t.categoria_id == _categoria_id(usuario_id, 'Mercado'),
+            t.data >= inicio, t.data <= fim)),
+        ('Transações: banco no período', select(Transacao.__table__).where(
+            t.usuario_id == usuario_id, t.banco_id == banco_id,
+            t.data >= inicio, t.data <= fim)),
+        ('Dashboard: totais por tipo', select(
+            t.tipo, func.sum(t.valor)).where(
+            t.usuario_id == usuario_id).group_by(t.tipo)),
+        ('Extrato do banco', select(MovimentacaoBanco.__table__).where(
+            m.banco_id == banco_id).order_by(m.data.desc())),
+        ('Fatura do mês', select(FaturaCartao.__table__).where(
+            f.usuario_id == usuario_id, f.cartao_id == cartao_id,
+            f.ano == 2024, f.mes == 3)),
+        ('Faturas abertas', select(func.sum(f.valor_restante)).where(
+            f.usuario_id == usuario_id, f.status == 'aberta')),
+        ('Dívidas parceladas', select(CompraCartao.__table__).where(
+            c.usuario_id == usuario_id, c.status == 'aberta')),
+        ('Compras do cartão', select(CompraCartao.__table__).where(
+            c.cartao_id == cartao_id).limit(1)),
+        ('Recorrências ativas', select(Recorrencia.__table__).where(
+            r.usuario_id == usuario_id, r.ativa.is_(True))),
+        ('Orçamentos do mês', select(Orcamento.__table__).where(
+            o.usuario_id == usuario_id, o.ano == 2024, o.mes == 3)),
+    ]
+
+
+def plano(conexao, stmt):
+    compilado = stmt.compile(dialect=conexao.dialect,
+                             compile_kwargs={'literal_binds': True})
+    if conexao.dialect.name == 'sqlite':
+        linhas = conexao.execute(text(f'EXPLAIN QUERY PLAN {compilado}'))
+        return ' | '.join(linha[-1] for linha in linhas)
+    linhas = conexao.execute(text(f'EXPLAIN {compilado}'))
+    return ' | '.join(linha[0].strip() for linha in linhas)
+
+
+def medir(engine, usuarios, repeticoes):
+    """Plano e latência mediana (ms) de cada consulta"""
+    resultado = {}
+    rnd = random.Random(42)
+    alvos = [rnd.randint(1, usuarios) for _ in range(repeticoes)]
+
+    with engine.connect() as conexao:
+        for nome, stmt in consultas(alvos[0]):
+            resultado[nome] = {'plano': plano(conexao, stmt)}
+
+        for nome in resultado:
+            tempos = []
+            for usuario_id in alvos:
+                stmt = dict(consultas(usuario_id))[nome]
+                inicio = time.perf_counter()
+                conexao.execute(stmt).all()
+                tempos.append((time.perf_counter() - inicio) * 1000)
+            resultado[nome]['ms'] = statistics.median(tempos)
+
+    return resultado
+
+
+# ===== EXECUÇÃO =====
+
+def indices_secundarios():
+    return [indice for tabela in db.metadata.sorted_tables
+            for indice in tabela.indexes]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--url', default='sqlite:////tmp/benchmark_indices.db')
+    parser.add_argument('--linhas', type=int, default=1_000_000)
+    parser.add_argument('--usuarios', type=int, default=1000)
+    parser.add_argument('--repeticoes', type=int, default=20)
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+
+    print(f"🔄 Recriando o esquema em {engine.url!r} (sem índices secundários)...")
+    with engine.begin() as conexao:
+        db.metadata.drop_all(conexao)
+        for tabela in db.metadata.sorted_tables:
+            # Cria tabela a tabela: sem o evento after_create do metadata
+            # (a busca textual não entra no benchmark)
+            tabela.create(conexao)
+        for indice in indices_secundarios():
+            indice.drop(conexao)
+
+    print(f"🔄 Gerando {args.linhas:,} transações para {args.usuarios:,} usuários...")
+    inicio = time.perf_counter()
+    gerar_massa(engine, args.linhas, args.usuarios)
+    print(f"✅ Massa gerada em {time.perf_counter() - inicio:.1f}s")
+
+    with engine.begin() as conexao:
+        conexao.execute(text('ANALYZE'))
+    antes = medir(engine, args.usuarios, args.repeticoes)
+
+    print("🔧 Criando os índices declarados nos modelos...")
+    inicio = time.perf_counter()
+    with engine.begin() as conexao:
+        for indice in indices_secundarios():
+            indice.create(conexao)
+        conexao.execute(text('ANALYZE'))
+    print(f"✅ Índices criados em {time.perf_counter() - inicio:.1f}s")
+    depois = medir(engine, args.usuarios, args.repeticoes)
+
+    print()
+    print(f"{'Consulta':<40} {'Antes (ms)':>12} {'Depois (ms)':>12} {'Ganho':>8}")
+    print('-' * 76)
+    for nome in antes:
+        a, d = antes[nome]['ms'], depois[nome]['ms']
+        print(f"{nome:<40} {a:>12.2f} {d:>12.2f} {a / max(d, 1e-6):>7.0f}x")
+
+    print()
+    print("📋 Planos de execução")
+    for nome in antes:
+        print(f"\n{nome}")
+        print(f"   antes:  {antes[nome]['plano']}")
+        print(f"   depois: {depois[nome]['plano']}")
+
+    engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+"""
+Busca textual nas descrições de transações, compras no cartão e
+movimentações bancárias.
+
+- SQLite (desenvolvimento): uma tabela virtual FTS5 (`busca_texto`)
+  mantida em sincronia por triggers de INSERT, UPDATE e DELETE nas três
+  tabelas. O rowid da FTS codifica a origem (registro_id * 4 + origem),
+  então cada trigger atualiza a linha certa sem varrer o índice.
+- PostgreSQL (produção): índices GIN sobre to_tsvector('portuguese',
+  descricao) em cada tabela; a própria tabela é a fonte, então não há
+  nada a sincronizar. A consulta usa to_tsquery com prefixo (:*) em cada
+  palavra, para encontrar o mesmo que o SQLite.
+
+O índice é instalado depois de db.create_all() (evento after_create) e
+também pela migração 006 (migracoes.py) em bancos já existentes.
+"""
+
+import re
+
+from sqlalchemy import event, text
+
+from models import db, de_centavos
+
+# Código de cada tabela indexada (fica nos 2 bits baixos do rowid da FTS)
+ORIGENS = {
+    1: 'transacao',
+    2: 'compra_cartao',
+    3: 'movimentacao_banco',
+}
+
+LIMITE_PADRAO = 20
+LIMITE_MAXIMO = 100
+
+# ===== SQLITE (FTS5) =====
+
+_SQLITE_TABELA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS busca_texto USING fts5(
+    descricao,
+    usuario,
+    data UNINDEXED,
+    valor UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+)
+'''
+
+# (tabela, código, expressão do usuário, coluna de data, coluna de valor).
+# O usuário é gravado como o token 'u<id>' numa coluna indexada, para que o
+# filtro por usuário seja resolvido pelo próprio índice FTS junto com o termo.
+_SQLITE_FONTES = [
+    ('transacoes', 1, '{r}.usuario_id', 'data', 'valor'),
+    ('compras_cartao', 2, '{r}.usuario_id', 'data_compra', 'valor_total'),
+    ('movimentacoes_banco', 3,
+     '(SELECT usuario_id FROM bancos WHERE id = {r}.banco_id)', 'data', 'valor'),
+]
+
+
+def _sqlite_insert(tabela, codigo, usuario, data, valor, r):
+    return (f"INSERT INTO busca_texto "
+            f"(rowid, descricao, usuario, data, valor) "
+            f"SELECT {r}.id * 4 + {codigo}, {r}.descricao, "
+            f"'u' || {usuario.format(r=r)}, {r}.{data}, {r}.{valor}")
+
+
+def _sqlite_ddl():
+    """DDL da tabela FTS e dos triggers de sincronia"""
+    comandos = [_SQLITE_TABELA]
+    for tabela, codigo, usuario, data, valor in _SQLITE_FONTES:
+        apagar = f"DELETE FROM busca_texto WHERE rowid = old.id * 4 + {codigo};"
+        inserir = _sqlite_insert(tabela, codigo, usuario, data, valor, 'new') + ';'
+        comandos += [
+            f"CREATE TRIGGER IF NOT EXISTS {tabela}_busca_ai AFTER INSERT "
+            f"ON {tabela} BEGIN {inserir} END",
+            f"CREATE TRIGGER IF NOT EXISTS {tabela}_busca_ad AFTER DELETE "
+            f"ON {tabela} BEGIN {apagar} END",
+            f"CREATE TRIGGER IF NOT EXISTS {tabela}_busca_au AFTER UPDATE "
+            f"ON {tabela} BEGIN {apagar} {inserir} END",
+        ]
+    return comandos
+
+
+def _sqlite_reconstruir(conexao):
+    """Preenche a FTS com o conteúdo atual das três tabelas"""
+    conexao.execute(text("DELETE FROM busca_texto"))
+    for tabela, codigo, usuario, data, valor in _SQLITE_FONTES:
+        conexao.execute(text(
+            _sqlite_insert(tabela, codigo, usuario, data, valor, tabela)
+            + f" FROM {tabela}"))
+
+
+def _sqlite_termo(usuario_id, consulta):
+    """
+    Converte o texto digitado em uma consulta FTS5 segura.
+
+    Cada palavra vira um termo entre aspas com busca por prefixo
+    ("netf"*), então operadores e aspas digitados não quebram a sintaxe.
+    Retorna None quando não sobra nenhuma palavra.
+    """
+    palavras = re.findall(r'\w+', consulta)
+    if not palavras:
+        return None
+    termos = ' '.join(f'"{p}"*' for p in palavras)
+    return f'usuario:"u{int(usuario_id)}" AND descricao:({termos})'
+
+
+# ===== POSTGRESQL (tsvector + GIN) =====
+
+_POSTGRES_FONTES = [
+    ('transacoes', 1),
+    ('compras_cartao', 2),
+    ('movimentacoes_banco', 3),
+]
+
+
+def _postgres_ddl():
+    return [
+        f"CREATE INDEX IF NOT EXISTS ix_{tabela}_descricao_busca ON {tabela} "
+        f"USING GIN (to_tsvector('portuguese', descricao))"
+        for tabela, _ in _POSTGRES_FONTES
+    ]
+
+
+def _postgres_termo(consulta):
+    """
+    Converte o texto digitado em uma consulta to_tsquery segura, com as
+    mesmas palavras e a mesma busca por prefixo do SQLite: 'netf':* & ...
+    Retorna None quando não sobra nenhuma palavra.
+    """
+    palavras = re.findall(r'\w+', consulta)
+    if not palavras:
+        return None
+    return ' & '.join(f"'{p}':*" for p in palavras)
+
+
+_POSTGRES_BUSCA = '''
+WITH consulta AS (SELECT to_tsquery('portuguese', :termo) AS q)
+SELECT origem, id, descricao, data, valor, rank FROM (
+    SELECT 1 AS origem, t.id, t.descricao, t.data, t.valor,
+           ts_rank(to_tsvector('portuguese', t.descricao), consulta.q) AS rank
+    FROM transacoes t, consulta
+    WHERE t.usuario_id = :usuario_id
+      AND to_tsvector('portuguese', t.descricao) @@ consulta.q
+    UNION ALL
+    SELECT 2, c.id, c.descricao, c.data_compra, c.valor_total,
+           ts_rank(to_tsvector('portuguese', c.descricao), consulta.q)
+    FROM compras_cartao c, consulta
+    WHERE c.usuario_id = :usuario_id
+      AND to_tsvector('portuguese', c.descricao) @@ consulta.q
+    UNION ALL
+    SELECT 3, m.id, m.descricao, m.data, m.valor,
+           ts_rank(to_tsvector('portuguese', m.descricao), consulta.q)
+    FROM movimentacoes_banco m JOIN bancos b ON b.id = m.banco_id, consulta
+    WHERE b.usuario_id = :usuario_id
+      AND to_tsvector('portuguese', m.descricao) @@ consulta.q
+) resultados
+ORDER BY rank DESC, data DESC
+LIMIT :limite
+'''
+
+
+# ===== INSTALAÇÃO =====
+
+def instalar_indice_busca(conexao):
+    """Cria (se faltar) o índice de busca do banco atual"""
+    dialeto = conexao.dialect.name
+
+    if dialeto == 'sqlite':
+        existia = conexao.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE name = 'busca_texto'")).first()
+        for ddl in _sqlite_ddl():
+            conexao.execute(text(ddl))
+        if not existia:
+            _sqlite_reconstruir(conexao)
+
+    elif dialeto == 'postgresql':
+        for ddl in _postgres_ddl():
+            conexao.execute(text(ddl))
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _criar_indice_busca(metadata, conexao, **kwargs):
+    instalar_indice_busca(conexao)
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def _remover_indice_busca(metadata, conexao, **kwargs):
+    # A FTS não faz parte do metadata; sem isso ela sobreviveria ao drop_all
+    if conexao.dialect.name == 'sqlite':
+        conexao.execute(text("DROP TABLE IF EXISTS busca_texto"))
+
+
+# ===== BUSCA =====
+
+def buscar_descricoes(usuario_id, consulta, limite=LIMITE_PADRAO):
+    """
+    Busca `consulta` nas descrições das três tabelas do usuário.
+
+    Retorna uma lista de dicionários ordenada por relevância, cada um com
+    origem, id, descricao, data, valor e rank (maior = mais relevante).
+    """
+    consulta = (consulta or '').strip()
+    if not consulta:
+        return []
+
+    limite = max(1, min(limite, LIMITE_MAXIMO))
+    dialeto = db.session.get_bind().dialect.name
+
+    if dialeto == 'sqlite':
+        termo = _sqlite_termo(usuario_id, consulta)
+        if not termo:
+            return []
+        # bm25() é negativo: quanto menor, mais relevante.
+        # Peso 0 na coluna usuario para ela não influenciar o ranking.
+        linhas = db.session.execute(text('''
+            SELECT rowid % 4 AS origem, rowid / 4 AS id, descricao,
+                   data, valor, -bm25(busca_texto, 1.0, 0.0) AS rank
+            FROM busca_texto
+            WHERE busca_texto MATCH :termo
+            ORDER BY bm25(busca_texto, 1.0, 0.0), data DESC
+            LIMIT :limite
+        '''), {'termo': termo, 'limite': limite})
+
+    elif dialeto == 'postgresql':
+        termo = _postgres_termo(consulta)
+        if not termo:
+            return []
+        linhas = db.session.execute(text(_POSTGRES_BUSCA), {
+            'termo': termo, 'usuario_id': usuario_id, 'limite': limite})
+
+    else:
+        raise NotImplementedError(
+            f"Banco de dados '{dialeto}' não suporta busca textual")
+
+    return [{
+        'origem': ORIGENS[linha.origem],
+        'id': linha.id,
+        'descricao': linha.descricao,
+        'data': str(linha.data),
+        # SQL puro não passa pelo tipo Dinheiro: o valor vem em centavos
+        'valor': de_centavos(linha.valor),
+        'rank': round(float(linha.rank), 4)
+    } for linha in linhas]
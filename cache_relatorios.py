@@ -0,0 +1,114 @@
+"""
+Cache dos resultados de relatórios e orçamentos.
+
+Cada usuário tem um contador `versao_dados` (tabela usuarios) que sobe a
+cada escrita nos dados que os relatórios leem: transações (pelo ORM ou
+em lote), categorias, orçamentos, compras no cartão e bancos. A chave do
+cache inclui essa versão, então um resultado antigo simplesmente deixa de
+ser encontrado depois de qualquer escrita, sem chamadas de invalidação
+espalhadas pelas rotas.
+
+O cache fica na memória do processo (LRU com tamanho fixo). Com vários
+workers cada um tem o seu, mas todos leem a mesma versão do banco, então
+nenhum serve dado velho.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, Banco, Categoria, CompraCartao, Orcamento, Transacao, Usuario
+
+TAMANHO_CACHE = 512
+
+# Modelos cujas escritas mudam o resultado de algum relatório
+MODELOS_VERSIONADOS = (Transacao, Categoria, Orcamento, CompraCartao, Banco)
+
+
+# ===== VERSÃO DOS DADOS =====
+
+def incrementar_versao(usuario_ids, conexao=None):
+    """Soma 1 à versao_dados dos usuários, no próprio banco"""
+    usuario_ids = set(usuario_ids)
+    if not usuario_ids:
+        return
+
+    usuarios = Usuario.__table__
+    (conexao or db.session).execute(
+        usuarios.update().where(usuarios.c.id.in_(usuario_ids)).values(
+            versao_dados=usuarios.c.versao_dados + 1))
+
+
+def versao_dados(usuario_id):
+    """Versão atual dos dados do usuário (uma leitura pela chave primária)"""
+    return db.session.query(Usuario.versao_dados).filter(
+        Usuario.id == usuario_id).scalar() or 0
+
+
+@event.listens_for(Session, 'after_flush')
+def _incrementar_versao_alterados(sessao, contexto):
+    usuarios_apagados = {obj.id for obj in sessao.deleted if isinstance(obj, Usuario)}
+    alterados = [obj for obj in sessao.dirty if sessao.is_modified(obj)]
+
+    usuario_ids = {
+        obj.usuario_id
+        for obj in (*sessao.new, *sessao.deleted, *alterados)
+        if isinstance(obj, MODELOS_VERSIONADOS)
+    } - usuarios_apagados - {None}
+
+    incrementar_versao(usuario_ids, sessao.connection())
+
+
+# ===== CACHE LRU =====
+
+class CacheLRU:
+    """Dicionário limitado que descarta o item usado há mais tempo"""
+
+    def __init__(self, tamanho):
+        self.tamanho = tamanho
+        self.itens = OrderedDict()
+        self.trava = Lock()
+        self.acertos = 0
+        self.falhas = 0
+
+    def obter(self, chave):
+        """(True, valor) se a chave está no cache, senão (False, None)"""
+        with self.trava:
+            if chave not in self.itens:
+                self.falhas += 1
+                return False, None
+            self.itens.move_to_end(chave)
+            self.acertos += 1
+            return True, self.itens[chave]
+
+    def guardar(self, chave, valor):
+        with self.trava:
+            self.itens[chave] = valor
+            self.itens.move_to_end(chave)
+            while len(self.itens) > self.tamanho:
+                self.itens.popitem(last=False)
+
+    def limpar(self):
+        with self.trava:
+            self.itens.clear()
+            self.acertos = self.falhas = 0
+
+
+cache = CacheLRU(TAMANHO_CACHE)
+
+
+def em_cache(nome, usuario_id, parametros, calcular):
+    """
+    Resultado de `calcular()` para (nome, usuário, parâmetros, versão dos
+    dados). Num acerto a única consulta é a da versão do usuário.
+    """
+    chave = (nome, usuario_id, tuple(sorted(parametros.items())),
+             versao_dados(usuario_id))
+
+    encontrado, valor = cache.obter(chave)
+    if not encontrado:
+        valor = calcular()
+        cache.guardar(chave, valor)
+    return valor
@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from app import app, db
+from app import app
+from migracoes import aplicar_migracoes
 import sys
 sys.path.insert(0, '/home/vanderson/Projects/meu_app_financeiro')
 
@@ -9,7 +10,7 @@ sys.path.insert(0, '/home/vanderson/Projects/meu_app_financeiro')
 print("🔄 Criando/Atualizando banco de dados...")
 
 with app.app_context():
-    db.create_all()
+    aplicar_migracoes()
     print("✅ Banco de dados criado/atualizado com sucesso!")
     print("📊 Tabelas existentes:")
     print("  ✅ usuario")
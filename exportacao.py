@@ -0,0 +1,324 @@
+"""
+Exportação de transações e movimentações bancárias em CSV, OFX, XLSX e PDF.
+
+As funções de CSV e OFX são geradores: recebem as linhas já em streaming
+(ver `linhas_em_streaming`) e devolvem o arquivo em pedaços de texto,
+para serem enviados com stream_with_context. As de XLSX e PDF escrevem
+num arquivo aberto em modo binário, linha a linha, e são usadas pelos
+relatórios gerados em segundo plano (tarefas.py). Nada é materializado
+em memória, então exportar 100 linhas ou 5 milhões custa a mesma memória.
+"""
+
+import csv
+import io
+import re
+import zipfile
+from datetime import datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from models import db
+
+# Quantas linhas o cursor do banco traz por vez
+LOTE_EXPORTACAO = 1000
+
+# Quantas linhas do CSV são acumuladas antes de enviar um pedaço
+LINHAS_POR_PEDACO = 500
+
+
+def linhas_em_streaming(stmt, tamanho_lote=LOTE_EXPORTACAO):
+    """
+    Executa o SELECT com yield_per, lendo o resultado em lotes.
+
+    No PostgreSQL isso usa um cursor do lado do servidor (stream_results);
+    no SQLite o cursor já é lido sob demanda.
+    """
+    resultado = db.session.execute(
+        stmt.execution_options(yield_per=tamanho_lote))
+    try:
+        for linha in resultado:
+            yield linha
+    finally:
+        resultado.close()
+
+
+def formatar_valor(valor):
+    """1234.5 -> '1234,50' (formato de planilha brasileira)"""
+    return f'{valor:.2f}'.replace('.', ',')
+
+
+# ===== CSV =====
+
+def gerar_csv(cabecalho, linhas):
+    """
+    Gera um CSV (separador ';', decimal com vírgula, UTF-8 com BOM para o
+    Excel reconhecer os acentos) em pedaços de LINHAS_POR_PEDACO linhas.
+
+    `linhas` deve produzir sequências já na ordem do cabeçalho.
+    """
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=';', lineterminator='\r\n')
+
+    buffer.write('\ufeff')
+    escritor.writerow(cabecalho)
+
+    for numero, linha in enumerate(linhas, start=1):
+        escritor.writerow(linha)
+        if numero % LINHAS_POR_PEDACO == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+
+    yield buffer.getvalue()
+
+
+# ===== OFX =====
+
+def _ofx_texto(texto):
+    """Escapa os caracteres especiais do SGML do OFX"""
+    return (str(texto or '').replace('&', '&amp;')
+            .replace('<', '&lt;').replace('>', '&gt;'))
+
+
+def _ofx_data(data):
+    return data.strftime('%Y%m%d')
+
+
+def gerar_ofx(lancamentos, inicio, fim, conta='CARTEIRA'):
+    """
+    Gera um extrato OFX 1.02 (SGML).
+
+    `lancamentos` produz tuplas (fitid, data, valor, descricao), com valor
+    positivo para entradas e negativo para saídas. `inicio` e `fim` são o
+    período do extrato (DTSTART/DTEND).
+    """
+    agora = datetime.now().strftime('%Y%m%d%H%M%S')
+
+    yield (
+        'OFXHEADER:100\r\n'
+        'DATA:OFXSGML\r\n'
+        'VERSION:102\r\n'
+        'SECURITY:NONE\r\n'
+        'ENCODING:UTF-8\r\n'
+        'CHARSET:NONE\r\n'
+        'COMPRESSION:NONE\r\n'
+        'OLDFILEUID:NONE\r\n'
+        'NEWFILEUID:NONE\r\n'
+        '\r\n'
+        '<OFX>\r\n'
+        '<SIGNONMSGSRSV1><SONRS>'
+        '<STATUS><CODE>0<SEVERITY>INFO</STATUS>'
+        f'<DTSERVER>{agora}<LANGUAGE>POR'
+        '</SONRS></SIGNONMSGSRSV1>\r\n'
+        '<BANKMSGSRSV1><STMTTRNRS><TRNUID>1'
+        '<STATUS><CODE>0<SEVERITY>INFO</STATUS>\r\n'
+        '<STMTRS><CURDEF>BRL\r\n'
+        f'<BANKACCTFROM><BANKID>0<ACCTID>{_ofx_texto(conta)}'
+        '<ACCTTYPE>CHECKING</BANKACCTFROM>\r\n'
+        f'<BANKTRANLIST><DTSTART>{_ofx_data(inicio)}'
+        f'<DTEND>{_ofx_data(fim)}\r\n'
+    )
+
+    pedaco = []
+    for fitid, data, valor, descricao in lancamentos:
+        pedaco.append(
+            '<STMTTRN>'
+            f'<TRNTYPE>{"CREDIT" if valor >= 0 else "DEBIT"}'
+            f'<DTPOSTED>{_ofx_data(data)}'
+            f'<TRNAMT>{valor:.2f}'
+            f'<FITID>{fitid}'
+            f'<MEMO>{_ofx_texto(descricao)}'
+            '</STMTTRN>\r\n')
+        if len(pedaco) == LINHAS_POR_PEDACO:
+            yield ''.join(pedaco)
+            pedaco = []
+
+    yield ''.join(pedaco) + (
+        '</BANKTRANLIST>\r\n'
+        '</STMTRS></STMTTRNRS></BANKMSGSRSV1>\r\n'
+        '</OFX>\r\n'
+    )
+
+
+# ===== XLSX =====
+
+# Caracteres de controle não são aceitos no XML da planilha
+_CONTROLE_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+_XLSX_TIPOS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" '
+    'ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/'
+    'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '{planilhas}</Types>')
+
+_XLSX_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/'
+    'officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>')
+
+
+def _xlsx_celula(valor):
+    if isinstance(valor, bool) or valor is None:
+        valor = '' if valor is None else str(valor)
+    if isinstance(valor, (int, float, Decimal)):
+        return f'<c><v>{valor}</v></c>'
+    texto = escape(_CONTROLE_XML.sub('', str(valor)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{texto}</t></is></c>'
+
+
+def _xlsx_linha(valores):
+    return '<row>' + ''.join(_xlsx_celula(v) for v in valores) + '</row>'
+
+
+def escrever_xlsx(arquivo, planilhas):
+    """
+    Escreve uma planilha XLSX (Office Open XML) em `arquivo`.
+
+    `planilhas` é uma lista de (nome, cabecalho, linhas); cada `linhas`
+    é consumida uma vez, gravando direto no zip, sem montar a planilha
+    em memória. Valores numéricos viram células numéricas; o resto, texto.
+    """
+    with zipfile.ZipFile(arquivo, 'w', zipfile.ZIP_DEFLATED) as pacote:
+        for numero, (_, cabecalho, linhas) in enumerate(planilhas, start=1):
+            with pacote.open(f'xl/worksheets/sheet{numero}.xml', 'w',
+                             force_zip64=True) as folha:
+                folha.write(
+                    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                    '<worksheet xmlns="http://schemas.openxmlformats.org/'
+                    'spreadsheetml/2006/main"><sheetData>'.encode())
+                folha.write(_xlsx_linha(cabecalho).encode())
+
+                pedaco = []
+                for linha in linhas:
+                    pedaco.append(_xlsx_linha(linha))
+                    if len(pedaco) == LINHAS_POR_PEDACO:
+                        folha.write(''.join(pedaco).encode())
+                        pedaco = []
+                folha.write((''.join(pedaco) + '</sheetData></worksheet>').encode())
+
+        pacote.writestr('[Content_Types].xml', _XLSX_TIPOS.format(planilhas=''.join(
+            f'<Override PartName="/xl/worksheets/sheet{numero}.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.'
+            'spreadsheetml.worksheet+xml"/>'
+            for numero in range(1, len(planilhas) + 1))))
+        pacote.writestr('_rels/.rels', _XLSX_RELS)
+        pacote.writestr('xl/workbook.xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            '<sheets>' + ''.join(
+                f'<sheet name="{escape(nome[:31], {chr(34): "&quot;"})}" '
+                f'sheetId="{numero}" r:id="rId{numero}"/>'
+                for numero, (nome, _, _) in enumerate(planilhas, start=1))
+            + '</sheets></workbook>'))
+        pacote.writestr('xl/_rels/workbook.xml.rels', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            + ''.join(
+                f'<Relationship Id="rId{numero}" Type="http://schemas.openxmlformats.org/'
+                'officeDocument/2006/relationships/worksheet" '
+                f'Target="worksheets/sheet{numero}.xml"/>'
+                for numero in range(1, len(planilhas) + 1))
+            + '</Relationships>'))
+
+
+# ===== PDF =====
+
+PDF_LARGURA, PDF_ALTURA = 595, 842  # A4 em pontos
+PDF_MARGEM = 40
+PDF_FONTE = 8
+PDF_ENTRELINHA = 11
+PDF_LINHAS_POR_PAGINA = (PDF_ALTURA - 2 * PDF_MARGEM) // PDF_ENTRELINHA
+
+
+def _pdf_texto(texto):
+    """Texto em WinAnsi (acentos do português) com ( ) e \\ escapados"""
+    texto = str(texto).replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    return texto.encode('cp1252', errors='replace')
+
+
+def _pdf_colunas(valores, larguras):
+    """Linha de largura fixa (a fonte é Courier): cada valor cortado na sua coluna"""
+    return ' '.join(str(v)[:largura].ljust(largura)
+                    for v, largura in zip(valores, larguras)).rstrip()
+
+
+class _EscritorPDF:
+    """Escreve os objetos do PDF em sequência, guardando as posições para o xref"""
+
+    def __init__(self, arquivo):
+        self.arquivo = arquivo
+        self.posicao = 0
+        self.posicoes = {}
+        self.proximo_id = 4  # 1: catálogo, 2: páginas, 3: fonte
+        self.paginas = []
+
+    def escrever(self, dados):
+        self.arquivo.write(dados)
+        self.posicao += len(dados)
+
+    def objeto(self, numero, corpo):
+        self.posicoes[numero] = self.posicao
+        self.escrever(f'{numero} 0 obj\n'.encode() + corpo + b'\nendobj\n')
+
+    def pagina(self, linhas):
+        conteudo = b'BT /F1 %d Tf %d TL %d %d Td\n' % (
+            PDF_FONTE, PDF_ENTRELINHA, PDF_MARGEM, PDF_ALTURA - PDF_MARGEM)
+        conteudo += b''.join(b'(' + _pdf_texto(linha) + b') Tj T*\n' for linha in linhas)
+        conteudo += b'ET'
+
+        id_conteudo, id_pagina = self.proximo_id, self.proximo_id + 1
+        self.proximo_id += 2
+        self.objeto(id_conteudo, b'<< /Length %d >>\nstream\n' % len(conteudo)
+                    + conteudo + b'\nendstream')
+        self.objeto(id_pagina, (
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PDF_LARGURA} {PDF_ALTURA}] '
+            f'/Contents {id_conteudo} 0 R /Resources << /Font << /F1 3 0 R >> >> >>'
+        ).encode())
+        self.paginas.append(id_pagina)
+
+    def fechar(self):
+        self.objeto(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        self.objeto(2, ('<< /Type /Pages /Kids [%s] /Count %d >>' % (
+            ' '.join(f'{p} 0 R' for p in self.paginas), len(self.paginas))).encode())
+        self.objeto(3, b'<< /Type /Font /Subtype /Type1 /BaseFont /Courier '
+                       b'/Encoding /WinAnsiEncoding >>')
+
+        inicio_xref = self.posicao
+        total = self.proximo_id
+        self.escrever(b'xref\n0 %d\n0000000000 65535 f \n' % total)
+        self.escrever(b''.join(b'%010d 00000 n \n' % self.posicoes[numero]
+                               for numero in range(1, total)))
+        self.escrever(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+                      % (total, inicio_xref))
+
+
+def escrever_pdf(arquivo, titulo, secoes):
+    """
+    Escreve um PDF de texto (A4, Courier) em `arquivo`.
+
+    `secoes` é uma lista de (titulo, cabecalho, larguras, linhas), com a
+    largura em caracteres de cada coluna. Cada página é gravada assim que
+    fica cheia, então só uma página por vez fica em memória.
+    """
+    pdf = _EscritorPDF(arquivo)
+    pdf.escrever(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    pagina = [titulo, '']
+    for titulo_secao, cabecalho, larguras, linhas in secoes:
+        cabecalho = _pdf_colunas(cabecalho, larguras)
+        pagina += ['', titulo_secao, cabecalho, '-' * len(cabecalho)]
+        for linha in linhas:
+            if len(pagina) >= PDF_LINHAS_POR_PAGINA:
+                pdf.pagina(pagina)
+                pagina = [cabecalho, '-' * len(cabecalho)]
+            pagina.append(_pdf_colunas(linha, larguras))
+
+    pdf.pagina(pagina)
+    pdf.fechar()
@@ -0,0 +1,187 @@
+"""
+Faturas do cartão de crédito e o livro de parcelas (TransacaoFatura).
+
+Cada compra no cartão é lançada como uma linha de TransacaoFatura por
+parcela, presa à fatura do mês em que aquela parcela é cobrada: a 1ª
+parcela entra na fatura da data da compra (respeitando o dia de
+fechamento) e cada parcela seguinte na fatura do mês seguinte.
+
+Assim o total de uma fatura, o calendário de parcelas e o detalhe de uma
+fatura saem de consultas com índice (fatura_id, compra_cartao_id) em vez
+de reexpandir as compras em Python.
+
+Os totais das faturas só mudam por somar_nas_faturas, um upsert atômico
+na chave única (usuario_id, cartao_id, ano, mes).
+
+As funções daqui não fazem commit; quem chama decide a transação.
+"""
+
+from calendar import monthrange
+from datetime import date
+
+from dateutil.relativedelta import relativedelta
+from models import (
+    db, FaturaCartao, PagamentoFatura, TransacaoFatura, insert_com_conflito,
+    para_centavos, de_centavos
+)
+
+
+# ===== CALENDÁRIO =====
+
+def competencia_fatura(cartao, data_compra):
+    """(mes, ano) da fatura em que uma compra do cartão entra"""
+    if data_compra.day <= cartao.dia_fechamento:
+        return data_compra.month, data_compra.year
+    proximo_mes = data_compra + relativedelta(months=1)
+    return proximo_mes.month, proximo_mes.year
+
+
+def datas_fatura(cartao, mes, ano):
+    """
+    (data_fechamento, data_vencimento) da fatura do mês.
+    A fatura fecha no mês da competência e vence no mês seguinte.
+    """
+    _, ultimo_dia = monthrange(ano, mes)
+    data_fechamento = date(ano, mes, min(cartao.dia_fechamento, ultimo_dia))
+
+    vencimento = date(ano, mes, 1) + relativedelta(months=1)
+    _, ultimo_dia_venc = monthrange(vencimento.year, vencimento.month)
+    data_vencimento = vencimento.replace(
+        day=min(cartao.dia_vencimento, ultimo_dia_venc))
+
+    return data_fechamento, data_vencimento
+
+
+def valores_parcelas(valor_total, quantidade):
+    """
+    Divide o valor em `quantidade` parcelas exatas em centavos.
+    Os centavos que sobram da divisão ficam na 1ª parcela.
+    """
+    quantidade = max(1, quantidade or 1)
+    base, resto = divmod(para_centavos(valor_total), quantidade)
+    return [de_centavos(base + resto)] + [de_centavos(base)] * (quantidade - 1)
+
+
+def parcelas_da_compra(cartao, valor_total, quantidade, data_compra):
+    """Lista de (numero_parcela, (mes, ano), valor) de uma compra"""
+    mes, ano = competencia_fatura(cartao, data_compra)
+    primeira = date(ano, mes, 1)
+
+    parcelas = []
+    for numero, valor in enumerate(valores_parcelas(valor_total, quantidade), start=1):
+        competencia = primeira + relativedelta(months=numero - 1)
+        parcelas.append((numero, (competencia.month, competencia.year), valor))
+    return parcelas
+
+
+# ===== FATURAS =====
+
+def somar_nas_faturas(cartao, valores):
+    """
+    Soma valores às faturas do cartão: `valores` é {(mes, ano): valor},
+    com valor negativo para abater. Retorna {(mes, ano): FaturaCartao}.
+
+    É um único INSERT ... ON CONFLICT DO UPDATE pela chave única
+    (usuario_id, cartao_id, ano, mes): faturas que não existem são
+    criadas e as existentes recebem valor_total = valor_total + valor no
+    próprio banco, então dois workers lançando compras no mesmo cartão
+    ao mesmo tempo não duplicam a fatura nem perdem atualização.
+    """
+    valores = {competencia: valor for competencia, valor in valores.items() if valor}
+    if not valores:
+        return {}
+
+    hoje = date.today()
+    linhas = []
+    for (mes, ano), valor in valores.items():
+        data_fechamento, data_vencimento = datas_fatura(cartao, mes, ano)
+        linhas.append({
+            'usuario_id': cartao.usuario_id, 'cartao_id': cartao.id,
+            'mes': mes, 'ano': ano,
+            'data_fechamento': data_fechamento, 'data_vencimento': data_vencimento,
+            'valor_total': valor, 'valor_pago': 0, 'valor_restante': valor,
+            'status': 'atrasada' if data_vencimento < hoje else 'aberta'})
+
+    stmt = insert_com_conflito(FaturaCartao).values(linhas)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['usuario_id', 'cartao_id', 'ano', 'mes'],
+        set_={
+            'valor_total': FaturaCartao.valor_total + stmt.excluded.valor_total,
+            'valor_restante': FaturaCartao.valor_total + stmt.excluded.valor_total
+            - db.func.coalesce(FaturaCartao.valor_pago, 0),
+            'status': db.case(
+                (db.and_(FaturaCartao.status == 'aberta',
+                         FaturaCartao.data_vencimento < hoje), 'atrasada'),
+                else_=FaturaCartao.status),
+        }).returning(FaturaCartao)
+
+    faturas = db.session.scalars(
+        stmt, execution_options={'populate_existing': True}).all()
+    return {(f.mes, f.ano): f for f in faturas}
+
+
+# ===== LIVRO DE PARCELAS =====
+
+def lancar_parcelas(cartao, compras):
+    """
+    Lança as parcelas de uma ou mais compras do mesmo cartão.
+
+    `compras` pode ter objetos CompraCartao ou linhas com id, valor_total,
+    quantidade_parcelas e data_compra. Todas as parcelas vão num único
+    INSERT em lote e cada fatura tocada recebe a soma de uma vez.
+    """
+    linhas = []
+    totais = {}
+
+    for compra in compras:
+        for numero, competencia, valor in parcelas_da_compra(
+                cartao, compra.valor_total, compra.quantidade_parcelas,
+                compra.data_compra):
+            totais[competencia] = totais.get(competencia, 0) + valor
+            linhas.append((competencia, compra.id, numero, valor))
+
+    if not linhas:
+        return
+
+    faturas = somar_nas_faturas(cartao, totais)
+
+    db.session.execute(db.insert(TransacaoFatura), [
+        {'fatura_id': faturas[competencia].id, 'compra_cartao_id': compra_id,
+         'numero_parcela': numero, 'valor_parcela': valor}
+        for competencia, compra_id, numero, valor in linhas
+    ])
+
+
+def estornar_parcelas(compra):
+    """
+    Retira das faturas as parcelas já lançadas de uma compra (antes de
+    editá-la ou apagá-la). Faturas que ficam zeradas, sem pagamento e
+    sem outras parcelas são removidas.
+    """
+    por_competencia = db.session.query(
+        FaturaCartao.mes, FaturaCartao.ano,
+        db.func.sum(TransacaoFatura.valor_parcela)
+    ).join(
+        FaturaCartao, TransacaoFatura.fatura_id == FaturaCartao.id
+    ).filter(
+        TransacaoFatura.compra_cartao_id == compra.id
+    ).group_by(FaturaCartao.mes, FaturaCartao.ano).all()
+
+    if not por_competencia:
+        return
+
+    db.session.execute(db.delete(TransacaoFatura).where(
+        TransacaoFatura.compra_cartao_id == compra.id))
+
+    faturas = somar_nas_faturas(compra.cartao, {
+        (mes, ano): -total for mes, ano, total in por_competencia})
+
+    for fatura in faturas.values():
+        if fatura.valor_total > 0:
+            continue
+        em_uso = db.session.query(
+            db.exists().where(PagamentoFatura.fatura_id == fatura.id)
+            | db.exists().where(TransacaoFatura.fatura_id == fatura.id)
+        ).scalar()
+        if not em_uso:
+            db.session.delete(fatura)
@@ -0,0 +1,192 @@
+"""
+Leitura de extratos bancários (CSV e OFX) para importação em lote.
+
+Os leitores são geradores: percorrem o arquivo linha a linha e produzem
+dicionários normalizados (data, descricao, valor, tipo, categoria), sem
+carregar o arquivo inteiro. A gravação em lotes fica em app.py
+(importar_extrato), que também recebe o parse_valor usado aqui.
+"""
+
+import csv
+import hashlib
+import re
+from datetime import datetime
+from functools import lru_cache
+
+# Quantas linhas são gravadas por lote (um INSERT e um commit por lote)
+TAMANHO_LOTE_IMPORTACAO = 2000
+
+# Nomes aceitos no cabeçalho do CSV (comparados sem acento e em minúsculas)
+COLUNAS_CSV = {
+    'data': ('data', 'date', 'data lancamento', 'data do lancamento'),
+    'descricao': ('descricao', 'historico', 'lancamento', 'description',
+                  'memo', 'estabelecimento'),
+    'valor': ('valor', 'amount', 'value', 'valor (r$)'),
+    'tipo': ('tipo', 'type'),
+    'categoria': ('categoria', 'category'),
+}
+
+FORMATOS_DATA = ('%d/%m/%Y', '%Y-%m-%d', '%d/%m/%y', '%d-%m-%Y')
+
+_SEM_ACENTO = str.maketrans('áàâãéêíóôõúüç', 'aaaaeeiooouuc')
+
+
+class ErroImportacao(ValueError):
+    """Arquivo que não pode ser importado (formato ou cabeçalho inválido)"""
+
+
+def _normalizar(texto):
+    return (texto or '').strip().lower().translate(_SEM_ACENTO)
+
+
+@lru_cache(maxsize=4096)
+def ler_data(texto):
+    # Extratos repetem muito as mesmas datas; o cache evita o strptime
+    texto = (texto or '').strip()
+    for formato in FORMATOS_DATA:
+        try:
+            return datetime.strptime(texto, formato).date()
+        except ValueError:
+            continue
+    raise ValueError(f'Data inválida: {texto!r}')
+
+
+def _linha_normalizada(data, descricao, valor, tipo=None, categoria=None):
+    """
+    Monta a linha importada. Sem coluna de tipo, o sinal do valor decide:
+    negativo é Despesa, positivo é Receita. O valor gravado é sempre positivo.
+    """
+    if not valor:
+        # parse_valor devolve zero para textos que não são números
+        raise ValueError('valor inválido')
+
+    tipo = _normalizar(tipo)
+    if tipo in ('receita', 'credito', 'credit', 'entrada', 'c'):
+        tipo = 'Receita'
+    elif tipo in ('despesa', 'debito', 'debit', 'saida', 'd'):
+        tipo = 'Despesa'
+    else:
+        tipo = 'Despesa' if valor < 0 else 'Receita'
+
+    return {
+        'data': data,
+        'descricao': ' '.join((descricao or '').split())[:200] or 'Sem descrição',
+        'valor': abs(valor),
+        'tipo': tipo,
+        'categoria': (categoria or '').strip() or None,
+    }
+
+
+# ===== CSV =====
+
+def ler_csv(arquivo, parse_valor):
+    """
+    Lê um CSV de extrato (separador ';' ou ',') linha a linha.
+
+    Produz um dicionário por linha válida, ou uma string com a mensagem de
+    erro para linhas que não puderam ser lidas (quem chama conta os erros).
+    """
+    primeira = arquivo.readline()
+    if not primeira:
+        return
+    separador = ';' if primeira.count(';') >= primeira.count(',') else ','
+
+    cabecalho = [_normalizar(c) for c in next(csv.reader([primeira], delimiter=separador))]
+    posicoes = {}
+    for campo, nomes in COLUNAS_CSV.items():
+        for i, coluna in enumerate(cabecalho):
+            if coluna in nomes:
+                posicoes[campo] = i
+                break
+
+    faltando = {'data', 'descricao', 'valor'} - posicoes.keys()
+    if faltando:
+        raise ErroImportacao(
+            f"Colunas obrigatórias ausentes: {', '.join(sorted(faltando))}")
+
+    def campo(linha, nome):
+        i = posicoes.get(nome)
+        return linha[i] if i is not None and i < len(linha) else None
+
+    for numero, linha in enumerate(csv.reader(arquivo, delimiter=separador), start=2):
+        if not any(c.strip() for c in linha):
+            continue
+        try:
+            valor_texto = (campo(linha, 'valor') or '').replace('R$', '').replace(' ', '')
+            if not valor_texto:
+                raise ValueError('valor vazio')
+            yield _linha_normalizada(
+                ler_data(campo(linha, 'data')),
+                campo(linha, 'descricao'),
+                parse_valor(valor_texto),
+                campo(linha, 'tipo'),
+                campo(linha, 'categoria'))
+        except (ValueError, TypeError) as e:
+            yield f'Linha {numero}: {e}'
+
+
+# ===== OFX =====
+
+_TAG_OFX = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<\r\n]*)')
+
+
+def ler_ofx(arquivo, parse_valor):
+    """
+    Lê os lançamentos (<STMTTRN>) de um OFX, em SGML (1.x) ou XML (2.x).
+
+    O arquivo é percorrido linha a linha; só o lançamento atual fica em
+    memória.
+    """
+    atual = None
+
+    def emitir(campos):
+        try:
+            return _linha_normalizada(
+                datetime.strptime(campos.get('DTPOSTED', '')[:8], '%Y%m%d').date(),
+                campos.get('MEMO') or campos.get('NAME'),
+                parse_valor(campos.get('TRNAMT', '')))
+        except ValueError as e:
+            return f"Lançamento {campos.get('FITID', '?')}: {e}"
+
+    for linha in arquivo:
+        for fecha, tag, conteudo in _TAG_OFX.findall(linha):
+            tag = tag.upper()
+            if tag == 'STMTTRN':
+                if atual is not None:
+                    yield emitir(atual)
+                atual = None if fecha else {}
+            elif atual is not None and not fecha and conteudo.strip():
+                atual[tag] = conteudo.strip()
+
+    if atual is not None:
+        yield emitir(atual)
+
+
+# ===== DUPLICATAS =====
+
+class HashImportacao:
+    """
+    Calcula o hash de conteúdo (data, valor, descrição, conta) de cada linha.
+
+    Linhas idênticas dentro do mesmo arquivo (dois cafés iguais no mesmo
+    dia) recebem um número de ocorrência, então continuam distintas entre
+    si, mas reimportar o mesmo arquivo gera exatamente os mesmos hashes.
+    """
+
+    def __init__(self, conta):
+        self.conta = conta
+        self.vistos = {}
+
+    def __call__(self, linha):
+        chave = '|'.join([
+            linha['data'].isoformat(),
+            f"{linha['tipo'][0]}{linha['valor']:.2f}",
+            _normalizar(linha['descricao']),
+            self.conta,
+        ]).encode('utf-8')
+        digest = hashlib.sha256(chave).digest()
+
+        ocorrencia = self.vistos.get(digest, 0)
+        self.vistos[digest] = ocorrencia + 1
+
+        return hashlib.sha256(digest + str(ocorrencia).encode()).hexdigest()
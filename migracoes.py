@@ -0,0 +1,603 @@
+"""
+Migrações versionadas do esquema do banco de dados.
+
+Cada migração tem um número de versão, uma descrição e uma função que
+recebe a conexão. As versões aplicadas ficam registradas na tabela
+`schema_version`; `flask db upgrade` aplica apenas as pendentes, em
+ordem, cada uma na sua própria transação.
+
+Importar app.py não executa nenhum DDL: as migrações rodam só no passo
+de release (Procfile) ou manualmente.
+
+Regras para novas migrações:
+- Acrescente sempre no FIM da lista, com o próximo número.
+- A migração 1 cria as tabelas que faltam a partir dos modelos atuais,
+  então em um banco novo as colunas já existem; por isso colunas e
+  índices são criados de forma idempotente (adicionar_coluna e
+  CREATE INDEX IF NOT EXISTS).
+- Tabelas novas criadas depois da migração 1 devem ser criadas com
+  criar_tabela(conexao, 'nome').
+"""
+
+from datetime import date, datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import inspect, text
+from sqlalchemy.sql import sqltypes
+
+from models import db, para_centavos, de_centavos
+from busca import instalar_indice_busca
+from faturas import datas_fatura, parcelas_da_compra
+from resumos import reconstruir_resumos
+from orcamentos import recalcular_gastos
+from regras_recorrencia import proxima_ocorrencia
+
+
+# ===== AUXILIARES =====
+
+def adicionar_coluna(conexao, tabela, coluna, ddl):
+    """Executa o ALTER TABLE só se a coluna ainda não existir"""
+    colunas = {c['name'] for c in inspect(conexao).get_columns(tabela)}
+    if coluna in colunas:
+        return False
+    conexao.execute(text(ddl))
+    return True
+
+
+def criar_indices(conexao, *ddls):
+    for ddl in ddls:
+        conexao.execute(text(ddl))
+
+
+def criar_tabela(conexao, nome):
+    """Cria a tabela do modelo (se ainda não existir)"""
+    db.metadata.tables[nome].create(conexao, checkfirst=True)
+
+
+# ===== MIGRAÇÕES =====
+
+def m001_esquema_inicial(conexao):
+    # Cria só as tabelas que faltam; bancos existentes não são alterados
+    db.metadata.create_all(bind=conexao)
+
+
+def m002_transacoes_cartao_recorrencia(conexao):
+    adicionar_coluna(
+        conexao, 'transacoes', 'cartao_id',
+        'ALTER TABLE transacoes ADD COLUMN cartao_id INTEGER '
+        'REFERENCES cartoes_credito(id)')
+    adicionar_coluna(
+        conexao, 'transacoes', 'recorrencia_id',
+        'ALTER TABLE transacoes ADD COLUMN recorrencia_id INTEGER '
+        'REFERENCES recorrencias(id)')
+
+
+def m003_proxima_ocorrencia(conexao):
+    adicionar_coluna(
+        conexao, 'recorrencias', 'proxima_ocorrencia',
+        'ALTER TABLE recorrencias ADD COLUMN proxima_ocorrencia DATE')
+    criar_indices(
+        conexao,
+        'CREATE INDEX IF NOT EXISTS ix_recorrencias_proxima_ocorrencia '
+        'ON recorrencias (proxima_ocorrencia)')
+
+    # Preencher a próxima ocorrência das recorrências já existentes
+    hoje = date.today()
+    pendentes = conexao.execute(text(
+        'SELECT id, frequencia, dia_vencimento, data_inicio, data_fim '
+        'FROM recorrencias WHERE proxima_ocorrencia IS NULL'
+    ).columns(data_inicio=db.Date, data_fim=db.Date)).all()
+    atualizacoes = [
+        {'id': rec.id, 'proxima': proxima_ocorrencia(rec, hoje)}
+        for rec in pendentes
+    ]
+    if atualizacoes:
+        conexao.execute(text(
+            'UPDATE recorrencias SET proxima_ocorrencia = :proxima '
+            'WHERE id = :id'), atualizacoes)
+
+
+def m004_livro_de_ocorrencias(conexao):
+    criar_indices(
+        conexao,
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_transacoes_recorrencia_data '
+        'ON transacoes (recorrencia_id, data)')
+
+
+def m005_indices_listagem_transacoes(conexao):
+    criar_indices(
+        conexao,
+        'CREATE INDEX IF NOT EXISTS ix_transacoes_usuario_data_id '
+        'ON transacoes (usuario_id, data, id)',
+        'CREATE INDEX IF NOT EXISTS ix_transacoes_usuario_banco_data '
+        'ON transacoes (usuario_id, banco_id, data)')
+    # Em bancos novos a coluna de texto já não existe (ver migração 10)
+    colunas = {c['name'] for c in inspect(conexao).get_columns('transacoes')}
+    if 'categoria' in colunas:
+        criar_indices(
+            conexao,
+            'CREATE INDEX IF NOT EXISTS ix_transacoes_usuario_categoria_data '
+            'ON transacoes (usuario_id, categoria, data)')
+
+
+def m006_busca_textual(conexao):
+    instalar_indice_busca(conexao)
+
+
+def m007_hash_importacao(conexao):
+    adicionar_coluna(
+        conexao, 'transacoes', 'hash_importacao',
+        'ALTER TABLE transacoes ADD COLUMN hash_importacao VARCHAR(64)')
+    criar_indices(
+        conexao,
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_transacoes_usuario_hash_importacao '
+        'ON transacoes (usuario_id, hash_importacao)')
+
+
+def m008_indices_por_usuario(conexao):
+    criar_indices(
+        conexao,
+        'CREATE INDEX IF NOT EXISTS ix_bancos_usuario_id ON bancos (usuario_id)',
+        'CREATE INDEX IF NOT EXISTS ix_cartoes_credito_usuario_id '
+        'ON cartoes_credito (usuario_id)',
+        'CREATE INDEX IF NOT EXISTS ix_categorias_usuario_id '
+        'ON categorias (usuario_id)',
+        'CREATE INDEX IF NOT EXISTS ix_movimentacoes_banco_data '
+        'ON movimentacoes_banco (banco_id, data)',
+        'CREATE INDEX IF NOT EXISTS ix_compras_cartao_usuario_status '
+        'ON compras_cartao (usuario_id, status)',
+        'CREATE INDEX IF NOT EXISTS ix_compras_cartao_cartao_data '
+        'ON compras_cartao (cartao_id, data_compra)',
+        'CREATE INDEX IF NOT EXISTS ix_faturas_cartao_usuario_cartao_ano_mes '
+        'ON faturas_cartao (usuario_id, cartao_id, ano, mes)',
+        'CREATE INDEX IF NOT EXISTS ix_faturas_cartao_usuario_status '
+        'ON faturas_cartao (usuario_id, status)',
+        'CREATE INDEX IF NOT EXISTS ix_transacoes_fatura_fatura_id '
+        'ON transacoes_fatura (fatura_id)',
+        'CREATE INDEX IF NOT EXISTS ix_pagamentos_fatura_fatura_id '
+        'ON pagamentos_fatura (fatura_id)',
+        'CREATE INDEX IF NOT EXISTS ix_recorrencias_usuario_ativa '
+        'ON recorrencias (usuario_id, ativa)',
+        'CREATE INDEX IF NOT EXISTS ix_orcamentos_usuario_ano_mes '
+        'ON orcamentos (usuario_id, ano, mes)',
+        'CREATE INDEX IF NOT EXISTS ix_execucoes_recorrencia_data_referencia '
+        'ON execucoes_recorrencia (data_referencia)')
+
+
+# Colunas monetárias que passaram de FLOAT (reais) para BIGINT (centavos)
+COLUNAS_DINHEIRO = [
+    ('transacoes', 'valor'),
+    ('bancos', 'saldo'),
+    ('movimentacoes_banco', 'valor'),
+    ('compras_cartao', 'valor_total'),
+    ('faturas_cartao', 'valor_total'),
+    ('faturas_cartao', 'valor_pago'),
+    ('faturas_cartao', 'valor_restante'),
+    ('transacoes_fatura', 'valor_parcela'),
+    ('pagamentos_fatura', 'valor'),
+    ('recorrencias', 'valor'),
+    ('orcamentos', 'limite_mensal'),
+]
+
+
+def m009_valores_em_centavos(conexao):
+    """
+    Converte os valores monetários de reais (float) para centavos (inteiro).
+
+    Só converte colunas ainda declaradas como ponto flutuante: em um banco
+    criado pela migração 1 com os modelos atuais elas já nascem BIGINT.
+    No SQLite o tipo declarado da coluna não muda (seria preciso recriar a
+    tabela), mas o conteúdo passa a ser inteiro; os triggers da busca
+    textual reindexam as linhas alteradas automaticamente.
+    """
+    inspetor = inspect(conexao)
+    postgres = conexao.dialect.name == 'postgresql'
+
+    for tabela, coluna in COLUNAS_DINHEIRO:
+        tipo = next(c['type'] for c in inspetor.get_columns(tabela)
+                    if c['name'] == coluna)
+        if not isinstance(tipo, sqltypes.Float):
+            continue
+
+        if postgres:
+            conexao.execute(text(
+                f'ALTER TABLE {tabela} ALTER COLUMN {coluna} TYPE BIGINT '
+                f'USING ROUND({coluna} * 100)::BIGINT'))
+        else:
+            conexao.execute(text(
+                f'UPDATE {tabela} SET {coluna} = CAST(ROUND({coluna} * 100) AS INTEGER) '
+                f'WHERE {coluna} IS NOT NULL'))
+
+
+# Tabelas cuja categoria era texto livre e passou a ser FK para categorias
+TABELAS_COM_CATEGORIA = ['transacoes', 'compras_cartao', 'recorrencias', 'orcamentos']
+
+
+def m010_categoria_id(conexao):
+    """
+    Troca a coluna de texto `categoria` por `categoria_id` (FK categorias.id).
+
+    Cada nome usado e ainda não cadastrado vira uma Categoria do usuário;
+    depois as linhas apontam para ela e a coluna de texto é removida
+    (o SQLite suporta DROP COLUMN desde a 3.35).
+    """
+    postgres = conexao.dialect.name == 'postgresql'
+    nome = "COALESCE(NULLIF(TRIM({t}.categoria), ''), 'Outros')"
+
+    for tabela in TABELAS_COM_CATEGORIA:
+        adicionar_coluna(
+            conexao, tabela, 'categoria_id',
+            f'ALTER TABLE {tabela} ADD COLUMN categoria_id INTEGER '
+            f'REFERENCES categorias(id)')
+
+        colunas = {c['name'] for c in inspect(conexao).get_columns(tabela)}
+        if 'categoria' not in colunas:
+            continue
+
+        conexao.execute(text(
+            f'INSERT INTO categorias (usuario_id, nome, data_criacao) '
+            f'SELECT DISTINCT t.usuario_id, {nome.format(t="t")}, CURRENT_TIMESTAMP '
+            f'FROM {tabela} t WHERE NOT EXISTS ('
+            f'SELECT 1 FROM categorias c WHERE c.usuario_id = t.usuario_id '
+            f'AND c.nome = {nome.format(t="t")})'))
+        conexao.execute(text(
+            f'UPDATE {tabela} SET categoria_id = ('
+            f'SELECT MIN(c.id) FROM categorias c '
+            f'WHERE c.usuario_id = {tabela}.usuario_id '
+            f'AND c.nome = {nome.format(t=tabela)})'))
+
+        if tabela == 'transacoes':
+            # O índice antigo cobre a coluna de texto e impede o DROP COLUMN
+            conexao.execute(text(
+                'DROP INDEX IF EXISTS ix_transacoes_usuario_categoria_data'))
+        conexao.execute(text(f'ALTER TABLE {tabela} DROP COLUMN categoria'))
+        if postgres:
+            conexao.execute(text(
+                f'ALTER TABLE {tabela} ALTER COLUMN categoria_id SET NOT NULL'))
+
+    criar_indices(
+        conexao,
+        'CREATE INDEX IF NOT EXISTS ix_transacoes_usuario_categoria_data '
+        'ON transacoes (usuario_id, categoria_id, data)')
+
+
+def m011_transacao_compra_cartao(conexao):
+    """
+    Liga cada transação de cartão à sua CompraCartao por compra_cartao_id.
+
+    O vínculo antigo era implícito (mesmo usuário, descrição e data); ele é
+    usado uma última vez aqui, primeiro exigindo também o mesmo valor e
+    depois sem o valor, só com as compras que ficaram sem transação.
+    """
+    criada = adicionar_coluna(
+        conexao, 'transacoes', 'compra_cartao_id',
+        'ALTER TABLE transacoes ADD COLUMN compra_cartao_id INTEGER '
+        'REFERENCES compras_cartao(id) ON DELETE SET NULL')
+    criar_indices(
+        conexao,
+        'CREATE INDEX IF NOT EXISTS ix_transacoes_compra_cartao_id '
+        'ON transacoes (compra_cartao_id)')
+    if not criada:
+        return
+
+    for mesmo_valor in ('AND c.valor_total = transacoes.valor', ''):
+        conexao.execute(text(
+            'UPDATE transacoes SET compra_cartao_id = ('
+            'SELECT MIN(c.id) FROM compras_cartao c '
+            'WHERE c.usuario_id = transacoes.usuario_id '
+            'AND c.descricao = transacoes.descricao '
+            f'AND c.data_compra = transacoes.data {mesmo_valor} '
+            'AND c.id NOT IN (SELECT compra_cartao_id FROM transacoes '
+            'WHERE compra_cartao_id IS NOT NULL)) '
+            "WHERE forma_pagamento = 'Cartão de Crédito' "
+            'AND compra_cartao_id IS NULL'))
+
+
+def m012_livro_de_parcelas(conexao):
+    """
+    Preenche transacoes_fatura com uma linha por parcela de cada compra
+    que ainda não tem parcelas, na fatura do mês de cada parcela.
+
+    Antes a compra inteira entrava só na fatura da 1ª parcela; essa fatura
+    recebe (parcela 1 - valor da compra) e as seguintes recebem a sua
+    parcela. Faturas que faltam são criadas. Valores em centavos.
+    """
+    criar_indices(
+        conexao,
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_transacoes_fatura_compra_parcela '
+        'ON transacoes_fatura (compra_cartao_id, numero_parcela)')
+
+    cartoes = {linha.id: linha for linha in conexao.execute(text(
+        'SELECT id, usuario_id, dia_fechamento, dia_vencimento '
+        'FROM cartoes_credito'))}
+    compras = conexao.execute(text(
+        'SELECT c.id, c.cartao_id, c.valor_total, c.quantidade_parcelas, '
+        'c.data_compra FROM compras_cartao c WHERE NOT EXISTS ('
+        'SELECT 1 FROM transacoes_fatura t WHERE t.compra_cartao_id = c.id) '
+        'ORDER BY c.id').columns(data_compra=db.Date)).all()
+    if not compras:
+        return
+
+    faturas = {(linha.cartao_id, linha.mes, linha.ano): linha.id
+               for linha in conexao.execute(text(
+                   'SELECT id, cartao_id, mes, ano FROM faturas_cartao'))}
+    ja_existiam = set(faturas)
+    ajustes = {}
+    parcelas = []
+
+    for compra in compras:
+        cartao = cartoes.get(compra.cartao_id)
+        if cartao is None:
+            continue
+
+        for numero, (mes, ano), valor in parcelas_da_compra(
+                cartao, de_centavos(compra.valor_total or 0),
+                compra.quantidade_parcelas, compra.data_compra):
+            chave = (cartao.id, mes, ano)
+            if chave not in faturas:
+                data_fechamento, data_vencimento = datas_fatura(cartao, mes, ano)
+                faturas[chave] = conexao.execute(text(
+                    'INSERT INTO faturas_cartao (usuario_id, cartao_id, mes, ano, '
+                    'valor_total, valor_pago, valor_restante, data_fechamento, '
+                    'data_vencimento, status, data_criacao) VALUES (:usuario_id, '
+                    ':cartao_id, :mes, :ano, 0, 0, 0, :data_fechamento, '
+                    ":data_vencimento, 'aberta', :agora) RETURNING id"),
+                    {'usuario_id': cartao.usuario_id, 'cartao_id': cartao.id,
+                     'mes': mes, 'ano': ano, 'data_fechamento': data_fechamento,
+                     'data_vencimento': data_vencimento,
+                     'agora': datetime.utcnow()}).scalar_one()
+
+            centavos = para_centavos(valor)
+            delta = centavos
+            if numero == 1 and chave in ja_existiam:
+                delta -= compra.valor_total or 0
+
+            fatura_id = faturas[chave]
+            ajustes[fatura_id] = ajustes.get(fatura_id, 0) + delta
+            parcelas.append({'fatura_id': fatura_id, 'compra_id': compra.id,
+                             'numero': numero, 'valor': centavos})
+
+    if parcelas:
+        conexao.execute(text(
+            'INSERT INTO transacoes_fatura (fatura_id, compra_cartao_id, '
+            'numero_parcela, valor_parcela) '
+            'VALUES (:fatura_id, :compra_id, :numero, :valor)'), parcelas)
+
+    ajustes = [{'id': fatura_id, 'delta': delta}
+               for fatura_id, delta in ajustes.items() if delta]
+    if ajustes:
+        conexao.execute(text(
+            'UPDATE faturas_cartao '
+            'SET valor_total = COALESCE(valor_total, 0) + :delta, '
+            'valor_restante = COALESCE(valor_total, 0) + :delta '
+            '- COALESCE(valor_pago, 0) '
+            'WHERE id = :id'), ajustes)
+
+
+def m013_fatura_unica_por_mes(conexao):
+    """
+    Uma fatura por (usuario_id, cartao_id, ano, mes), garantida por índice
+    único (é a chave do upsert de faturas.somar_nas_faturas).
+
+    Faturas duplicadas por lançamentos concorrentes são juntadas na de
+    menor id antes de criar o índice: valores somados, parcelas e
+    pagamentos passam para ela e as outras são apagadas.
+    """
+    duplicadas = conexao.execute(text(
+        'SELECT usuario_id, cartao_id, ano, mes, MIN(id) AS manter, '
+        'SUM(COALESCE(valor_total, 0)) AS total, '
+        'SUM(COALESCE(valor_pago, 0)) AS pago '
+        'FROM faturas_cartao GROUP BY usuario_id, cartao_id, ano, mes '
+        'HAVING COUNT(*) > 1')).all()
+
+    for grupo in duplicadas:
+        chave = {'usuario_id': grupo.usuario_id, 'cartao_id': grupo.cartao_id,
+                 'ano': grupo.ano, 'mes': grupo.mes, 'manter': grupo.manter}
+        outras = ('SELECT id FROM faturas_cartao WHERE usuario_id = :usuario_id '
+                  'AND cartao_id = :cartao_id AND ano = :ano AND mes = :mes '
+                  'AND id <> :manter')
+        for tabela in ('transacoes_fatura', 'pagamentos_fatura'):
+            conexao.execute(text(
+                f'UPDATE {tabela} SET fatura_id = :manter '
+                f'WHERE fatura_id IN ({outras})'), chave)
+        conexao.execute(text(f'DELETE FROM faturas_cartao WHERE id IN ({outras})'), chave)
+        conexao.execute(text(
+            'UPDATE faturas_cartao SET valor_total = :total, valor_pago = :pago, '
+            'valor_restante = :restante WHERE id = :manter'),
+            {'manter': grupo.manter, 'total': grupo.total, 'pago': grupo.pago,
+             'restante': grupo.total - grupo.pago})
+
+    criar_indices(
+        conexao,
+        'DROP INDEX IF EXISTS ix_faturas_cartao_usuario_cartao_ano_mes',
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_faturas_cartao_usuario_cartao_ano_mes '
+        'ON faturas_cartao (usuario_id, cartao_id, ano, mes)')
+
+
+def m014_resumo_mensal(conexao):
+    """Cria o resumo mensal das transações e o preenche a partir delas"""
+    criar_tabela(conexao, 'resumos_mensais')
+    criar_indices(
+        conexao,
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_resumos_mensais_chave '
+        'ON resumos_mensais (usuario_id, ano, mes, categoria_id, tipo, '
+        'forma_pagamento)')
+    reconstruir_resumos(conexao)
+
+
+def m015_indice_series_relatorio(conexao):
+    # Índice de cobertura para as séries dos relatórios por período
+    criar_indices(
+        conexao,
+        'CREATE INDEX IF NOT EXISTS ix_transacoes_usuario_data_tipo_categoria_valor '
+        'ON transacoes (usuario_id, data, tipo, categoria_id, valor)')
+
+
+def m016_versao_dados(conexao):
+    adicionar_coluna(
+        conexao, 'usuarios', 'versao_dados',
+        'ALTER TABLE usuarios ADD COLUMN versao_dados INTEGER NOT NULL DEFAULT 0')
+
+
+def m017_tarefas_relatorio(conexao):
+    criar_tabela(conexao, 'tarefas_relatorio')
+    criar_indices(
+        conexao,
+        'CREATE INDEX IF NOT EXISTS ix_tarefas_relatorio_status_disponivel '
+        'ON tarefas_relatorio (status, disponivel_em)',
+        'CREATE INDEX IF NOT EXISTS ix_tarefas_relatorio_usuario_criada '
+        'ON tarefas_relatorio (usuario_id, criada_em)')
+
+
+def m018_alertas_orcamento(conexao):
+    """Gasto acumulado nos orçamentos (preenchido pelo resumo) e notificações"""
+    adicionar_coluna(
+        conexao, 'orcamentos', 'gasto',
+        'ALTER TABLE orcamentos ADD COLUMN gasto BIGINT NOT NULL DEFAULT 0')
+    criar_tabela(conexao, 'notificacoes_orcamento')
+    criar_indices(
+        conexao,
+        'CREATE INDEX IF NOT EXISTS ix_notificacoes_orcamento_usuario_lida_criada '
+        'ON notificacoes_orcamento (usuario_id, lida, criada_em)')
+    recalcular_gastos(conexao)
+
+
+def m019_arquivos_relatorio_no_banco(conexao):
+    # Arquivos dos relatórios em partes no banco, visíveis ao web e ao worker
+    criar_tabela(conexao, 'partes_arquivo_relatorio')
+
+
+def m020_movimentacao_transacao(conexao):
+    """
+    Liga cada movimentação bancária à transação que a gerou
+    (transacao_id). Nas antigas o vínculo era implícito (mesmo banco,
+    data, valor e descrição "Despesa: ..."/"Receita: ..."); ele é usado
+    uma última vez aqui.
+    """
+    criada = adicionar_coluna(
+        conexao, 'movimentacoes_banco', 'transacao_id',
+        'ALTER TABLE movimentacoes_banco ADD COLUMN transacao_id INTEGER '
+        'REFERENCES transacoes(id) ON DELETE SET NULL')
+    criar_indices(
+        conexao,
+        'CREATE INDEX IF NOT EXISTS ix_movimentacoes_banco_transacao_id '
+        'ON movimentacoes_banco (transacao_id)')
+    if not criada:
+        return
+
+    conexao.execute(text(
+        'UPDATE movimentacoes_banco SET transacao_id = ('
+        'SELECT MIN(t.id) FROM transacoes t '
+        'WHERE t.banco_id = movimentacoes_banco.banco_id '
+        'AND t.data = movimentacoes_banco.data '
+        'AND t.valor = movimentacoes_banco.valor '
+        "AND movimentacoes_banco.descricao = CASE "
+        "WHEN lower(t.tipo) IN ('receita', 'entrada') THEN 'Receita: ' "
+        "ELSE 'Despesa: ' END || t.descricao) "
+        'WHERE transacao_id IS NULL'))
+
+
+MIGRACOES = [
+    (1, 'Esquema inicial (tabelas dos modelos)', m001_esquema_inicial),
+    (2, 'Transações: cartao_id e recorrencia_id', m002_transacoes_cartao_recorrencia),
+    (3, 'Recorrências: proxima_ocorrencia', m003_proxima_ocorrencia),
+    (4, 'Livro de ocorrências (recorrencia_id, data)', m004_livro_de_ocorrencias),
+    (5, 'Índices de listagem e filtros de transações', m005_indices_listagem_transacoes),
+    (6, 'Índice de busca textual', m006_busca_textual),
+    (7, 'Transações: hash_importacao', m007_hash_importacao),
+    (8, 'Índices compostos por usuário', m008_indices_por_usuario),
+    (9, 'Valores monetários em centavos (BIGINT)', m009_valores_em_centavos),
+    (10, 'Categoria como FK (categoria_id)', m010_categoria_id),
+    (11, 'Transações: compra_cartao_id', m011_transacao_compra_cartao),
+    (12, 'Livro de parcelas das faturas', m012_livro_de_parcelas),
+    (13, 'Faturas: uma por cartão e mês (índice único)', m013_fatura_unica_por_mes),
+    (14, 'Resumo mensal das transações', m014_resumo_mensal),
+    (15, 'Índice das séries dos relatórios', m015_indice_series_relatorio),
+    (16, 'Usuários: versao_dados (cache dos relatórios)', m016_versao_dados),
+    (17, 'Fila de relatórios em arquivo (PDF/XLSX)', m017_tarefas_relatorio),
+    (18, 'Orçamentos: gasto acumulado e alertas', m018_alertas_orcamento),
+    (19, 'Arquivos dos relatórios guardados no banco', m019_arquivos_relatorio_no_banco),
+    (20, 'Movimentações bancárias: transacao_id', m020_movimentacao_transacao),
+]
+
+
+# ===== EXECUÇÃO =====
+
+def _criar_tabela_versao(conexao):
+    conexao.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_version ('
+        'versao INTEGER PRIMARY KEY, '
+        'descricao VARCHAR(200) NOT NULL, '
+        'aplicada_em TIMESTAMP NOT NULL)'))
+
+
+def versoes_aplicadas(conexao):
+    _criar_tabela_versao(conexao)
+    return {linha[0] for linha in conexao.execute(
+        text('SELECT versao FROM schema_version'))}
+
+
+def aplicar_migracoes(engine=None, avisar=print):
+    """
+    Aplica as migrações pendentes, em ordem, uma transação por migração.
+
+    No PostgreSQL um advisory lock impede que dois processos de release
+    apliquem a mesma migração ao mesmo tempo.
+    Retorna a lista de versões aplicadas nesta execução.
+    """
+    engine = engine or db.engine
+    aplicadas_agora = []
+
+    with engine.begin() as conexao:
+        _criar_tabela_versao(conexao)
+
+    for versao, descricao, migracao in MIGRACOES:
+        with engine.begin() as conexao:
+            if conexao.dialect.name == 'postgresql':
+                conexao.execute(text('SELECT pg_advisory_xact_lock(7508)'))
+
+            ja_aplicada = conexao.execute(text(
+                'SELECT 1 FROM schema_version WHERE versao = :versao'),
+                {'versao': versao}).first()
+            if ja_aplicada:
+                continue
+
+            avisar(f"🔧 Aplicando migração {versao:03d}: {descricao}...")
+            migracao(conexao)
+            conexao.execute(text(
+                'INSERT INTO schema_version (versao, descricao, aplicada_em) '
+                'VALUES (:versao, :descricao, :aplicada_em)'),
+                {'versao': versao, 'descricao': descricao,
+                 'aplicada_em': datetime.utcnow()})
+            aplicadas_agora.append(versao)
+
+    return aplicadas_agora
+
+
+# ===== COMANDOS (flask db ...) =====
+
+db_cli = AppGroup('db', help='Migrações do esquema do banco de dados.')
+
+
+@db_cli.command('upgrade')
+def db_upgrade():
+    """Aplica as migrações pendentes."""
+    aplicadas = aplicar_migracoes(avisar=click.echo)
+    if aplicadas:
+        click.echo(f"✅ {len(aplicadas)} migração(ões) aplicada(s). "
+                   f"Versão atual: {aplicadas[-1]}")
+    else:
+        click.echo("✅ Banco de dados já está atualizado.")
+
+
+@db_cli.command('status')
+def db_status():
+    """Mostra a versão atual do esquema e as migrações pendentes."""
+    with db.engine.begin() as conexao:
+        aplicadas = versoes_aplicadas(conexao)
+
+    click.echo(f"📊 Versão atual: {max(aplicadas) if aplicadas else 0}")
+    for versao, descricao, _ in MIGRACOES:
+        marca = '✅' if versao in aplicadas else '⏳'
+        click.echo(f"  {marca} {versao:03d} {descricao}")
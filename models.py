@@ -2,9 +2,83 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, date
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy import event
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import flag_dirty
+from regras_recorrencia import gerar_ocorrencias
 
 db = SQLAlchemy()
 
+CENTAVO = Decimal('0.01')
+
+
+def para_centavos(valor):
+    """Converte um valor em reais (Decimal, int, float ou texto) em centavos"""
+    if not isinstance(valor, Decimal):
+        # str() evita herdar o erro binário do float (0.1 -> 0.1000000000000000055)
+        valor = Decimal(str(valor))
+    return int((valor * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def de_centavos(centavos):
+    """Converte centavos (inteiro) em reais como Decimal com 2 casas"""
+    return (Decimal(int(round(centavos))) / 100).quantize(CENTAVO)
+
+
+class Dinheiro(db.TypeDecorator):
+    """
+    Valor monetário guardado como BIGINT em centavos.
+
+    No Python o valor é sempre um Decimal com 2 casas, então somas e
+    comparações são exatas tanto no banco (SUM de inteiros) quanto no código.
+    """
+    impl = db.BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, valor, dialect):
+        return None if valor is None else para_centavos(valor)
+
+    def process_result_value(self, valor, dialect):
+        return None if valor is None else de_centavos(valor)
+
+
+def insert_com_conflito(alvo):
+    """
+    INSERT do dialeto em uso (PostgreSQL ou SQLite), que aceita
+    ON CONFLICT DO NOTHING / DO UPDATE.
+    """
+    dialeto = db.session.get_bind().dialect.name
+    if dialeto == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialeto == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(
+            f"Banco de dados '{dialeto}' não suporta ON CONFLICT")
+    return insert(alvo)
+
+
+def inserir_ignorando_duplicados(modelo, linhas, indice_unico, retornar=None):
+    """
+    Insere várias linhas de uma vez com INSERT ... ON CONFLICT DO NOTHING.
+
+    Linhas que violam o índice único `indice_unico` são ignoradas pelo
+    próprio banco, então execuções concorrentes nunca criam duplicatas.
+    Retorna as colunas `retornar` (por padrão o id) das linhas inseridas.
+    """
+    if not linhas:
+        return []
+
+    tabela = modelo.__table__
+    colunas = [tabela.c[nome] for nome in (retornar or ['id'])]
+
+    stmt = insert_com_conflito(tabela).on_conflict_do_nothing(
+        index_elements=indice_unico).returning(*colunas)
+
+    return db.session.execute(stmt, linhas).all()
+
 
 class Usuario(UserMixin, db.Model):
     __tablename__ = 'usuarios'
@@ -14,6 +88,9 @@ class Usuario(UserMixin, db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     senha = db.Column(db.String(255), nullable=False)
     data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
+    # Sobe a cada escrita nos dados dos relatórios (chave do cache_relatorios)
+    versao_dados = db.Column(db.Integer, nullable=False, default=0,
+                             server_default='0')
 
     # Relacionamentos
     transacoes = db.relationship(
@@ -32,6 +109,12 @@ class Usuario(UserMixin, db.Model):
         'Orcamento', backref='usuario', lazy=True, cascade='all, delete-orphan')
     faturas = db.relationship(
         'FaturaCartao', backref='usuario', lazy=True, cascade='all, delete-orphan')
+    resumos_mensais = db.relationship(
+        'ResumoMensal', lazy=True, cascade='all, delete-orphan')
+    tarefas_relatorio = db.relationship(
+        'TarefaRelatorio', lazy=True, cascade='all, delete-orphan')
+    notificacoes_orcamento = db.relationship(
+        'NotificacaoOrcamento', lazy=True, cascade='all, delete-orphan')
 
     def set_senha(self, senha):
         self.senha = generate_password_hash(senha)
@@ -40,27 +123,154 @@ class Usuario(UserMixin, db.Model):
         return check_password_hash(self.senha, senha)
 
 
-class Transacao(db.Model):
+# ===== CATEGORIAS =====
+
+CATEGORIA_PADRAO = 'Outros'
+
+
+def _nome_categoria(nome):
+    return (nome or '').strip() or CATEGORIA_PADRAO
+
+
+def obter_categoria(usuario_id, nome, sessao=None):
+    """
+    Devolve a Categoria `nome` do usuário, criando-a se ainda não existir.
+
+    Lançamentos automáticos ('Ajuste', 'Transferência', 'Importado') usam
+    categorias que o usuário não cadastrou; elas passam a existir aqui.
+    """
+    sessao = sessao or db.session
+    nome = _nome_categoria(nome)
+
+    # Categoria criada nesta mesma unidade de trabalho e ainda não gravada
+    for obj in sessao.new:
+        if (isinstance(obj, Categoria) and obj.usuario_id == usuario_id
+                and obj.nome == nome):
+            return obj
+
+    with sessao.no_autoflush:
+        categoria = sessao.query(Categoria).filter_by(
+            usuario_id=usuario_id, nome=nome).order_by(Categoria.id).first()
+    if categoria is None:
+        categoria = Categoria(usuario_id=usuario_id, nome=nome)
+        sessao.add(categoria)
+    return categoria
+
+
+def ids_categorias(usuario_id, nomes):
+    """
+    Resolve vários nomes de uma vez para as inserções em lote.
+    Retorna {nome: categoria_id}; categorias que faltam são criadas.
+    """
+    nomes = {_nome_categoria(nome) for nome in nomes}
+    ids = dict(db.session.query(Categoria.nome, Categoria.id).filter(
+        Categoria.usuario_id == usuario_id, Categoria.nome.in_(nomes)).all())
+
+    faltando = nomes - ids.keys()
+    if faltando:
+        novas = [Categoria(usuario_id=usuario_id, nome=nome) for nome in faltando]
+        db.session.add_all(novas)
+        db.session.flush()
+        ids.update({c.nome: c.id for c in novas})
+    return ids
+
+
+class ComCategoria:
+    """
+    Acesso pelo nome à categoria (FK categoria_id) dos modelos que a usam.
+
+    `obj.categoria` devolve o nome; atribuir um nome guarda-o como pendente
+    e a categoria é resolvida (ou criada) no flush, quando o usuario_id já
+    está definido. Em consultas, prefira filtrar e agrupar por categoria_id.
+    """
+
+    @hybrid_property
+    def categoria(self):
+        pendente = self.__dict__.get('_categoria_pendente')
+        if pendente is not None:
+            return pendente
+        return self.categoria_modelo.nome if self.categoria_modelo else None
+
+    @categoria.setter
+    def categoria(self, nome):
+        self._categoria_pendente = _nome_categoria(nome)
+        # Só o nome mudou: marcar o objeto para passar pelo before_flush
+        flag_dirty(self)
+
+    @categoria.expression
+    def categoria(cls):
+        return db.select(Categoria.nome).where(
+            Categoria.id == cls.categoria_id).scalar_subquery()
+
+
+@event.listens_for(Session, 'before_flush')
+def _resolver_categorias(sessao, contexto, instancias):
+    for obj in list(sessao.new) + list(sessao.dirty):
+        pendente = obj.__dict__.get('_categoria_pendente')
+        if pendente is None:
+            continue
+        obj.categoria_modelo = obter_categoria(obj.usuario_id, pendente, sessao)
+        del obj._categoria_pendente
+
+
+class Transacao(ComCategoria, db.Model):
     __tablename__ = 'transacoes'
 
+    # active_history nas colunas da chave do resumo mensal e no valor: ao
+    # alterá-las o valor antigo é carregado antes (mesmo com o objeto
+    # expirado após um commit), para o flush saber de qual linha do resumo
+    # tirar a transação (ver resumos.py)
     id = db.Column(db.Integer, primary_key=True)
-    usuario_id = db.Column(db.Integer, db.ForeignKey(
-        'usuarios.id'), nullable=False)
+    usuario_id = db.column_property(db.Column(db.Integer, db.ForeignKey(
+        'usuarios.id'), nullable=False), active_history=True)
     descricao = db.Column(db.String(200), nullable=False)
-    valor = db.Column(db.Float, nullable=False)
-    categoria = db.Column(db.String(100), nullable=False)
-    tipo = db.Column(db.String(20), nullable=False)  # Receita ou Despesa
-    forma_pagamento = db.Column(db.String(50), nullable=False)
-    data = db.Column(db.Date, nullable=False)
+    valor = db.column_property(
+        db.Column(Dinheiro, nullable=False), active_history=True)
+    categoria_id = db.column_property(db.Column(db.Integer, db.ForeignKey(
+        'categorias.id'), nullable=False), active_history=True)
+    categoria_modelo = db.relationship('Categoria')
+    tipo = db.column_property(  # Receita ou Despesa
+        db.Column(db.String(20), nullable=False), active_history=True)
+    forma_pagamento = db.column_property(
+        db.Column(db.String(50), nullable=False), active_history=True)
+    data = db.column_property(db.Column(db.Date, nullable=False), active_history=True)
     banco_id = db.Column(db.Integer, db.ForeignKey('bancos.id'), nullable=True)
     cartao_id = db.Column(db.Integer, db.ForeignKey(
         'cartoes_credito.id'), nullable=True)  # ✅ ADICIONADO
     data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
     recorrencia_id = db.Column(db.Integer, db.ForeignKey(
         'recorrencias.id'), nullable=True)
+    # Hash do conteúdo da linha importada de um extrato (None se digitada)
+    hash_importacao = db.Column(db.String(64), nullable=True)
+    # Compra no cartão lançada junto com esta transação (None se não for cartão)
+    compra_cartao_id = db.Column(db.Integer, db.ForeignKey(
+        'compras_cartao.id', ondelete='SET NULL'), nullable=True, index=True)
 
     # Relacionamento
     banco = db.relationship('Banco', backref='transacoes')
+    compra_cartao = db.relationship(
+        'CompraCartao', backref=db.backref('transacao', uselist=False))
+
+    __table_args__ = (
+        # Livro de ocorrências: no máximo uma transação por recorrência e data
+        # (também atende as buscas só por recorrencia_id)
+        db.Index('uq_transacoes_recorrencia_data',
+                 'recorrencia_id', 'data', unique=True),
+        # Listagem paginada por (data DESC, id DESC) de cada usuário
+        db.Index('ix_transacoes_usuario_data_id',
+                 'usuario_id', 'data', 'id'),
+        # Filtros por categoria e por banco dentro de um período
+        db.Index('ix_transacoes_usuario_categoria_data',
+                 'usuario_id', 'categoria_id', 'data'),
+        db.Index('ix_transacoes_usuario_banco_data',
+                 'usuario_id', 'banco_id', 'data'),
+        # Séries dos relatórios por período: índice de cobertura (sem ler a tabela)
+        db.Index('ix_transacoes_usuario_data_tipo_categoria_valor',
+                 'usuario_id', 'data', 'tipo', 'categoria_id', 'valor'),
+        # Importação de extratos: a mesma linha nunca entra duas vezes
+        db.Index('uq_transacoes_usuario_hash_importacao',
+                 'usuario_id', 'hash_importacao', unique=True),
+    )
 
 
 class Banco(db.Model):
@@ -68,9 +278,9 @@ class Banco(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey(
-        'usuarios.id'), nullable=False)
+        'usuarios.id'), nullable=False, index=True)
     nome = db.Column(db.String(100), nullable=False)
-    saldo = db.Column(db.Float, default=0.0)
+    saldo = db.Column(Dinheiro, default=0)
     # Conta Corrente, Poupança, etc
     tipo = db.Column(db.String(50), nullable=False)
     descricao = db.Column(db.String(200), nullable=True)
@@ -89,10 +299,18 @@ class MovimentacaoBanco(db.Model):
         'bancos.id'), nullable=False)
     tipo_movimento = db.Column(
         db.String(20), nullable=False)  # entrada ou saida
-    valor = db.Column(db.Float, nullable=False)
+    valor = db.Column(Dinheiro, nullable=False)
     descricao = db.Column(db.String(200), nullable=False)
     data = db.Column(db.Date, nullable=False)
     data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
+    # Transação que gerou o movimento (None para depósitos, saques etc.)
+    transacao_id = db.Column(db.Integer, db.ForeignKey(
+        'transacoes.id', ondelete='SET NULL'), nullable=True, index=True)
+
+    __table_args__ = (
+        # Extrato do banco ordenado por data
+        db.Index('ix_movimentacoes_banco_data', 'banco_id', 'data'),
+    )
 
 
 class CartaoCredito(db.Model):
@@ -100,7 +318,7 @@ class CartaoCredito(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey(
-        'usuarios.id'), nullable=False)
+        'usuarios.id'), nullable=False, index=True)
     nome = db.Column(db.String(100), nullable=False)
     # Dia do fechamento da fatura
     dia_fechamento = db.Column(db.Integer, nullable=False)
@@ -114,7 +332,7 @@ class CartaoCredito(db.Model):
         'FaturaCartao', backref='cartao', lazy=True, cascade='all, delete-orphan')
 
 
-class CompraCartao(db.Model):
+class CompraCartao(ComCategoria, db.Model):
     __tablename__ = 'compras_cartao'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -123,14 +341,23 @@ class CompraCartao(db.Model):
     cartao_id = db.Column(db.Integer, db.ForeignKey(
         'cartoes_credito.id'), nullable=False)
     descricao = db.Column(db.String(200), nullable=False)
-    valor_total = db.Column(db.Float, nullable=False)
+    valor_total = db.Column(Dinheiro, nullable=False)
     quantidade_parcelas = db.Column(db.Integer, default=1)
     data_compra = db.Column(db.Date, nullable=False)
-    categoria = db.Column(db.String(100), nullable=False)
+    categoria_id = db.Column(db.Integer, db.ForeignKey(
+        'categorias.id'), nullable=False)
+    categoria_modelo = db.relationship('Categoria')
     forma_pagamento = db.Column(db.String(50), nullable=False)
     status = db.Column(db.String(20), default='aberta')  # aberta ou fechada
     data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # Dívidas parceladas (compras abertas do usuário)
+        db.Index('ix_compras_cartao_usuario_status', 'usuario_id', 'status'),
+        # Compras de um cartão por data
+        db.Index('ix_compras_cartao_cartao_data', 'cartao_id', 'data_compra'),
+    )
+
 
 class FaturaCartao(db.Model):
     """
@@ -150,9 +377,9 @@ class FaturaCartao(db.Model):
     ano = db.Column(db.Integer, nullable=False)
 
     # Valores
-    valor_total = db.Column(db.Float, default=0.0)
-    valor_pago = db.Column(db.Float, default=0.0)
-    valor_restante = db.Column(db.Float, default=0.0)
+    valor_total = db.Column(Dinheiro, default=0)
+    valor_pago = db.Column(Dinheiro, default=0)
+    valor_restante = db.Column(Dinheiro, default=0)
 
     # Datas importantes
     data_fechamento = db.Column(db.Date, nullable=False)
@@ -171,25 +398,42 @@ class FaturaCartao(db.Model):
     pagamentos = db.relationship(
         'PagamentoFatura', backref='fatura', lazy=True, cascade='all, delete-orphan')
 
+    __table_args__ = (
+        # Uma fatura por cartão e mês (chave do upsert em faturas.py);
+        # também atende a listagem por cartão
+        db.Index('uq_faturas_cartao_usuario_cartao_ano_mes',
+                 'usuario_id', 'cartao_id', 'ano', 'mes', unique=True),
+        # Totais de faturas abertas/atrasadas
+        db.Index('ix_faturas_cartao_usuario_status', 'usuario_id', 'status'),
+    )
+
 
 class TransacaoFatura(db.Model):
     """
-    Relaciona cada transação de cartão de crédito com a fatura correspondente.
+    Livro de parcelas: uma linha por parcela de cada compra no cartão,
+    presa à fatura do mês em que a parcela é cobrada (ver faturas.py).
     """
     __tablename__ = 'transacoes_fatura'
 
     id = db.Column(db.Integer, primary_key=True)
     fatura_id = db.Column(db.Integer, db.ForeignKey(
-        'faturas_cartao.id'), nullable=False)
+        'faturas_cartao.id'), nullable=False, index=True)
     compra_cartao_id = db.Column(db.Integer, db.ForeignKey(
         'compras_cartao.id'), nullable=False)
 
     # Parcela
     numero_parcela = db.Column(db.Integer, default=1)
-    valor_parcela = db.Column(db.Float, nullable=False)
+    valor_parcela = db.Column(Dinheiro, nullable=False)
 
     # Relacionamentos
-    compra = db.relationship('CompraCartao', backref='parcelas_fatura')
+    compra = db.relationship('CompraCartao', backref=db.backref(
+        'parcelas_fatura', cascade='all, delete-orphan'))
+
+    __table_args__ = (
+        # Uma linha por parcela; também atende a busca das parcelas de uma compra
+        db.Index('uq_transacoes_fatura_compra_parcela',
+                 'compra_cartao_id', 'numero_parcela', unique=True),
+    )
 
 
 class PagamentoFatura(db.Model):
@@ -200,9 +444,9 @@ class PagamentoFatura(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     fatura_id = db.Column(db.Integer, db.ForeignKey(
-        'faturas_cartao.id'), nullable=False)
+        'faturas_cartao.id'), nullable=False, index=True)
 
-    valor = db.Column(db.Float, nullable=False)
+    valor = db.Column(Dinheiro, nullable=False)
     data_pagamento = db.Column(db.Date, nullable=False)
     forma_pagamento = db.Column(db.String(50), nullable=False)
     descricao = db.Column(db.String(200), nullable=True)
@@ -215,22 +459,35 @@ class Categoria(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey(
-        'usuarios.id'), nullable=False)
+        'usuarios.id'), nullable=False, index=True)
     nome = db.Column(db.String(100), nullable=False)
     descricao = db.Column(db.String(200), nullable=True)
     data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
 
 
-class Recorrencia(db.Model):
+def _primeira_ocorrencia(context):
+    """Valor padrão de proxima_ocorrencia: a primeira ocorrência da recorrência"""
+    params = context.get_current_parameters()
+    return next(gerar_ocorrencias(
+        params.get('frequencia'),
+        params.get('dia_vencimento'),
+        params.get('data_inicio'),
+        params.get('data_fim')
+    ), None)
+
+
+class Recorrencia(ComCategoria, db.Model):
     __tablename__ = 'recorrencias'
 
     id = db.Column(db.Integer, primary_key=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey(
         'usuarios.id'), nullable=False)
     descricao = db.Column(db.String(200), nullable=False)
-    valor = db.Column(db.Float, nullable=False)
+    valor = db.Column(Dinheiro, nullable=False)
     tipo = db.Column(db.String(20), nullable=False)  # Receita ou Despesa
-    categoria = db.Column(db.String(100), nullable=False)
+    categoria_id = db.Column(db.Integer, db.ForeignKey(
+        'categorias.id'), nullable=False)
+    categoria_modelo = db.relationship('Categoria')
     forma_pagamento = db.Column(db.String(50), nullable=False)
     banco_id = db.Column(db.Integer, db.ForeignKey(
         'bancos.id'), nullable=True)  # ✅ NOVO
@@ -242,17 +499,156 @@ class Recorrencia(db.Model):
     data_inicio = db.Column(db.Date, nullable=False)
     data_fim = db.Column(db.Date, nullable=True)
     ativa = db.Column(db.Boolean, default=True)
+    # Data materializada da próxima ocorrência (avançada a cada geração)
+    proxima_ocorrencia = db.Column(
+        db.Date, nullable=True, index=True, default=_primeira_ocorrencia)
     data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # Recorrências ativas do usuário (listagem e projeção)
+        db.Index('ix_recorrencias_usuario_ativa', 'usuario_id', 'ativa'),
+    )
 
-class Orcamento(db.Model):
+
+class ExecucaoRecorrencia(db.Model):
+    """
+    Registro de cada execução do processamento de recorrências.
+    A última data_referencia é a marca d'água usada pelo modo catch-up.
+    """
+    __tablename__ = 'execucoes_recorrencia'
+
+    id = db.Column(db.Integer, primary_key=True)
+    data_referencia = db.Column(db.Date, nullable=False, index=True)
+    modo = db.Column(db.String(20), nullable=False)  # diario ou catch-up
+    transacoes_geradas = db.Column(db.Integer, default=0)
+    duracao_segundos = db.Column(db.Float, default=0.0)
+    data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class Orcamento(ComCategoria, db.Model):
     __tablename__ = 'orcamentos'
 
     id = db.Column(db.Integer, primary_key=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey(
         'usuarios.id'), nullable=False)
-    categoria = db.Column(db.String(100), nullable=False)
-    limite_mensal = db.Column(db.Float, nullable=False)
+    categoria_id = db.Column(db.Integer, db.ForeignKey(
+        'categorias.id'), nullable=False)
+    categoria_modelo = db.relationship('Categoria')
+    # active_history: o limite antigo decide se a alteração cruzou um alerta
+    limite_mensal = db.column_property(
+        db.Column(Dinheiro, nullable=False), active_history=True)
+    # Despesas do mês na categoria, somadas a cada escrita (ver orcamentos.py)
+    gasto = db.Column(Dinheiro, nullable=False, default=0, server_default='0')
     mes = db.Column(db.Integer, nullable=False)
     ano = db.Column(db.Integer, nullable=False)
     data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Orçamentos do mês do usuário
+        db.Index('ix_orcamentos_usuario_ano_mes', 'usuario_id', 'ano', 'mes'),
+    )
+
+
+class NotificacaoOrcamento(db.Model):
+    """
+    Alerta de orçamento: registrado quando o gasto do mês cruza 80% ou
+    100% do limite (ver orcamentos.somar_nos_orcamentos).
+    """
+    __tablename__ = 'notificacoes_orcamento'
+
+    id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey(
+        'usuarios.id'), nullable=False)
+    orcamento_id = db.Column(db.Integer, db.ForeignKey(
+        'orcamentos.id'), nullable=False)
+    orcamento = db.relationship('Orcamento', backref=db.backref(
+        'notificacoes', lazy=True, cascade='all, delete-orphan'))
+    limiar = db.Column(db.Integer, nullable=False)  # 80 ou 100 (%)
+    gasto = db.Column(Dinheiro, nullable=False)
+    limite = db.Column(Dinheiro, nullable=False)
+    lida = db.Column(db.Boolean, nullable=False, default=False,
+                     server_default=db.false())
+    criada_em = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Alertas não lidos do usuário, mais recentes primeiro
+        db.Index('ix_notificacoes_orcamento_usuario_lida_criada',
+                 'usuario_id', 'lida', 'criada_em'),
+    )
+
+
+class ResumoMensal(db.Model):
+    """
+    Totais mensais das transações: uma linha por (usuário, ano, mês,
+    categoria, tipo, forma de pagamento) com a soma e a quantidade.
+    Mantido a cada flush e pelos caminhos em lote (ver resumos.py).
+    """
+    __tablename__ = 'resumos_mensais'
+
+    id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey(
+        'usuarios.id'), nullable=False)
+    ano = db.Column(db.Integer, nullable=False)
+    mes = db.Column(db.Integer, nullable=False)
+    categoria_id = db.Column(db.Integer, db.ForeignKey(
+        'categorias.id'), nullable=False)
+    tipo = db.Column(db.String(20), nullable=False)
+    forma_pagamento = db.Column(db.String(50), nullable=False)
+    total = db.Column(Dinheiro, nullable=False, default=0)
+    quantidade = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # Chave do upsert e das leituras por mês/ano do usuário
+        db.Index('uq_resumos_mensais_chave', 'usuario_id', 'ano', 'mes',
+                 'categoria_id', 'tipo', 'forma_pagamento', unique=True),
+    )
+
+
+class TarefaRelatorio(db.Model):
+    """
+    Fila de geração de relatórios em arquivo (PDF/XLSX), consumida pelo
+    comando `flask worker` (ver tarefas.py).
+    """
+    __tablename__ = 'tarefas_relatorio'
+
+    id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey(
+        'usuarios.id'), nullable=False)
+    tipo = db.Column(db.String(30), nullable=False)  # extrato_anual
+    formato = db.Column(db.String(10), nullable=False)  # xlsx, pdf
+    parametros = db.Column(db.JSON, nullable=False, default=dict)
+    # pendente, processando, concluida, falhou
+    status = db.Column(db.String(20), nullable=False, default='pendente')
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    erro = db.Column(db.Text)
+    arquivo = db.Column(db.String(255))
+    criada_em = db.Column(db.DateTime, default=datetime.utcnow)
+    # Retentativas só voltam a ser reservadas depois deste horário
+    disponivel_em = db.Column(db.DateTime, default=datetime.utcnow)
+    iniciada_em = db.Column(db.DateTime)
+    concluida_em = db.Column(db.DateTime)
+    partes = db.relationship('ParteArquivoRelatorio', lazy=True,
+                             cascade='all, delete-orphan')
+
+    __table_args__ = (
+        # Próxima tarefa da fila e tarefas do usuário
+        db.Index('ix_tarefas_relatorio_status_disponivel',
+                 'status', 'disponivel_em'),
+        db.Index('ix_tarefas_relatorio_usuario_criada',
+                 'usuario_id', 'criada_em'),
+    )
+
+
+class ParteArquivoRelatorio(db.Model):
+    """
+    Conteúdo do arquivo gerado por uma TarefaRelatorio, em partes de até
+    tarefas.TAMANHO_PARTE bytes. Fica no banco, e não no disco do worker,
+    porque o worker e a aplicação web rodam em processos (e máquinas) com
+    sistemas de arquivos separados.
+    """
+    __tablename__ = 'partes_arquivo_relatorio'
+
+    tarefa_id = db.Column(db.Integer, db.ForeignKey(
+        'tarefas_relatorio.id', ondelete='CASCADE'), primary_key=True)
+    numero = db.Column(db.Integer, primary_key=True)
+    dados = db.Column(db.LargeBinary, nullable=False)
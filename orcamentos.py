@@ -0,0 +1,225 @@
+"""
+Orçamentos × gastos por categoria e mês, e os alertas de orçamento.
+
+Cada Orcamento guarda o próprio `gasto` do mês. A cada escrita de
+despesa (pelo ORM ou em lote) o resumo mensal repassa a diferença para
+somar_nos_orcamentos, que atualiza o orçamento da categoria com um
+UPDATE pela chave e registra uma NotificacaoOrcamento quando o gasto
+cruza 80% ou 100% do limite (ou quando o limite é baixado abaixo do
+gasto). O alerta custa O(1) por escrita, em vez de reagregar o mês a
+cada visita à página de orçamentos.
+
+Os gastos da visão de vários meses vêm do resumo mensal (resumos.py).
+Períodos são intervalos semiabertos de meses [início, fim), comparados
+pela chave (ano, mes) na ordem dos índices (usuario_id, ano, mes, ...)
+do resumo e dos orçamentos; nenhuma consulta aplica extract() sobre a
+data, então o banco lê só o trecho do índice do período.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import event, inspect
+
+from models import (
+    db, de_centavos, Categoria, Dinheiro, NotificacaoOrcamento, Orcamento,
+    ResumoMensal,
+)
+
+MESES_VISAO = 12
+
+# Percentual do limite a partir do qual o orçamento entra em alerta
+LIMIAR_ALERTA = 80
+
+# Percentuais do limite que geram notificação ao serem cruzados
+LIMIARES_NOTIFICACAO = (LIMIAR_ALERTA, 100)
+
+
+def somar_meses(ano, mes, quantidade):
+    """(ano, mes) `quantidade` meses depois (ou antes, se negativa)"""
+    indice = ano * 12 + mes - 1 + quantidade
+    return indice // 12, indice % 12 + 1
+
+
+def no_periodo(coluna_ano, coluna_mes, inicio, fim):
+    """Condição (ano, mes) em [inicio, fim), comparando a chave como tupla"""
+    chave = db.tuple_(coluna_ano, coluna_mes)
+    return db.and_(chave >= inicio, chave < fim)
+
+
+def limiares_atingidos(gasto, limite):
+    """Limiares de notificação (em % do limite) que o gasto já alcançou"""
+    if limite <= 0:
+        return []
+    return [limiar for limiar in LIMIARES_NOTIFICACAO if gasto * 100 >= limiar * limite]
+
+
+def situacao_orcamento(gasto, limite):
+    """(percentual do limite já gasto, status: em_dia, alerta ou excedido)"""
+    percentual = gasto / limite * 100 if limite > 0 else 0
+    # Mesma comparação das notificações: o status muda junto com o alerta
+    atingidos = limiares_atingidos(gasto, limite)
+    if 100 in atingidos:
+        return percentual, 'excedido'
+    if LIMIAR_ALERTA in atingidos:
+        return percentual, 'alerta'
+    return percentual, 'em_dia'
+
+
+def visao_orcamentos(usuario_id, ano, mes, meses=MESES_VISAO):
+    """
+    Limite × gasto de todas as categorias nos `meses` meses que terminam
+    em (ano, mes), com uma única consulta agrupada: as linhas de despesa
+    do resumo e os orçamentos do período são unidos (UNION ALL) e somados
+    por categoria e mês.
+    """
+    inicio = somar_meses(ano, mes, 1 - meses)
+    fim = somar_meses(ano, mes, 1)
+    zero = db.literal(0, Dinheiro())
+
+    gastos = db.select(
+        ResumoMensal.categoria_id, ResumoMensal.ano, ResumoMensal.mes,
+        ResumoMensal.total.label('gasto'), zero.label('limite')
+    ).where(
+        ResumoMensal.usuario_id == usuario_id,
+        no_periodo(ResumoMensal.ano, ResumoMensal.mes, inicio, fim),
+        ResumoMensal.tipo == 'Despesa')
+
+    limites = db.select(
+        Orcamento.categoria_id, Orcamento.ano, Orcamento.mes,
+        zero, Orcamento.limite_mensal
+    ).where(
+        Orcamento.usuario_id == usuario_id,
+        no_periodo(Orcamento.ano, Orcamento.mes, inicio, fim))
+
+    periodo = db.union_all(gastos, limites).subquery()
+    linhas = db.session.execute(
+        db.select(
+            Categoria.nome, periodo.c.ano, periodo.c.mes,
+            db.func.sum(periodo.c.limite), db.func.sum(periodo.c.gasto)
+        ).join(Categoria, Categoria.id == periodo.c.categoria_id).group_by(
+            Categoria.nome, periodo.c.ano, periodo.c.mes)
+    ).all()
+
+    colunas = [somar_meses(*inicio, deslocamento) for deslocamento in range(meses)]
+    posicao = {chave: i for i, chave in enumerate(colunas)}
+
+    categorias = {}
+    for nome, ano_linha, mes_linha, limite, gasto in linhas:
+        celulas = categorias.setdefault(nome, [None] * meses)
+        percentual, status = situacao_orcamento(gasto, limite)
+        celulas[posicao[(ano_linha, mes_linha)]] = {
+            'limite': limite, 'gasto': gasto,
+            'percentual': percentual if limite > 0 else None,
+            'status': status if limite > 0 else 'sem_orcamento'}
+
+    return {
+        'meses': [f'{mes_coluna:02d}/{ano_coluna}' for ano_coluna, mes_coluna in colunas],
+        'categorias': [
+            {'categoria': nome, 'meses': celulas,
+             'total_limite': sum(c['limite'] for c in celulas if c),
+             'total_gasto': sum(c['gasto'] for c in celulas if c)}
+            for nome, celulas in sorted(categorias.items())
+        ],
+    }
+
+
+# ===== GASTO INCREMENTAL E ALERTAS =====
+
+def limiares_cruzados(antes, depois, limite, limite_anterior=None):
+    """
+    Limiares alcançados quando o gasto passa de `antes` para `depois` (ou
+    o limite passa de `limite_anterior` para `limite`) e que ainda não
+    estavam alcançados.
+    """
+    if limite_anterior is None:
+        limite_anterior = limite
+    ja_atingidos = limiares_atingidos(antes, limite_anterior)
+    return [limiar for limiar in limiares_atingidos(depois, limite)
+            if limiar not in ja_atingidos]
+
+
+def _notificacao(usuario_id, orcamento_id, limiar, gasto, limite, agora):
+    return {'usuario_id': usuario_id, 'orcamento_id': orcamento_id,
+            'limiar': limiar, 'gasto': gasto, 'limite': limite,
+            'lida': False, 'criada_em': agora}
+
+
+def somar_nos_orcamentos(deltas, conexao=None):
+    """
+    Soma `deltas` {(usuario_id, ano, mes, categoria_id): valor} ao gasto
+    dos orçamentos correspondentes (um UPDATE ... RETURNING pela chave
+    cada) e grava as notificações dos limiares cruzados.
+    """
+    conexao = conexao or db.session
+    orcamentos = Orcamento.__table__
+    agora = datetime.utcnow()
+    notificacoes = []
+
+    for (usuario_id, ano, mes, categoria_id), valor in deltas.items():
+        if not valor:
+            continue
+        atualizados = conexao.execute(orcamentos.update().where(
+            orcamentos.c.usuario_id == usuario_id, orcamentos.c.ano == ano,
+            orcamentos.c.mes == mes, orcamentos.c.categoria_id == categoria_id
+        ).values(gasto=orcamentos.c.gasto + valor).returning(
+            orcamentos.c.id, orcamentos.c.gasto, orcamentos.c.limite_mensal)).all()
+
+        for orcamento_id, gasto, limite in atualizados:
+            for limiar in limiares_cruzados(gasto - valor, gasto, limite):
+                notificacoes.append(_notificacao(
+                    usuario_id, orcamento_id, limiar, gasto, limite, agora))
+
+    if notificacoes:
+        conexao.execute(NotificacaoOrcamento.__table__.insert(), notificacoes)
+
+
+def _gasto_no_resumo(usuario_id, ano, mes, categoria_id):
+    """Subconsulta (em centavos) das despesas do resumo num mês/categoria"""
+    resumo = ResumoMensal.__table__
+    return db.select(db.func.coalesce(db.func.sum(
+        db.type_coerce(resumo.c.total, db.BigInteger)), 0)
+    ).where(
+        resumo.c.usuario_id == usuario_id, resumo.c.ano == ano,
+        resumo.c.mes == mes, resumo.c.categoria_id == categoria_id,
+        resumo.c.tipo == 'Despesa'
+    ).scalar_subquery()
+
+
+def recalcular_gastos(conexao, usuario_ids=None):
+    """Refaz o gasto dos orçamentos a partir do resumo mensal"""
+    orcamentos = Orcamento.__table__
+    atualizar = orcamentos.update().values(gasto=_gasto_no_resumo(
+        orcamentos.c.usuario_id, orcamentos.c.ano, orcamentos.c.mes,
+        orcamentos.c.categoria_id))
+    if usuario_ids is not None:
+        atualizar = atualizar.where(orcamentos.c.usuario_id.in_(usuario_ids))
+    conexao.execute(atualizar)
+
+
+@event.listens_for(Orcamento, 'before_insert')
+def _gasto_inicial(mapper, conexao, orcamento):
+    # Orçamento criado com o mês já em andamento começa com o gasto atual
+    centavos = conexao.execute(db.select(_gasto_no_resumo(
+        orcamento.usuario_id, orcamento.ano, orcamento.mes,
+        orcamento.categoria_id))).scalar()
+    orcamento.gasto = de_centavos(centavos)
+
+
+@event.listens_for(Orcamento, 'after_update')
+def _alertas_novo_limite(mapper, conexao, orcamento):
+    # Baixar o limite também pode cruzar 80%/100% sem nenhuma despesa nova
+    historico = inspect(orcamento).attrs.limite_mensal.history
+    if not historico.added or not historico.deleted:
+        return
+
+    orcamentos = Orcamento.__table__
+    # O gasto é somado por UPDATEs fora do ORM: lido do banco, não do objeto
+    gasto = conexao.execute(db.select(orcamentos.c.gasto).where(
+        orcamentos.c.id == orcamento.id)).scalar()
+    limite = historico.added[0]
+    notificacoes = [
+        _notificacao(orcamento.usuario_id, orcamento.id, limiar, gasto, limite,
+                     datetime.utcnow())
+        for limiar in limiares_cruzados(gasto, gasto, limite, historico.deleted[0])]
+    if notificacoes:
+        conexao.execute(NotificacaoOrcamento.__table__.insert(), notificacoes)
@@ -0,0 +1,98 @@
+"""
+Motor de regras das recorrências.
+
+Centraliza o cálculo das datas de ocorrência de cada frequência
+(Diária, Semanal, Quinzenal, Mensal, Bimestral, Trimestral, Semestral
+e Anual). É usado tanto pela geração automática de transações quanto
+pela projeção, e também para manter a coluna Recorrencia.proxima_ocorrencia.
+"""
+
+from datetime import date, timedelta
+from calendar import monthrange
+
+# Frequências com intervalo fixo em dias, contados a partir da data_inicio
+FREQUENCIAS_DIAS = {
+    'diária': 1,
+    'diaria': 1,
+    'semanal': 7,
+    'quinzenal': 15,
+}
+
+# Frequências com intervalo em meses, sempre no dia_vencimento
+FREQUENCIAS_MESES = {
+    'mensal': 1,
+    'bimestral': 2,
+    'trimestral': 3,
+    'semestral': 6,
+    'anual': 12,
+}
+
+
+def _data_no_mes(ano, mes, dia):
+    """Monta a data usando o último dia do mês quando o dia não existe (ex: 31/02)"""
+    _, ultimo_dia = monthrange(ano, mes)
+    return date(ano, mes, min(dia, ultimo_dia))
+
+
+def gerar_ocorrencias(frequencia, dia_vencimento, data_inicio, data_fim=None, a_partir_de=None):
+    """
+    Gera (de forma preguiçosa) as datas de ocorrência a partir de `a_partir_de`.
+
+    O gerador termina em data_fim; sem data_fim ele é infinito, então quem
+    chama deve limitar a iteração.
+    """
+    if not data_inicio:
+        return
+
+    freq = (frequencia or '').strip().lower()
+    a_partir_de = max(a_partir_de or data_inicio, data_inicio)
+
+    if freq in FREQUENCIAS_DIAS:
+        passo = FREQUENCIAS_DIAS[freq]
+        # Primeiro múltiplo do passo que não fica antes de a_partir_de
+        saltos = -(-(a_partir_de - data_inicio).days // passo)
+        atual = data_inicio + timedelta(days=saltos * passo)
+
+        while data_fim is None or atual <= data_fim:
+            yield atual
+            atual += timedelta(days=passo)
+
+    elif freq in FREQUENCIAS_MESES:
+        passo = FREQUENCIAS_MESES[freq]
+        dia = dia_vencimento or data_inicio.day
+        mes_inicio = data_inicio.year * 12 + data_inicio.month - 1
+
+        meses_ate_inicio = (a_partir_de.year * 12 + a_partir_de.month - 1) - mes_inicio
+        k = max(0, meses_ate_inicio // passo)
+
+        while True:
+            ano, mes = divmod(mes_inicio + k * passo, 12)
+            atual = _data_no_mes(ano, mes + 1, dia)
+
+            if data_fim and atual > data_fim:
+                return
+            if atual >= a_partir_de:
+                yield atual
+            k += 1
+
+
+def ocorrencias_entre(rec, inicio, fim):
+    """Datas de ocorrência da recorrência no intervalo [inicio, fim]"""
+    for data in gerar_ocorrencias(rec.frequencia, rec.dia_vencimento,
+                                  rec.data_inicio, rec.data_fim, inicio):
+        if data > fim:
+            return
+        yield data
+
+
+def proxima_ocorrencia(rec, a_partir_de):
+    """Primeira ocorrência em ou depois de `a_partir_de` (None se já terminou)"""
+    return next(gerar_ocorrencias(rec.frequencia, rec.dia_vencimento,
+                                  rec.data_inicio, rec.data_fim, a_partir_de), None)
+
+
+def quantidade_no_mes(rec, ano, mes):
+    """Quantas vezes a recorrência ocorre no mês informado"""
+    _, ultimo_dia = monthrange(ano, mes)
+    return sum(1 for _ in ocorrencias_entre(
+        rec, date(ano, mes, 1), date(ano, mes, ultimo_dia)))
@@ -0,0 +1,223 @@
+"""
+Resumo mensal das transações (tabela resumos_mensais).
+
+Cada linha guarda a soma e a quantidade das transações de um usuário em
+um (ano, mês, categoria, tipo, forma de pagamento). Relatórios mensais e
+anuais e os orçamentos leem essas poucas linhas em vez de somar todo o
+histórico de transações a cada requisição.
+
+O resumo é mantido na mesma transação de cada alteração:
+- inserções, edições e exclusões pelo ORM: evento after_flush da Session;
+- inserções em lote (ocorrências de recorrências, extratos importados):
+  somar_transacoes_no_resumo com as linhas devolvidas pelo INSERT.
+
+Cada soma de despesas também é repassada ao gasto dos orçamentos
+(orcamentos.somar_nos_orcamentos), que dispara os alertas de limite.
+
+`flask resumos reconstruir` refaz o resumo de todos os usuários a partir
+das transações, em lotes de usuários processados em paralelo.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import event, extract, func, inspect
+from sqlalchemy.orm import Session
+
+from models import (
+    db, insert_com_conflito, para_centavos, de_centavos, ResumoMensal, Transacao, Usuario
+)
+from cache_relatorios import incrementar_versao
+from orcamentos import recalcular_gastos, somar_nos_orcamentos
+
+# Colunas da transação que definem a linha do resumo (além do valor)
+CAMPOS_CHAVE = ('usuario_id', 'data', 'categoria_id', 'tipo', 'forma_pagamento')
+
+
+def chave_resumo(usuario_id, data, categoria_id, tipo, forma_pagamento):
+    return (usuario_id, data.year, data.month, categoria_id, tipo, forma_pagamento)
+
+
+def _acumular(deltas, chave, valor, quantidade):
+    # O valor pode chegar como float/str antes do flush; soma em Decimal exato
+    total, qtd = deltas.get(chave, (0, 0))
+    deltas[chave] = (total + de_centavos(para_centavos(valor)), qtd + quantidade)
+
+
+# ===== ATUALIZAÇÃO INCREMENTAL =====
+
+def somar_no_resumo(deltas, conexao=None):
+    """
+    Aplica `deltas` {chave: (valor, quantidade)} ao resumo com um único
+    INSERT ... ON CONFLICT DO UPDATE (total = total + valor). Linhas que
+    ficam sem nenhuma transação são apagadas.
+    """
+    deltas = {chave: delta for chave, delta in deltas.items() if any(delta)}
+    if not deltas:
+        return
+
+    conexao = conexao or db.session
+    tabela = ResumoMensal.__table__
+
+    stmt = insert_com_conflito(tabela).values([
+        {'usuario_id': usuario_id, 'ano': ano, 'mes': mes,
+         'categoria_id': categoria_id, 'tipo': tipo,
+         'forma_pagamento': forma_pagamento, 'total': total,
+         'quantidade': quantidade}
+        for (usuario_id, ano, mes, categoria_id, tipo, forma_pagamento),
+        (total, quantidade) in deltas.items()
+    ])
+    conexao.execute(stmt.on_conflict_do_update(
+        index_elements=['usuario_id', 'ano', 'mes', 'categoria_id', 'tipo',
+                        'forma_pagamento'],
+        set_={'total': tabela.c.total + stmt.excluded.total,
+              'quantidade': tabela.c.quantidade + stmt.excluded.quantidade}))
+
+    if any(quantidade < 0 for _, quantidade in deltas.values()):
+        conexao.execute(tabela.delete().where(
+            tabela.c.usuario_id.in_({chave[0] for chave in deltas}),
+            tabela.c.quantidade <= 0))
+
+    # Gasto acumulado dos orçamentos e alertas, na mesma transação
+    despesas = {}
+    for (usuario_id, ano, mes, categoria_id, tipo, _), (total, _) in deltas.items():
+        if tipo == 'Despesa':
+            chave = (usuario_id, ano, mes, categoria_id)
+            despesas[chave] = despesas.get(chave, 0) + total
+    somar_nos_orcamentos(despesas, conexao)
+
+
+def somar_transacoes_no_resumo(linhas, sinal=1):
+    """
+    Soma (ou, com sinal=-1, subtrai) ao resumo transações gravadas em lote
+    e sobe a versão dos dados dos usuários (os lotes não passam pelo flush).
+    As linhas precisam ter usuario_id, data, categoria_id, tipo,
+    forma_pagamento e valor.
+    """
+    deltas = {}
+    for linha in linhas:
+        _acumular(deltas, chave_resumo(*(getattr(linha, c) for c in CAMPOS_CHAVE)),
+                  sinal * linha.valor, sinal)
+    somar_no_resumo(deltas)
+    incrementar_versao({chave[0] for chave in deltas})
+
+
+def _valor_anterior(estado, campo):
+    # As colunas da chave e o valor têm active_history (models.Transacao):
+    # o valor antigo está no histórico mesmo com o objeto expirado
+    historico = estado.attrs[campo].history
+    if historico.deleted:
+        return historico.deleted[0]
+    return getattr(estado.obj(), campo)
+
+
+@event.listens_for(Session, 'after_flush')
+def _atualizar_resumo(sessao, contexto):
+    deltas = {}
+    usuarios_apagados = {obj.id for obj in sessao.deleted if isinstance(obj, Usuario)}
+
+    for obj in sessao.new:
+        if isinstance(obj, Transacao):
+            _acumular(deltas, chave_resumo(*(getattr(obj, c) for c in CAMPOS_CHAVE)),
+                      obj.valor, 1)
+
+    for obj in sessao.deleted:
+        if isinstance(obj, Transacao) and obj.usuario_id not in usuarios_apagados:
+            estado = inspect(obj)
+            _acumular(deltas, chave_resumo(
+                *(_valor_anterior(estado, c) for c in CAMPOS_CHAVE)),
+                -_valor_anterior(estado, 'valor'), -1)
+
+    for obj in sessao.dirty:
+        if not isinstance(obj, Transacao):
+            continue
+        estado = inspect(obj)
+        antes = [_valor_anterior(estado, c) for c in CAMPOS_CHAVE + ('valor',)]
+        depois = [getattr(obj, c) for c in CAMPOS_CHAVE + ('valor',)]
+        if antes != depois:
+            _acumular(deltas, chave_resumo(*antes[:-1]), -antes[-1], -1)
+            _acumular(deltas, chave_resumo(*depois[:-1]), depois[-1], 1)
+
+    if deltas:
+        somar_no_resumo(deltas, sessao.connection())
+
+
+# ===== LEITURA =====
+
+def totais_por_categoria(usuario_id, ano, mes=None, tipo=None):
+    """{categoria_id: total} do mês (ou do ano inteiro, sem `mes`)"""
+    filtros = [ResumoMensal.usuario_id == usuario_id, ResumoMensal.ano == ano]
+    if mes:
+        filtros.append(ResumoMensal.mes == mes)
+    if tipo:
+        filtros.append(ResumoMensal.tipo == tipo)
+
+    return dict(db.session.query(
+        ResumoMensal.categoria_id, func.sum(ResumoMensal.total)
+    ).filter(*filtros).group_by(ResumoMensal.categoria_id).all())
+
+
+# ===== RECONSTRUÇÃO =====
+
+def reconstruir_resumos(conexao, usuario_ids=None):
+    """
+    Refaz o resumo a partir das transações (de todos os usuários, ou só
+    dos `usuario_ids`) com um DELETE e um INSERT ... SELECT agrupado.
+    """
+    resumo = ResumoMensal.__table__
+    transacoes = Transacao.__table__
+    ano = extract('year', transacoes.c.data)
+    mes = extract('month', transacoes.c.data)
+
+    apagar = resumo.delete()
+    agrupar = db.select(
+        transacoes.c.usuario_id, ano, mes, transacoes.c.categoria_id,
+        transacoes.c.tipo, transacoes.c.forma_pagamento,
+        func.sum(transacoes.c.valor), func.count()
+    ).group_by(
+        transacoes.c.usuario_id, ano, mes, transacoes.c.categoria_id,
+        transacoes.c.tipo, transacoes.c.forma_pagamento)
+
+    if usuario_ids is not None:
+        apagar = apagar.where(resumo.c.usuario_id.in_(usuario_ids))
+        agrupar = agrupar.where(transacoes.c.usuario_id.in_(usuario_ids))
+
+    conexao.execute(apagar)
+    conexao.execute(resumo.insert().from_select(
+        ['usuario_id', 'ano', 'mes', 'categoria_id', 'tipo',
+         'forma_pagamento', 'total', 'quantidade'], agrupar))
+
+
+resumos_cli = AppGroup('resumos', help='Resumo mensal das transações.')
+
+
+@resumos_cli.command('reconstruir')
+@click.option('--lote', 'tamanho_lote', default=200, show_default=True,
+              help='Usuários por transação.')
+@click.option('--workers', default=4, show_default=True,
+              help='Lotes processados em paralelo.')
+def resumos_reconstruir(tamanho_lote, workers):
+    """Refaz o resumo mensal (e o gasto dos orçamentos) de todos os usuários."""
+    engine = db.engine
+    usuario_ids = [id for id, in db.session.query(Usuario.id).order_by(Usuario.id)]
+    lotes = [usuario_ids[i:i + tamanho_lote]
+             for i in range(0, len(usuario_ids), tamanho_lote)]
+
+    # O SQLite serializa as escritas; paralelismo só atrapalharia
+    if engine.dialect.name == 'sqlite':
+        workers = 1
+
+    def reconstruir_lote(ids):
+        with engine.begin() as conexao:
+            reconstruir_resumos(conexao, ids)
+            recalcular_gastos(conexao, ids)
+        return len(ids)
+
+    feitos = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for quantidade in executor.map(reconstruir_lote, lotes):
+            feitos += quantidade
+            click.echo(f"🔄 {feitos}/{len(usuario_ids)} usuários...")
+
+    click.echo(f"✅ Resumo mensal reconstruído para {feitos} usuários.")
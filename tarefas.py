@@ -0,0 +1,361 @@
+"""
+Fila de relatórios em arquivo (PDF/XLSX) guardada no próprio banco.
+
+A rota só grava uma TarefaRelatorio 'pendente' e responde na hora; o
+arquivo é gerado pelo comando `flask worker`, um processo separado dos
+workers do gunicorn (linha `worker` do Procfile). Não há broker externo:
+a fila é a tabela tarefas_relatorio.
+
+Ciclo de uma tarefa:
+- pendente -> processando: reservar_tarefa, um UPDATE ... RETURNING
+  atômico (no PostgreSQL com FOR UPDATE SKIP LOCKED), então dois
+  workers nunca pegam a mesma tarefa;
+- processando -> concluida: o arquivo é escrito em streaming num
+  arquivo temporário e gravado no banco em partes
+  (partes_arquivo_relatorio), na mesma transação que conclui a tarefa.
+  O worker roda em outro processo (no deploy, outra máquina com disco
+  próprio e efêmero), então a aplicação web só enxerga o que está no
+  banco;
+- erro ou tempo esgotado -> pendente de novo, com espera crescente,
+  até MAX_TENTATIVAS; depois disso, falhou.
+
+Cada tarefa tem TEMPO_LIMITE segundos: o gerador confere o prazo a cada
+lote de linhas, e tarefas presas em 'processando' (worker que morreu)
+são devolvidas à fila por liberar_expiradas. Tarefas encerradas há mais
+de DIAS_RETENCAO dias são apagadas, com os arquivos, por limpar_antigas.
+"""
+
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import click
+from flask.cli import with_appcontext
+
+from exportacao import (
+    LOTE_EXPORTACAO, linhas_em_streaming, escrever_pdf, escrever_xlsx, formatar_valor
+)
+from models import (
+    db, Banco, CartaoCredito, Categoria, FaturaCartao, MovimentacaoBanco,
+    ParteArquivoRelatorio, TarefaRelatorio, Transacao
+)
+
+# Formato -> tipo MIME do download
+FORMATOS_TAREFA = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'pdf': 'application/pdf',
+}
+TEMPO_LIMITE = 300  # segundos por tentativa
+FOLGA_EXPIRACAO = 60  # além do limite, antes de considerar o worker morto
+MAX_TENTATIVAS = 3
+ESPERA_RETENTATIVA = 30  # segundos; dobra a cada tentativa
+INTERVALO_CONSULTA = 2  # segundos entre consultas à fila vazia
+TAMANHO_PARTE = 512 * 1024  # bytes por linha de partes_arquivo_relatorio
+DIAS_RETENCAO = 7  # tarefas encerradas (e seus arquivos) guardadas por
+INTERVALO_LIMPEZA = 3600  # segundos entre limpezas no worker
+
+
+class TempoEsgotado(Exception):
+    """A tarefa passou do TEMPO_LIMITE"""
+
+
+# ===== FILA =====
+
+def enfileirar(usuario_id, tipo, formato, parametros):
+    """Grava uma tarefa pendente (sem commit) e a devolve"""
+    if tipo not in GERADORES or formato not in FORMATOS_TAREFA:
+        raise ValueError(f'Relatório inválido: {tipo}/{formato}')
+
+    tarefa = TarefaRelatorio(usuario_id=usuario_id, tipo=tipo, formato=formato,
+                             parametros=parametros, status='pendente',
+                             disponivel_em=datetime.utcnow())
+    db.session.add(tarefa)
+    return tarefa
+
+
+def reservar_tarefa(agora=None):
+    """
+    Passa a próxima tarefa disponível para 'processando' e a devolve
+    (ou None com a fila vazia). A condição status = 'pendente' no UPDATE
+    garante que só um worker a leva.
+    """
+    agora = agora or datetime.utcnow()
+
+    proxima = db.select(TarefaRelatorio.id).where(
+        TarefaRelatorio.status == 'pendente',
+        TarefaRelatorio.disponivel_em <= agora
+    ).order_by(
+        TarefaRelatorio.disponivel_em, TarefaRelatorio.id
+    ).limit(1).with_for_update(skip_locked=True).scalar_subquery()
+
+    tarefa = db.session.scalars(
+        db.update(TarefaRelatorio).where(
+            TarefaRelatorio.id == proxima,
+            TarefaRelatorio.status == 'pendente'
+        ).values(
+            status='processando', iniciada_em=agora,
+            tentativas=TarefaRelatorio.tentativas + 1
+        ).returning(TarefaRelatorio),
+        execution_options={'synchronize_session': False,
+                           'populate_existing': True}).first()
+    db.session.commit()
+    return tarefa
+
+
+def _falhar(condicoes, erro, agora):
+    """
+    Encerra a tentativa das tarefas que atendem `condicoes`: volta para a
+    fila com espera de ESPERA_RETENTATIVA * 2^(tentativas - 1) segundos,
+    ou 'falhou' depois de MAX_TENTATIVAS.
+    """
+    tabela = TarefaRelatorio.__table__
+    tarefas = db.session.execute(
+        db.select(tabela.c.id, tabela.c.tentativas).where(*condicoes)).all()
+
+    for id, tentativas in tarefas:
+        if tentativas < MAX_TENTATIVAS:
+            valores = {'status': 'pendente', 'iniciada_em': None,
+                       'disponivel_em': agora + timedelta(
+                           seconds=ESPERA_RETENTATIVA * 2 ** (tentativas - 1))}
+        else:
+            valores = {'status': 'falhou', 'concluida_em': agora}
+        db.session.execute(tabela.update().where(
+            tabela.c.id == id, *condicoes).values(erro=erro, **valores))
+
+
+def liberar_expiradas(agora=None):
+    """Tarefas presas em 'processando' além do prazo contam como tentativa perdida"""
+    agora = agora or datetime.utcnow()
+    limite = agora - timedelta(seconds=TEMPO_LIMITE + FOLGA_EXPIRACAO)
+    tabela = TarefaRelatorio.__table__
+
+    ids = [id for id, in db.session.execute(db.select(tabela.c.id).where(
+        tabela.c.status == 'processando', tabela.c.iniciada_em < limite))]
+    for id in ids:
+        _falhar([tabela.c.id == id, tabela.c.status == 'processando'],
+                'Tempo esgotado (worker interrompido)', agora)
+    db.session.commit()
+    return len(ids)
+
+
+# ===== EXECUÇÃO =====
+
+def nome_arquivo(tarefa):
+    """Nome do arquivo no download"""
+    return f"{tarefa.tipo}_{tarefa.parametros.get('ano', '')}.{tarefa.formato}"
+
+
+def com_prazo(linhas, prazo):
+    """Repassa as linhas, conferindo o prazo a cada LOTE_EXPORTACAO linhas"""
+    for numero, linha in enumerate(linhas):
+        if numero % LOTE_EXPORTACAO == 0 and time.monotonic() > prazo:
+            raise TempoEsgotado(f'Passou de {TEMPO_LIMITE}s')
+        yield linha
+
+
+def _gravar_partes(tarefa_id, arquivo):
+    """Copia `arquivo` (já escrito) para o banco, uma parte por INSERT"""
+    arquivo.seek(0)
+    tabela = ParteArquivoRelatorio.__table__
+    numero = 0
+    while True:
+        dados = arquivo.read(TAMANHO_PARTE)
+        if not dados:
+            break
+        db.session.execute(tabela.insert().values(
+            tarefa_id=tarefa_id, numero=numero, dados=dados))
+        numero += 1
+
+
+def executar_tarefa(tarefa, agora=None):
+    """
+    Gera o arquivo da tarefa reservada num arquivo temporário e o grava no
+    banco. Em caso de erro a tarefa volta para a fila (ou falha de vez) e
+    nada é gravado. Retorna True se o arquivo foi gerado.
+    """
+    prazo = time.monotonic() + TEMPO_LIMITE
+    tabela = TarefaRelatorio.__table__
+    # Só finaliza se a tarefa ainda é desta tentativa (não foi liberada)
+    desta_tentativa = [tabela.c.id == tarefa.id,
+                       tabela.c.status == 'processando',
+                       tabela.c.tentativas == tarefa.tentativas]
+
+    try:
+        with tempfile.TemporaryFile() as arquivo:
+            GERADORES[tarefa.tipo](tarefa, arquivo, prazo)
+            _gravar_partes(tarefa.id, arquivo)
+    except Exception as erro:
+        db.session.rollback()
+        _falhar(desta_tentativa, f'{type(erro).__name__}: {erro}',
+                agora or datetime.utcnow())
+        db.session.commit()
+        return False
+
+    concluida = db.session.execute(tabela.update().where(*desta_tentativa).values(
+        status='concluida', erro=None, concluida_em=agora or datetime.utcnow(),
+        arquivo=nome_arquivo(tarefa)))
+    if concluida.rowcount == 0:
+        # A tentativa foi liberada enquanto gerava: outra vai gravar o arquivo
+        db.session.rollback()
+        return False
+    db.session.commit()
+    return True
+
+
+def partes_do_arquivo(tarefa):
+    """
+    Gerador com o conteúdo do arquivo da tarefa, uma parte por consulta
+    (sem carregar o arquivo inteiro na memória), ou None se não há arquivo.
+    """
+    quantidade = db.session.query(db.func.count()).filter(
+        ParteArquivoRelatorio.tarefa_id == tarefa.id).scalar()
+    if not quantidade:
+        return None
+
+    def partes():
+        for numero in range(quantidade):
+            yield db.session.query(ParteArquivoRelatorio.dados).filter_by(
+                tarefa_id=tarefa.id, numero=numero).scalar()
+    return partes()
+
+
+def devolver_a_fila(tarefa, agora=None):
+    """Tarefa concluída sem arquivo no banco volta a ser gerada (sem commit)"""
+    db.session.query(ParteArquivoRelatorio).filter_by(tarefa_id=tarefa.id).delete()
+    tarefa.status = 'pendente'
+    tarefa.tentativas = 0
+    tarefa.arquivo = tarefa.erro = tarefa.iniciada_em = tarefa.concluida_em = None
+    tarefa.disponivel_em = agora or datetime.utcnow()
+
+
+def limpar_antigas(agora=None):
+    """Apaga as tarefas encerradas há mais de DIAS_RETENCAO dias e seus arquivos"""
+    agora = agora or datetime.utcnow()
+    tabela = TarefaRelatorio.__table__
+    antigas = db.select(tabela.c.id).where(
+        tabela.c.status.in_(('concluida', 'falhou')),
+        tabela.c.concluida_em < agora - timedelta(days=DIAS_RETENCAO))
+
+    partes = ParteArquivoRelatorio.__table__
+    db.session.execute(partes.delete().where(partes.c.tarefa_id.in_(antigas)))
+    apagadas = db.session.execute(tabela.delete().where(
+        tabela.c.id.in_(antigas))).rowcount
+    db.session.commit()
+    return apagadas
+
+
+# ===== RELATÓRIOS =====
+
+def extrato_anual(tarefa, arquivo, prazo):
+    """Transações, faturas do cartão e movimentações bancárias do ano"""
+    usuario_id = tarefa.usuario_id
+    ano = int(tarefa.parametros['ano'])
+    inicio, fim = date(ano, 1, 1), date(ano + 1, 1, 1)
+
+    transacoes = db.select(
+        Transacao.data, Transacao.descricao, Categoria.nome, Transacao.tipo,
+        Transacao.forma_pagamento, Transacao.valor
+    ).join(Categoria, Transacao.categoria_id == Categoria.id).where(
+        Transacao.usuario_id == usuario_id,
+        Transacao.data >= inicio, Transacao.data < fim
+    ).order_by(Transacao.data, Transacao.id)
+
+    faturas = db.select(
+        CartaoCredito.nome, FaturaCartao.mes, FaturaCartao.ano,
+        FaturaCartao.data_vencimento, FaturaCartao.valor_total,
+        FaturaCartao.valor_pago, FaturaCartao.status
+    ).join(CartaoCredito, FaturaCartao.cartao_id == CartaoCredito.id).where(
+        FaturaCartao.usuario_id == usuario_id, FaturaCartao.ano == ano
+    ).order_by(FaturaCartao.mes, CartaoCredito.nome)
+
+    movimentacoes = db.select(
+        MovimentacaoBanco.data, Banco.nome, MovimentacaoBanco.tipo_movimento,
+        MovimentacaoBanco.descricao, MovimentacaoBanco.valor
+    ).join(Banco, MovimentacaoBanco.banco_id == Banco.id).where(
+        Banco.usuario_id == usuario_id,
+        MovimentacaoBanco.data >= inicio, MovimentacaoBanco.data < fim
+    ).order_by(MovimentacaoBanco.data, MovimentacaoBanco.id)
+
+    def linhas(stmt, formatar):
+        return com_prazo((formatar(linha) for linha in linhas_em_streaming(stmt)), prazo)
+
+    def data_br(dia):
+        return dia.strftime('%d/%m/%Y')
+
+    if tarefa.formato == 'xlsx':
+        escrever_xlsx(arquivo, [
+            ('Transações',
+             ['Data', 'Descrição', 'Categoria', 'Tipo', 'Forma de Pagamento', 'Valor'],
+             linhas(transacoes, lambda t: [data_br(t[0]), *t[1:]])),
+            ('Faturas do Cartão',
+             ['Cartão', 'Mês', 'Vencimento', 'Total', 'Pago', 'Status'],
+             linhas(faturas, lambda f: [f[0], f'{f[1]:02d}/{f[2]}', data_br(f[3]),
+                                        f[4] or 0, f[5] or 0, f[6]])),
+            ('Movimentações',
+             ['Data', 'Banco', 'Movimento', 'Descrição', 'Valor'],
+             linhas(movimentacoes, lambda m: [data_br(m[0]), *m[1:]])),
+        ])
+    else:
+        escrever_pdf(arquivo, f'Extrato anual {ano}', [
+            ('TRANSAÇÕES', ['Data', 'Descrição', 'Categoria', 'Tipo', 'Pagamento', 'Valor'],
+             [10, 34, 18, 8, 14, 12],
+             linhas(transacoes, lambda t: [data_br(t[0]), t[1], t[2], t[3], t[4],
+                                           formatar_valor(t[5]).rjust(12)])),
+            ('FATURAS DO CARTÃO', ['Cartão', 'Mês', 'Vencimento', 'Total', 'Pago', 'Status'],
+             [24, 8, 10, 12, 12, 10],
+             linhas(faturas, lambda f: [f[0], f'{f[1]:02d}/{f[2]}', data_br(f[3]),
+                                        formatar_valor(f[4] or 0).rjust(12),
+                                        formatar_valor(f[5] or 0).rjust(12), f[6]])),
+            ('MOVIMENTAÇÕES BANCÁRIAS', ['Data', 'Banco', 'Movimento', 'Descrição', 'Valor'],
+             [10, 20, 9, 46, 12],
+             linhas(movimentacoes, lambda m: [data_br(m[0]), m[1], m[2], m[3],
+                                              formatar_valor(m[4]).rjust(12)])),
+        ])
+
+
+GERADORES = {
+    'extrato_anual': extrato_anual,
+}
+
+
+# ===== WORKER =====
+
+@click.command('worker')
+@click.option('--uma-vez', is_flag=True,
+              help='Processa as tarefas disponíveis e sai (para cron/testes).')
+@click.option('--intervalo', default=INTERVALO_CONSULTA, show_default=True,
+              help='Segundos de espera quando a fila está vazia.')
+@with_appcontext
+def worker_cli(uma_vez, intervalo):
+    """Gera os relatórios em arquivo da fila tarefas_relatorio."""
+    click.echo("👷 Worker de relatórios iniciado.")
+    proxima_limpeza = 0
+
+    while True:
+        if time.monotonic() >= proxima_limpeza:
+            apagadas = limpar_antigas()
+            if apagadas:
+                click.echo(f"🧹 {apagadas} tarefa(s) antigas apagadas com os arquivos.")
+            proxima_limpeza = time.monotonic() + INTERVALO_LIMPEZA
+
+        liberadas = liberar_expiradas()
+        if liberadas:
+            click.echo(f"⏰ {liberadas} tarefa(s) expiradas devolvidas à fila.")
+
+        tarefa = reservar_tarefa()
+        if tarefa is None:
+            if uma_vez:
+                break
+            time.sleep(intervalo)
+            continue
+
+        inicio = time.perf_counter()
+        if executar_tarefa(tarefa):
+            click.echo(f"✅ Tarefa {tarefa.id} ({tarefa.tipo}.{tarefa.formato}) "
+                       f"concluída em {time.perf_counter() - inicio:.2f}s")
+        else:
+            db.session.refresh(tarefa)
+            click.echo(f"❌ Tarefa {tarefa.id} falhou (tentativa {tarefa.tentativas}, "
+                       f"status {tarefa.status}): {tarefa.erro}")
+
+    click.echo("✅ Fila de relatórios vazia.")
@@ -0,0 +1,154 @@
+"""
+Tendências de vários anos: variações mês a mês e ano a ano, médias
+móveis por categoria e taxa de poupança.
+
+Os dados vêm do resumo mensal (uma linha por mês × categoria × tipo ×
+forma de pagamento), carregados de uma vez em arrays NumPy. Os totais
+por mês e categoria são montados com np.add.at, as variações com
+diferenças entre colunas defasadas e as médias móveis com np.cumsum;
+nenhum laço em Python percorre meses ou transações.
+
+Os valores são somados em centavos (inteiros) e só convertidos para
+reais na saída.
+"""
+
+from datetime import date
+
+import numpy as np
+
+from models import db, CATEGORIA_PADRAO, Categoria, ResumoMensal
+
+ANOS_PADRAO = 5
+ANOS_MAXIMO = 20
+JANELAS_MEDIA = (3, 6, 12)
+
+
+# ===== CARGA =====
+
+def _indice_mes(ano, mes):
+    return ano * 12 + mes - 1
+
+
+def carregar_resumo(usuario_id, primeiro, ultimo):
+    """
+    Arrays (mes, categoria, receita, centavos) do resumo do usuário entre
+    os índices de mês `primeiro` e `ultimo` (ano * 12 + mes - 1).
+    `mes` já vem relativo a `primeiro`.
+    """
+    indice = ResumoMensal.ano * 12 + ResumoMensal.mes - 1
+    linhas = db.session.execute(
+        db.select(
+            indice, db.func.coalesce(ResumoMensal.categoria_id, 0),
+            ResumoMensal.tipo == 'Receita',
+            # Centavos crus da coluna, sem passar por Decimal
+            db.func.sum(db.type_coerce(ResumoMensal.total, db.BigInteger))
+        ).where(
+            ResumoMensal.usuario_id == usuario_id,
+            indice.between(primeiro, ultimo)
+        ).group_by(indice, ResumoMensal.categoria_id, ResumoMensal.tipo)
+    ).all()
+
+    dados = np.array(linhas, dtype=np.int64).reshape(-1, 4)
+    return dados[:, 0] - primeiro, dados[:, 1], dados[:, 2].astype(bool), dados[:, 3]
+
+
+# ===== SÉRIES =====
+
+def _variacao(series, defasagem):
+    """Diferença (absoluta e %) de cada mês para `defasagem` meses antes"""
+    absoluta = np.full(series.shape, np.nan)
+    percentual = np.full(series.shape, np.nan)
+    if series.shape[-1] > defasagem:
+        atual, anterior = series[..., defasagem:], series[..., :-defasagem]
+        absoluta[..., defasagem:] = atual - anterior
+        with np.errstate(divide='ignore', invalid='ignore'):
+            percentual[..., defasagem:] = np.where(
+                anterior != 0, (atual - anterior) / np.abs(anterior) * 100, np.nan)
+    return absoluta, percentual
+
+
+def _media_movel(series, janela):
+    """Média dos últimos `janela` meses; NaN enquanto a janela não se completa"""
+    acumulado = np.cumsum(series, axis=-1)
+    media = np.full(series.shape, np.nan)
+    if series.shape[-1] >= janela:
+        soma = acumulado[..., janela - 1:].copy()
+        soma[..., 1:] -= acumulado[..., :-janela]
+        media[..., janela - 1:] = soma / janela
+    return media
+
+
+def _reais(valores):
+    """Centavos (array) para lista de reais, com None no lugar de NaN"""
+    return [None if np.isnan(v) else round(v / 100, 2) for v in valores.tolist()]
+
+
+def _percentuais(valores):
+    return [None if np.isnan(v) else round(v, 1) for v in valores.tolist()]
+
+
+def _serie(centavos):
+    """Valores, variações e médias móveis de uma série (ou matriz) mensal"""
+    mensal, mensal_pct = _variacao(centavos, 1)
+    anual, anual_pct = _variacao(centavos, 12)
+    return {'total': centavos, 'variacao_mensal': mensal,
+            'variacao_mensal_pct': mensal_pct, 'variacao_anual': anual,
+            'variacao_anual_pct': anual_pct,
+            **{f'media_{janela}': _media_movel(centavos, janela)
+               for janela in JANELAS_MEDIA}}
+
+
+def _serie_para_dict(serie, linha=None):
+    return {nome: (_percentuais if nome.endswith('_pct') else _reais)(
+                valores if linha is None else valores[linha])
+            for nome, valores in serie.items()}
+
+
+def calcular_tendencias(usuario_id, anos=ANOS_PADRAO, hoje=None):
+    """
+    Séries mensais dos últimos `anos` anos (até o mês de `hoje`):
+    receitas, despesas e taxa de poupança do mês, e as despesas de cada
+    categoria, todas com variação mês a mês e ano a ano e médias móveis
+    de 3, 6 e 12 meses.
+    """
+    hoje = hoje or date.today()
+    anos = max(1, min(anos, ANOS_MAXIMO))
+    ultimo = _indice_mes(hoje.year, hoje.month)
+    primeiro = ultimo - anos * 12 + 1
+    quantidade_meses = anos * 12
+
+    mes, categoria, receita, centavos = carregar_resumo(usuario_id, primeiro, ultimo)
+    despesa = ~receita
+
+    receitas = np.bincount(mes[receita], weights=centavos[receita],
+                           minlength=quantidade_meses)
+    despesas = np.bincount(mes[despesa], weights=centavos[despesa],
+                           minlength=quantidade_meses)
+
+    # Matriz categoria × mês das despesas
+    categoria_ids, linha_categoria = np.unique(categoria[despesa], return_inverse=True)
+    por_categoria = np.zeros((len(categoria_ids), quantidade_meses))
+    np.add.at(por_categoria, (linha_categoria, mes[despesa]), centavos[despesa])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        taxa_poupanca = np.where(
+            receitas > 0, (receitas - despesas) / receitas * 100, np.nan)
+
+    nomes = dict(db.session.query(Categoria.id, Categoria.nome).filter(
+        Categoria.usuario_id == usuario_id))
+    serie_categorias = _serie(por_categoria)
+    categorias = sorted(
+        ({'categoria': nomes.get(categoria_id, CATEGORIA_PADRAO),
+          **_serie_para_dict(serie_categorias, linha)}
+         for linha, categoria_id in enumerate(categoria_ids.tolist())),
+        key=lambda c: c['categoria'])
+
+    meses = np.arange(primeiro, ultimo + 1)
+    return {
+        'anos': anos,
+        'meses': [f'{m // 12}-{m % 12 + 1:02d}' for m in meses.tolist()],
+        'receitas': _serie_para_dict(_serie(receitas)),
+        'despesas': _serie_para_dict(_serie(despesas)),
+        'taxa_poupanca': _percentuais(taxa_poupanca),
+        'categorias': categorias,
+    }
@@ -178,6 +178,43 @@ class TestComprasCartao:
 
         print("✅ Teste PASSOU: Compra parcelada")
 
+    def test_transacao_ligada_a_compra(self, client, usuario_teste):
+        """✅ Teste: Transação de cartão e compra sincronizadas pela chave"""
+        with app.app_context():
+            usuario = db.session.get(Usuario, usuario_teste)
+            cartao = CartaoCredito(usuario_id=usuario_teste, nome='Nubank',
+                                   dia_fechamento=24, dia_vencimento=5)
+            db.session.add(cartao)
+            db.session.commit()
+            client.post('/login', data={'email': usuario.email,
+                                        'senha': 'senha123'})
+
+            client.post('/adicionar', data={
+                'descricao': 'Fone', 'valor': '150,00', 'categoria': 'Eletrônicos',
+                'tipo': 'Despesa', 'data': date.today().isoformat(),
+                'forma_pagamento': 'Cartão de Crédito', 'cartao_id': cartao.id})
+
+            transacao = Transacao.query.filter_by(usuario_id=usuario_teste).one()
+            compra = CompraCartao.query.filter_by(usuario_id=usuario_teste).one()
+            assert transacao.compra_cartao_id == compra.id
+
+            # Editar a compra (descrição e valor) chega na transação pela chave
+            client.post(f'/compras-cartao/editar/{compra.id}', data={
+                'descricao': 'Fone Bluetooth', 'valor': '180,00',
+                'quantidade_parcelas': 1, 'categoria': 'Eletrônicos',
+                'data_compra': date.today().isoformat()})
+            db.session.expire_all()
+            transacao = db.session.get(Transacao, transacao.id)
+            assert transacao.descricao == 'Fone Bluetooth'
+            assert transacao.valor == 180
+
+            # Apagar a transação apaga a compra ligada a ela
+            client.post(f'/deletar/{transacao.id}')
+            assert CompraCartao.query.filter_by(
+                usuario_id=usuario_teste).count() == 0
+
+        print("✅ Teste PASSOU: Transação ligada à compra")
+
 
 # ========== TESTES DE FATURAS ==========
 
@@ -238,6 +275,114 @@ class TestFaturas:
 
         print("✅ Teste PASSOU: Fatura depois do fechamento")
 
+    def test_livro_de_parcelas(self, client, usuario_teste):
+        """✅ Teste: Compra parcelada lança uma parcela em cada fatura"""
+        from decimal import Decimal
+        from models import TransacaoFatura
+
+        with app.app_context():
+            usuario = db.session.get(Usuario, usuario_teste)
+            cartao = CartaoCredito(usuario_id=usuario_teste, nome='Parcelado',
+                                   dia_fechamento=24, dia_vencimento=5)
+            db.session.add(cartao)
+            db.session.commit()
+            client.post('/login', data={'email': usuario.email,
+                                        'senha': 'senha123'})
+
+            # 3x de R$ 100,00: o centavo que sobra fica na 1ª parcela
+            client.post('/compras-cartao/criar', data={
+                'cartao_id': cartao.id, 'descricao': 'Geladeira',
+                'valor': '100,00', 'quantidade_parcelas': 3,
+                'categoria': 'Casa', 'data_compra': '2025-11-18'})
+
+            compra = CompraCartao.query.filter_by(usuario_id=usuario_teste).one()
+            parcelas = TransacaoFatura.query.filter_by(
+                compra_cartao_id=compra.id).order_by(
+                TransacaoFatura.numero_parcela).all()
+            assert [p.valor_parcela for p in parcelas] == [
+                Decimal('33.34'), Decimal('33.33'), Decimal('33.33')]
+            assert [(p.fatura.mes, p.fatura.ano) for p in parcelas] == [
+                (11, 2025), (12, 2025), (1, 2026)]
+            assert sum(f.valor_total for f in FaturaCartao.query.filter_by(
+                cartao_id=cartao.id)) == Decimal('100.00')
+
+            # Editar estorna as parcelas antigas e relança
+            client.post(f'/compras-cartao/editar/{compra.id}', data={
+                'descricao': 'Geladeira', 'valor': '120,00',
+                'quantidade_parcelas': 2, 'categoria': 'Casa',
+                'data_compra': '2025-11-18'})
+            db.session.expire_all()
+            totais = {(f.mes, f.ano): f.valor_total for f in
+                      FaturaCartao.query.filter_by(cartao_id=cartao.id)}
+            assert totais == {(11, 2025): Decimal('60.00'),
+                              (12, 2025): Decimal('60.00')}
+
+            # Apagar a compra retira as parcelas e as faturas zeradas
+            client.post(f'/compras-cartao/deletar/{compra.id}')
+            assert TransacaoFatura.query.count() == 0
+            assert FaturaCartao.query.filter_by(cartao_id=cartao.id).count() == 0
+
+        print("✅ Teste PASSOU: Livro de parcelas das faturas")
+
+    def test_fatura_upsert_unica_por_mes(self, usuario_teste, tmp_path):
+        """✅ Teste: Somar na fatura é um upsert na chave única do mês"""
+        from decimal import Decimal
+        from sqlalchemy import create_engine, text
+        from sqlalchemy.exc import IntegrityError
+        from faturas import somar_nas_faturas
+        from migracoes import m013_fatura_unica_por_mes
+
+        with app.app_context():
+            cartao = CartaoCredito(usuario_id=usuario_teste, nome='Upsert',
+                                   dia_fechamento=24, dia_vencimento=5)
+            db.session.add(cartao)
+            db.session.commit()
+
+            somar_nas_faturas(cartao, {(11, 2025): Decimal('40.00')})
+            somar_nas_faturas(cartao, {(11, 2025): Decimal('2.50'),
+                                       (12, 2025): Decimal('10.00')})
+            somar_nas_faturas(cartao, {(11, 2025): Decimal('-12.50')})
+            db.session.commit()
+
+            faturas = {(f.mes, f.ano): f.valor_total for f in
+                       FaturaCartao.query.filter_by(cartao_id=cartao.id)}
+            assert faturas == {(11, 2025): Decimal('30.00'),
+                               (12, 2025): Decimal('10.00')}
+
+            # O banco recusa uma segunda fatura para o mesmo mês
+            db.session.add(FaturaCartao(
+                usuario_id=usuario_teste, cartao_id=cartao.id, mes=11, ano=2025,
+                data_fechamento=date(2025, 11, 24),
+                data_vencimento=date(2025, 12, 5)))
+            with pytest.raises(IntegrityError):
+                db.session.commit()
+            db.session.rollback()
+
+        # A migração junta faturas duplicadas de bancos antigos
+        engine = create_engine(f"sqlite:///{tmp_path / 'antigo.db'}")
+        with engine.begin() as conexao:
+            conexao.execute(text(
+                'CREATE TABLE faturas_cartao (id INTEGER PRIMARY KEY, '
+                'usuario_id INTEGER, cartao_id INTEGER, mes INTEGER, ano INTEGER, '
+                'valor_total BIGINT, valor_pago BIGINT, valor_restante BIGINT)'))
+            conexao.execute(text(
+                'CREATE TABLE transacoes_fatura (id INTEGER PRIMARY KEY, fatura_id INTEGER)'))
+            conexao.execute(text(
+                'CREATE TABLE pagamentos_fatura (id INTEGER PRIMARY KEY, fatura_id INTEGER)'))
+            conexao.execute(text(
+                'INSERT INTO faturas_cartao VALUES '
+                '(1, 1, 1, 11, 2025, 1000, 500, 500), (2, 1, 1, 11, 2025, 2000, 0, 2000)'))
+            conexao.execute(text('INSERT INTO transacoes_fatura VALUES (1, 2)'))
+            m013_fatura_unica_por_mes(conexao)
+
+            assert conexao.execute(text(
+                'SELECT id, valor_total, valor_pago, valor_restante FROM faturas_cartao'
+            )).all() == [(1, 3000, 500, 2500)]
+            assert conexao.execute(text(
+                'SELECT fatura_id FROM transacoes_fatura')).scalar() == 1
+
+        print("✅ Teste PASSOU: Fatura única por mês com upsert")
+
 
 # ========== TESTES DE TRANSAÇÕES ==========
 
@@ -293,6 +438,238 @@ class TestTransacoes:
 
         print("✅ Teste PASSOU: Transação receita")
 
+    def test_paginacao_keyset(self, usuario_teste):
+        """✅ Teste: Paginação por cursor percorre tudo sem repetir"""
+        with app.app_context():
+            from app import paginar_transacoes
+
+            datas = [date(2025, 1, 1), date(2025, 1, 2), date(2025, 1, 2),
+                     date(2025, 1, 3), date(2025, 1, 3)]
+            for i, data in enumerate(datas):
+                db.session.add(Transacao(
+                    usuario_id=usuario_teste,
+                    descricao=f'Transação {i}',
+                    valor=10.00,
+                    categoria='Testes',
+                    tipo='Despesa',
+                    forma_pagamento='Dinheiro',
+                    data=data
+                ))
+            db.session.commit()
+
+            query = Transacao.query.filter_by(usuario_id=usuario_teste)
+            vistas = []
+            cursor = None
+            while True:
+                pagina, cursor = paginar_transacoes(query, cursor, 2)
+                vistas.extend(pagina)
+                if not cursor:
+                    break
+
+            esperado = sorted(query.all(), key=lambda t: (t.data, t.id),
+                              reverse=True)
+            assert [t.id for t in vistas] == [t.id for t in esperado]
+
+        print("✅ Teste PASSOU: Paginação por cursor")
+
+    def test_busca_com_filtros_e_resumo(self, usuario_teste):
+        """✅ Teste: Busca filtrada devolve página e totais na mesma consulta"""
+        with app.app_context():
+            from app import buscar_transacoes
+
+            dados = [('Mercado 50%', 100.00, 'Alimentação', 'Despesa'),
+                     ('Mercado bairro', 40.00, 'Alimentação', 'Despesa'),
+                     ('Salário', 1000.00, 'Salário', 'Receita')]
+            for descricao, valor, categoria, tipo in dados:
+                db.session.add(Transacao(
+                    usuario_id=usuario_teste,
+                    descricao=descricao,
+                    valor=valor,
+                    categoria=categoria,
+                    tipo=tipo,
+                    forma_pagamento='Dinheiro',
+                    data=date(2025, 2, 10)
+                ))
+            db.session.commit()
+
+            transacoes, resumo, cursor = buscar_transacoes(
+                usuario_teste, {'categoria': 'Alimentação'}, None, 1)
+            assert len(transacoes) == 1
+            assert cursor is not None
+            assert resumo['quantidade'] == 2
+            assert resumo['total_despesas'] == 140.00
+
+            # O '%' digitado é literal, não curinga
+            transacoes, resumo, _ = buscar_transacoes(
+                usuario_teste, {'q': '50%'}, None, 10)
+            assert [t.descricao for t in transacoes] == ['Mercado 50%']
+
+            transacoes, resumo, cursor = buscar_transacoes(
+                usuario_teste, {'tipo': 'Receita', 'q': 'inexistente'}, None, 10)
+            assert transacoes == [] and cursor is None
+            assert resumo['quantidade'] == 0 and resumo['saldo'] == 0
+
+        print("✅ Teste PASSOU: Busca com filtros")
+
+    def test_exportacao_csv_e_ofx(self, usuario_teste):
+        """✅ Teste: Exportação em CSV e OFX respeita os filtros"""
+        with app.app_context():
+            from app import exportacao_transacoes
+
+            for dia, descricao, tipo in [(1, 'Salário', 'Receita'),
+                                         (5, 'Aluguel & condomínio', 'Despesa'),
+                                         (20, 'Fora do período', 'Despesa')]:
+                db.session.add(Transacao(
+                    usuario_id=usuario_teste, descricao=descricao,
+                    valor=1250.50, categoria='Casa', tipo=tipo,
+                    forma_pagamento='Dinheiro', data=date(2025, 4, dia)))
+            db.session.commit()
+
+            filtros = {'data_inicio': '2025-04-01', 'data_fim': '2025-04-10'}
+
+            csv = ''.join(exportacao_transacoes(usuario_teste, filtros, 'csv'))
+            linhas = csv.lstrip('\ufeff').splitlines()
+            assert linhas[0].startswith('Data;Descrição')
+            assert linhas[1] == '01/04/2025;Salário;Casa;Receita;Dinheiro;1250,50;'
+            assert len(linhas) == 3
+
+            ofx = ''.join(exportacao_transacoes(usuario_teste, filtros, 'ofx'))
+            assert ofx.count('<STMTTRN>') == 2
+            assert '<TRNAMT>-1250.50' in ofx
+            assert 'Aluguel &amp; condomínio' in ofx
+            assert '<DTSTART>20250401<DTEND>20250405' in ofx
+
+        print("✅ Teste PASSOU: Exportação CSV/OFX")
+
+    def test_importacao_em_lote_sem_duplicatas(self, client, usuario_teste, monkeypatch):
+        """✅ Teste: Importação de extrato atualiza o saldo e ignora duplicatas"""
+        with app.app_context():
+            import io
+            from app import importar_extrato
+
+            banco = Banco(usuario_id=usuario_teste, nome='Itaú',
+                          tipo='Corrente', saldo=1000.00)
+            db.session.add(banco)
+            db.session.commit()
+
+            extrato = ('Data;Histórico;Valor\n'
+                       '01/05/2025;Café;-5,50\n'
+                       '01/05/2025;Café;-5,50\n'
+                       '02/05/2025;PIX recebido;1.200,00\n'
+                       '03/05/2025;Linha quebrada;abc\n')
+
+            resumo = importar_extrato(usuario_teste, io.StringIO(extrato),
+                                      'csv', banco=banco, tamanho_lote=2)
+            assert resumo['importadas'] == 3
+            assert resumo['total_erros'] == 1
+            assert Banco.query.get(banco.id).saldo == pytest.approx(2189.00)
+            assert MovimentacaoBanco.query.filter_by(
+                banco_id=banco.id).count() == 3
+
+            # Reimportar o mesmo arquivo não duplica nada
+            resumo = importar_extrato(usuario_teste, io.StringIO(extrato),
+                                      'csv', banco=banco)
+            assert resumo['importadas'] == 0
+            assert resumo['duplicadas'] == 3
+            assert Banco.query.get(banco.id).saldo == pytest.approx(2189.00)
+
+            ofx = ('<OFX><BANKTRANLIST>\n'
+                   '<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20250503120000'
+                   '<TRNAMT>-30.00<FITID>1<MEMO>Farmácia</STMTTRN>\n'
+                   '</BANKTRANLIST></OFX>\n')
+            resumo = importar_extrato(usuario_teste, io.StringIO(ofx),
+                                      'ofx', banco=banco)
+            assert resumo['importadas'] == 1
+            assert Transacao.query.filter_by(
+                usuario_id=usuario_teste, descricao='Farmácia').one().valor == 30.00
+
+            # Conta de destino malformada volta ao formulário (sem erro 500)
+            usuario = db.session.get(Usuario, usuario_teste)
+            client.post('/login', data={'email': usuario.email, 'senha': 'senha123'})
+            for destino in ('banco:', 'banco:abc', 'cartao:'):
+                resposta = client.post('/importar', data={
+                    'destino': destino,
+                    'arquivo': (io.BytesIO(extrato.encode()), 'extrato.csv')})
+                assert resposta.status_code == 302
+
+            # Extrato de cartão: créditos de todos os meses numa só soma às faturas
+            import app as aplicacao
+            chamadas = []
+            somar = aplicacao.somar_nas_faturas
+            def contar(cartao, valores):
+                chamadas.append(dict(valores))
+                return somar(cartao, valores)
+
+            cartao = CartaoCredito(usuario_id=usuario_teste, nome='Visa',
+                                   dia_fechamento=24, dia_vencimento=5)
+            db.session.add(cartao)
+            db.session.commit()
+            fatura_cartao = ('Data;Histórico;Valor\n'
+                             '05/05/2025;Livraria;-100,00\n'
+                             '06/05/2025;Estorno livraria;30,00\n'
+                             '26/05/2025;Cashback;10,00\n')
+            monkeypatch.setattr(aplicacao, 'somar_nas_faturas', contar)
+            resumo = importar_extrato(usuario_teste, io.StringIO(fatura_cartao),
+                                      'csv', cartao=cartao)
+            assert resumo['importadas'] == 3
+            assert chamadas == [{(5, 2025): -30, (6, 2025): -10}]
+            faturas = {(f.mes, f.ano): f.valor_total for f in FaturaCartao.query.filter_by(
+                cartao_id=cartao.id)}
+            assert faturas == {(5, 2025): 70, (6, 2025): -10}
+
+        print("✅ Teste PASSOU: Importação de extrato")
+
+    def test_valores_em_centavos(self, usuario_teste, tmp_path):
+        """✅ Teste: Valores gravados em centavos e somas exatas"""
+        from decimal import Decimal
+        from sqlalchemy import create_engine, text
+        from app import parse_valor, format_decimal
+        from migracoes import m009_valores_em_centavos
+
+        with app.app_context():
+            for _ in range(10):
+                db.session.add(Transacao(
+                    usuario_id=usuario_teste, descricao='Troco',
+                    valor=0.1, categoria='Outros', tipo='Despesa',
+                    data=date.today(), forma_pagamento='Dinheiro'))
+            db.session.add(Transacao(
+                usuario_id=usuario_teste, descricao='Salário',
+                valor=parse_valor('1.234,56'), categoria='Salário',
+                tipo='Receita', data=date.today(), forma_pagamento='Dinheiro'))
+            db.session.commit()
+
+            # No banco é inteiro (centavos); no Python, Decimal
+            brutos = {linha[0] for linha in db.session.execute(text(
+                'SELECT valor FROM transacoes WHERE usuario_id = :u'),
+                {'u': usuario_teste})}
+            assert brutos == {10, 123456}
+
+            soma = db.session.query(db.func.sum(Transacao.valor)).filter(
+                Transacao.usuario_id == usuario_teste,
+                Transacao.tipo == 'Despesa').scalar()
+            assert soma == Decimal('1.00')
+            assert format_decimal(soma) == '1,00'
+
+            # Entradas que não são números finitos viram zero
+            assert parse_valor('nan') == parse_valor('-Infinity') == Decimal('0.00')
+            assert parse_valor('250.99') == parse_valor('250,99') == Decimal('250.99')
+
+        # Banco antigo com valores em float é convertido pela migração 9
+        engine = create_engine(f"sqlite:///{tmp_path / 'float.db'}")
+        with engine.begin() as conexao:
+            from migracoes import COLUNAS_DINHEIRO
+            for tabela in {t for t, _ in COLUNAS_DINHEIRO}:
+                colunas = ', '.join(f'{c} FLOAT' for t, c in COLUNAS_DINHEIRO
+                                    if t == tabela)
+                conexao.execute(text(f'CREATE TABLE {tabela} (id INTEGER, {colunas})'))
+            conexao.execute(text('INSERT INTO transacoes VALUES (1, 19.99)'))
+            m009_valores_em_centavos(conexao)
+            assert conexao.execute(text(
+                'SELECT valor FROM transacoes')).scalar() == 1999
+        engine.dispose()
+
+        print("✅ Teste PASSOU: Valores em centavos")
+
 
 # ========== TESTES DE BANCOS ==========
 
@@ -375,6 +752,67 @@ class TestCategorias:
 
         print("✅ Teste PASSOU: Criação de categoria")
 
+    def test_categoria_como_chave_estrangeira(self, usuario_teste, tmp_path):
+        """✅ Teste: Categoria pelo nome vira categoria_id (e a migração converte)"""
+        from sqlalchemy import create_engine, inspect, text
+        from migracoes import m010_categoria_id
+
+        with app.app_context():
+            for descricao in ('Uber', '99'):
+                db.session.add(Transacao(
+                    usuario_id=usuario_teste, descricao=descricao, valor=20,
+                    categoria='Transporte', tipo='Despesa',
+                    data=date.today(), forma_pagamento='Dinheiro'))
+            db.session.commit()
+
+            # A categoria inexistente foi criada uma vez e é compartilhada
+            transporte = Categoria.query.filter_by(
+                usuario_id=usuario_teste, nome='Transporte').one()
+            transacoes = Transacao.query.filter_by(usuario_id=usuario_teste).all()
+            assert {t.categoria_id for t in transacoes} == {transporte.id}
+            assert transacoes[0].categoria == 'Transporte'
+
+            # Renomear a categoria vale para todas as transações
+            transporte.nome = 'Mobilidade'
+            db.session.commit()
+            assert Transacao.query.filter(
+                Transacao.categoria == 'Mobilidade').count() == 2
+
+        # Banco antigo: categoria em texto livre
+        engine = create_engine(f"sqlite:///{tmp_path / 'antigo.db'}")
+        with engine.begin() as conexao:
+            conexao.execute(text(
+                'CREATE TABLE categorias (id INTEGER PRIMARY KEY, '
+                'usuario_id INTEGER, nome VARCHAR(100), data_criacao DATETIME)'))
+            conexao.execute(text(
+                "INSERT INTO categorias (usuario_id, nome) VALUES (1, 'Casa')"))
+            for tabela in ('transacoes', 'compras_cartao',
+                           'recorrencias', 'orcamentos'):
+                conexao.execute(text(
+                    f'CREATE TABLE {tabela} (id INTEGER PRIMARY KEY, '
+                    f'usuario_id INTEGER, categoria VARCHAR(100), data DATE)'))
+            conexao.execute(text(
+                'CREATE INDEX ix_transacoes_usuario_categoria_data '
+                'ON transacoes (usuario_id, categoria, data)'))
+            conexao.execute(text(
+                "INSERT INTO transacoes (usuario_id, categoria) VALUES "
+                "(1, 'Casa'), (1, 'Lazer'), (2, 'Lazer'), (2, '')"))
+
+            m010_categoria_id(conexao)
+
+            assert 'categoria' not in {
+                c['name'] for c in inspect(conexao).get_columns('transacoes')}
+            linhas = conexao.execute(text(
+                'SELECT t.usuario_id, c.usuario_id, c.nome FROM transacoes t '
+                'JOIN categorias c ON c.id = t.categoria_id ORDER BY t.id')).all()
+            assert [tuple(l) for l in linhas] == [
+                (1, 1, 'Casa'), (1, 1, 'Lazer'), (2, 2, 'Lazer'), (2, 2, 'Outros')]
+            assert conexao.execute(text(
+                'SELECT COUNT(*) FROM categorias')).scalar() == 4
+        engine.dispose()
+
+        print("✅ Teste PASSOU: Categoria como chave estrangeira")
+
 
 # ========== TESTES DE RECORRÊNCIAS ==========
 
@@ -410,6 +848,821 @@ class TestRecorrencias:
 
         print("✅ Teste PASSOU: Criação de recorrência")
 
+    def test_processar_recorrencias_em_lote(self, usuario_teste):
+        """✅ Teste: Processamento em lote gera uma vez por dia"""
+        with app.app_context():
+            from app import processar_recorrencias
+
+            hoje = date(2025, 3, 10)
+            for descricao, frequencia in [('Aluguel', 'Mensal'),
+                                          ('Café', 'Diária'),
+                                          ('Seguro', 'Anual')]:
+                db.session.add(Recorrencia(
+                    usuario_id=usuario_teste,
+                    descricao=descricao,
+                    valor=10.00,
+                    tipo='Despesa',
+                    categoria='Testes',
+                    forma_pagamento='Dinheiro',
+                    frequencia=frequencia,
+                    dia_vencimento=10,
+                    data_inicio=date(2025, 1, 10),
+                    ativa=True
+                ))
+            db.session.commit()
+
+            assert processar_recorrencias(hoje) == 2
+            assert processar_recorrencias(hoje) == 0
+
+            geradas = Transacao.query.filter_by(
+                usuario_id=usuario_teste, data=hoje).all()
+            assert sorted(t.descricao for t in geradas) == [
+                '[REC] Aluguel', '[REC] Café']
+
+        print("✅ Teste PASSOU: Processamento de recorrências em lote")
+
+    def test_recorrencia_com_banco(self, client, usuario_teste):
+        """✅ Teste: Ocorrência criada com a recorrência movimenta o banco e é estornada"""
+        with app.app_context():
+            usuario = db.session.get(Usuario, usuario_teste)
+            banco = Banco(usuario_id=usuario_teste, nome='Itaú',
+                          tipo='Corrente', saldo=1000.00)
+            db.session.add(banco)
+            db.session.commit()
+            client.post('/login', data={'email': usuario.email, 'senha': 'senha123'})
+
+            client.post('/recorrencias/criar', data={
+                'descricao': 'Aluguel', 'valor': '400,00', 'tipo': 'Despesa',
+                'categoria': 'Casa', 'forma_pagamento': 'Débito',
+                'banco_id': banco.id, 'frequencia': 'Mensal',
+                'dia_vencimento': date.today().day,
+                'data_inicio': date.today().isoformat()})
+
+            db.session.expire_all()
+            assert db.session.get(Banco, banco.id).saldo == pytest.approx(600.00)
+            movimento = MovimentacaoBanco.query.filter_by(banco_id=banco.id).one()
+            assert movimento.tipo_movimento == 'saida' and movimento.valor == 400
+
+            assert movimento.transacao_id == Transacao.query.filter_by(
+                usuario_id=usuario_teste).one().id
+
+            # Movimento manual idêntico não é confundido com o da ocorrência
+            manual = MovimentacaoBanco(
+                banco_id=banco.id, tipo_movimento='saida', valor=400,
+                descricao=movimento.descricao, data=movimento.data)
+            db.session.add(manual)
+            db.session.commit()
+
+            recorrencia = Recorrencia.query.filter_by(usuario_id=usuario_teste).one()
+            client.post(f'/recorrencias/deletar/{recorrencia.id}')
+
+            db.session.expire_all()
+            assert db.session.get(Banco, banco.id).saldo == pytest.approx(1000.00)
+            assert [m.id for m in MovimentacaoBanco.query.filter_by(
+                banco_id=banco.id)] == [manual.id]
+
+        print("✅ Teste PASSOU: Recorrência com banco")
+
+    def test_deletar_ocorrencia_gerada(self, client, usuario_teste):
+        """✅ Teste: Apagar uma ocorrência gerada estorna o saldo e a movimentação"""
+        with app.app_context():
+            from app import processar_recorrencias
+
+            usuario = db.session.get(Usuario, usuario_teste)
+            banco = Banco(usuario_id=usuario_teste, nome='Itaú',
+                          tipo='Corrente', saldo=1000.00)
+            db.session.add(banco)
+            db.session.flush()
+            db.session.add(Recorrencia(
+                usuario_id=usuario_teste, descricao='Café', valor=10.00,
+                tipo='Despesa', categoria='Alimentação', forma_pagamento='Débito',
+                banco_id=banco.id, frequencia='Diária', dia_vencimento=1,
+                data_inicio=date(2025, 3, 1), ativa=True))
+            db.session.commit()
+
+            for dia in (date(2025, 3, 1), date(2025, 3, 2)):
+                processar_recorrencias(dia)
+            db.session.expire_all()
+            assert db.session.get(Banco, banco.id).saldo == pytest.approx(980.00)
+            assert MovimentacaoBanco.query.filter_by(banco_id=banco.id).count() == 2
+
+            primeira = Transacao.query.filter_by(
+                usuario_id=usuario_teste, data=date(2025, 3, 1)).one()
+            client.post('/login', data={'email': usuario.email, 'senha': 'senha123'})
+            client.post(f'/deletar/{primeira.id}')
+
+            db.session.expire_all()
+            assert db.session.get(Banco, banco.id).saldo == pytest.approx(990.00)
+            restantes = MovimentacaoBanco.query.filter_by(banco_id=banco.id).all()
+            assert [m.data for m in restantes] == [date(2025, 3, 2)]
+
+        print("✅ Teste PASSOU: Ocorrência gerada apagada")
+
+    def test_motor_de_regras(self):
+        """✅ Teste: Datas geradas pelo motor de regras"""
+        from regras_recorrencia import gerar_ocorrencias, proxima_ocorrencia
+
+        mensal = list(gerar_ocorrencias(
+            'mensal', 31, date(2025, 1, 15), date(2025, 4, 30)))
+        assert mensal == [date(2025, 1, 31), date(2025, 2, 28),
+                          date(2025, 3, 31), date(2025, 4, 30)]
+
+        semanal = gerar_ocorrencias('Semanal', 1, date(2025, 1, 1),
+                                    a_partir_de=date(2025, 1, 9))
+        assert next(semanal) == date(2025, 1, 15)
+
+        trimestral = list(gerar_ocorrencias(
+            'Trimestral', 5, date(2025, 1, 10), date(2025, 12, 31)))
+        assert trimestral == [date(2025, 4, 5), date(2025, 7, 5),
+                              date(2025, 10, 5)]
+
+        rec = Recorrencia(frequencia='Anual', dia_vencimento=20,
+                          data_inicio=date(2024, 6, 1),
+                          data_fim=date(2025, 12, 31))
+        assert proxima_ocorrencia(rec, date(2025, 6, 21)) is None
+        assert proxima_ocorrencia(rec, date(2025, 1, 1)) == date(2025, 6, 20)
+
+        print("✅ Teste PASSOU: Motor de regras")
+
+    def test_proxima_ocorrencia_avanca(self, usuario_teste):
+        """✅ Teste: proxima_ocorrencia é preenchida e avançada"""
+        with app.app_context():
+            from app import processar_recorrencias
+
+            rec = Recorrencia(
+                usuario_id=usuario_teste,
+                descricao='Academia',
+                valor=90.00,
+                tipo='Despesa',
+                categoria='Testes',
+                forma_pagamento='Dinheiro',
+                frequencia='mensal',
+                dia_vencimento=5,
+                data_inicio=date(2025, 1, 1),
+                ativa=True
+            )
+            db.session.add(rec)
+            db.session.commit()
+            assert rec.proxima_ocorrencia == date(2025, 1, 5)
+
+            assert processar_recorrencias(date(2025, 2, 5)) == 1
+            assert rec.proxima_ocorrencia == date(2025, 3, 5)
+
+            # Nada vence antes da próxima ocorrência
+            assert processar_recorrencias(date(2025, 3, 4)) == 0
+
+        print("✅ Teste PASSOU: Próxima ocorrência")
+
+    def test_livro_de_ocorrencias_sem_duplicatas(self, usuario_teste):
+        """✅ Teste: Criação e agendador não duplicam a mesma ocorrência"""
+        with app.app_context():
+            from app import (criar_transacao_de_recorrencia,
+                             processar_recorrencias, inserir_ocorrencias,
+                             dados_ocorrencia)
+
+            hoje = date.today()
+            rec = Recorrencia(
+                usuario_id=usuario_teste,
+                descricao='Streaming',
+                valor=39.90,
+                tipo='Despesa',
+                categoria='Testes',
+                forma_pagamento='Dinheiro',
+                frequencia='Diária',
+                dia_vencimento=hoje.day,
+                data_inicio=hoje,
+                ativa=True
+            )
+            db.session.add(rec)
+            db.session.commit()
+
+            assert criar_transacao_de_recorrencia(rec) is not None
+            assert processar_recorrencias(hoje) == 0
+            assert inserir_ocorrencias([dados_ocorrencia(rec, hoje)]) == []
+            db.session.commit()
+
+            assert Transacao.query.filter_by(
+                recorrencia_id=rec.id, data=hoje).count() == 1
+
+        print("✅ Teste PASSOU: Livro de ocorrências")
+
+    def test_catch_up_de_ocorrencias(self, usuario_teste):
+        """✅ Teste: Catch-up recupera dias perdidos e atualiza o banco"""
+        with app.app_context():
+            from app import processar_recorrencias_atrasadas
+
+            banco = Banco(usuario_id=usuario_teste, nome='Banco Catch-up',
+                          saldo=1000.00, tipo='Corrente')
+            db.session.add(banco)
+            db.session.flush()
+
+            rec = Recorrencia(
+                usuario_id=usuario_teste,
+                descricao='Estacionamento',
+                valor=10.00,
+                tipo='Despesa',
+                categoria='Testes',
+                forma_pagamento='Débito',
+                banco_id=banco.id,
+                frequencia='Diária',
+                dia_vencimento=1,
+                data_inicio=date(2025, 5, 1),
+                ativa=True
+            )
+            db.session.add(rec)
+            db.session.commit()
+            rec_id, banco_id = rec.id, banco.id
+
+            gerados = processar_recorrencias_atrasadas(
+                date(2025, 5, 1), date(2025, 5, 7), tamanho_lote=3)
+            assert gerados == 7
+
+            # Rodar de novo não duplica nada
+            assert processar_recorrencias_atrasadas(
+                date(2025, 5, 1), date(2025, 5, 7), tamanho_lote=3) == 0
+
+            assert Transacao.query.filter_by(recorrencia_id=rec_id).count() == 7
+            assert db.session.get(Banco, banco_id).saldo == pytest.approx(930.00)
+            assert MovimentacaoBanco.query.filter_by(
+                banco_id=banco_id).count() == 7
+            assert db.session.get(
+                Recorrencia, rec_id).proxima_ocorrencia == date(2025, 5, 8)
+
+        print("✅ Teste PASSOU: Catch-up de ocorrências")
+
+
+# ========== TESTES DO DASHBOARD ==========
+
+class TestDashboard:
+    """Testes dos totais do dashboard"""
+
+    def test_resumo_dashboard(self, usuario_teste):
+        """✅ Teste: Totais agregados no banco batem com o cálculo antigo"""
+        with app.app_context():
+            from app import resumo_dashboard
+
+            banco = Banco(usuario_id=usuario_teste, nome='Banco Resumo',
+                          saldo=0, tipo='Corrente')
+            db.session.add(banco)
+            db.session.flush()
+
+            dados = [
+                ('Receita', 1000.00, 'Dinheiro', None),
+                ('Despesa', 150.50, 'Dinheiro', None),
+                ('Receita', 2000.00, 'PIX', banco.id),
+                ('Despesa', 300.25, 'Débito', banco.id),
+                ('Despesa', 99.90, 'Cartão de Crédito', None),
+            ]
+            for tipo, valor, forma, banco_id in dados:
+                db.session.add(Transacao(
+                    usuario_id=usuario_teste,
+                    descricao=f'{tipo} {valor}',
+                    valor=valor,
+                    categoria='Testes',
+                    tipo=tipo,
+                    forma_pagamento=forma,
+                    data=date.today(),
+                    banco_id=banco_id
+                ))
+            db.session.commit()
+
+            resumo = resumo_dashboard(usuario_teste)
+
+            assert resumo['quantidade_transacoes'] == 5
+            assert resumo['total_receitas'] == pytest.approx(3000.00)
+            assert resumo['total_despesas'] == pytest.approx(450.75)
+            assert resumo['saldo_carteira'] == pytest.approx(849.50)
+
+        print("✅ Teste PASSOU: Resumo do dashboard")
+
+
+# ========== TESTES DE RELATÓRIOS ==========
+
+class TestRelatorios:
+    """Testes dos relatórios"""
+
+    def test_series_agrupadas_no_banco(self, usuario_teste):
+        """✅ Teste: Séries do relatório vêm de GROUP BY ordenado"""
+        from decimal import Decimal
+        from app import series_relatorio
+
+        with app.app_context():
+            dados = [('Salário', '3000.00', 'Trabalho', 'Receita', date(2025, 5, 5)),
+                     ('Mercado', '200.00', 'Alimentação', 'Despesa', date(2025, 5, 5)),
+                     ('Padaria', '12.50', 'Alimentação', 'Despesa', date(2025, 5, 1)),
+                     ('Uber', '30.00', 'Transporte', 'Despesa', date(2025, 6, 2))]
+            db.session.add_all([Transacao(
+                usuario_id=usuario_teste, descricao=descricao, valor=Decimal(valor),
+                categoria=categoria, tipo=tipo, forma_pagamento='Dinheiro', data=data)
+                for descricao, valor, categoria, tipo, data in dados])
+            db.session.commit()
+
+            series = series_relatorio(usuario_teste, {'data_fim': '2025-05-31'})
+
+            assert series['quantidade_transacoes'] == 3
+            assert series['total_receitas'] == Decimal('3000.00')
+            assert series['saldo'] == Decimal('2787.50')
+            assert series['grafico_barras'] == {
+                'labels': ['Alimentação', 'Trabalho'],
+                'receitas': [0, Decimal('3000.00')],
+                'despesas': [Decimal('212.50'), 0]}
+            assert series['grafico_linha'] == {
+                'labels': ['01/05/2025', '05/05/2025'],
+                'receitas': [0, Decimal('3000.00')],
+                'despesas': [Decimal('12.50'), Decimal('200.00')]}
+
+            # Período com pontas de meses incompletos (resumo + transações)
+            series = series_relatorio(
+                usuario_teste, {'data_inicio': '2025-05-03', 'data_fim': '2025-06-30'})
+            assert series['quantidade_transacoes'] == 3
+            assert series['total_despesas'] == Decimal('230.00')
+
+        print("✅ Teste PASSOU: Séries do relatório")
+
+    def test_api_relatorios(self, client, usuario_teste):
+        """✅ Teste: Página de relatórios busca séries e transações pela API"""
+        with app.app_context():
+            usuario = db.session.get(Usuario, usuario_teste)
+            db.session.add_all([Transacao(
+                usuario_id=usuario_teste, descricao=f'Compra {dia}', valor=10 * dia,
+                categoria='Mercado', tipo='Despesa', forma_pagamento='Pix',
+                data=date(2025, 7, dia)) for dia in (1, 2, 3)])
+            db.session.commit()
+            client.post('/login', data={'email': usuario.email,
+                                        'senha': 'senha123'})
+
+            pagina = client.get('/relatorios?data_inicio=2025-07-01')
+            assert pagina.status_code == 200
+            assert b'Compra 1' not in pagina.data
+
+            series = client.get('/api/relatorios/series?data_inicio=2025-07-01').get_json()
+            assert series['quantidade_transacoes'] == 3
+            assert series['total_despesas'] == 60
+            assert series['grafico_barras']['labels'] == ['Mercado']
+
+            primeira = client.get(
+                '/api/relatorios/transacoes?data_inicio=2025-07-01&por_pagina=2').get_json()
+            assert [t['descricao'] for t in primeira['transacoes']] == ['Compra 3', 'Compra 2']
+
+            segunda = client.get(
+                '/api/relatorios/transacoes?data_inicio=2025-07-01&por_pagina=2'
+                f"&cursor={primeira['proximo_cursor']}").get_json()
+            assert [t['descricao'] for t in segunda['transacoes']] == ['Compra 1']
+            assert segunda['proximo_cursor'] is None
+
+        print("✅ Teste PASSOU: API de relatórios")
+
+    def test_cache_por_versao_dos_dados(self, client, usuario_teste):
+        """✅ Teste: Relatório repetido vem do cache até a próxima escrita"""
+        from sqlalchemy import event
+        from cache_relatorios import cache
+
+        with app.app_context():
+            usuario = db.session.get(Usuario, usuario_teste)
+            client.post('/login', data={'email': usuario.email,
+                                        'senha': 'senha123'})
+            client.post('/adicionar', data={
+                'descricao': 'Aluguel', 'valor': '1000,00', 'categoria': 'Moradia',
+                'tipo': 'Despesa', 'data': '2025-08-05', 'forma_pagamento': 'Pix'})
+            cache.limpar()
+
+            url = '/api/relatorios/series?data_inicio=2025-08-01'
+            assert client.get(url).get_json()['total_despesas'] == 1000
+
+            consultas = []
+            def registrar(conn, cursor, sql, *args):
+                consultas.append(sql)
+            event.listen(db.engine, 'before_cursor_execute', registrar)
+            try:
+                assert client.get(url).get_json()['total_despesas'] == 1000
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', registrar)
+
+            assert cache.acertos == 1
+            assert not any('transacoes' in sql for sql in consultas)
+
+            # Qualquer escrita sobe a versão e o resultado é recalculado
+            client.post('/adicionar', data={
+                'descricao': 'Luz', 'valor': '150,00', 'categoria': 'Moradia',
+                'tipo': 'Despesa', 'data': '2025-08-10', 'forma_pagamento': 'Pix'})
+            assert client.get(url).get_json()['total_despesas'] == 1150
+            assert cache.acertos == 1
+
+        print("✅ Teste PASSOU: Cache dos relatórios")
+
+    def test_tendencias(self, client, usuario_teste):
+        """✅ Teste: Variações, médias móveis e taxa de poupança mês a mês"""
+        from decimal import Decimal
+        from tendencias import calcular_tendencias
+
+        with app.app_context():
+            usuario = db.session.get(Usuario, usuario_teste)
+            dados = [('Salário', '1000.00', 'Trabalho', 'Receita', date(2025, 5, 5)),
+                     ('Salário', '1000.00', 'Trabalho', 'Receita', date(2025, 6, 5)),
+                     ('Mercado', '300.00', 'Alimentação', 'Despesa', date(2025, 4, 10)),
+                     ('Mercado', '400.00', 'Alimentação', 'Despesa', date(2025, 5, 10)),
+                     ('Mercado', '500.00', 'Alimentação', 'Despesa', date(2025, 6, 10)),
+                     ('Mercado', '250.00', 'Alimentação', 'Despesa', date(2024, 6, 10))]
+            db.session.add_all([Transacao(
+                usuario_id=usuario_teste, descricao=descricao, valor=Decimal(valor),
+                categoria=categoria, tipo=tipo, forma_pagamento='Pix', data=data)
+                for descricao, valor, categoria, tipo, data in dados])
+            db.session.commit()
+
+            resultado = calcular_tendencias(usuario_teste, anos=2, hoje=date(2025, 6, 20))
+
+            assert len(resultado['meses']) == 24
+            assert resultado['meses'][-1] == '2025-06'
+            assert resultado['taxa_poupanca'][-2:] == [60.0, 50.0]
+
+            alimentacao, = resultado['categorias']
+            assert alimentacao['categoria'] == 'Alimentação'
+            assert alimentacao['total'][-3:] == [300.0, 400.0, 500.0]
+            assert alimentacao['variacao_mensal'][-1] == 100.0
+            assert alimentacao['variacao_mensal_pct'][-1] == 25.0
+            assert alimentacao['variacao_anual'][-1] == 250.0
+            assert alimentacao['media_3'][-1] == 400.0
+            assert alimentacao['media_12'][-1] == 100.0
+            assert alimentacao['media_12'][10] is None
+
+            client.post('/login', data={'email': usuario.email,
+                                        'senha': 'senha123'})
+            assert client.get('/relatorios/tendencias').status_code == 200
+            api = client.get('/api/relatorios/tendencias?anos=3').get_json()
+            assert api['anos'] == 3 and len(api['meses']) == 36
+
+        print("✅ Teste PASSOU: Tendências")
+
+
+# ========== TESTES DA FILA DE RELATÓRIOS ==========
+
+class TestFilaRelatorios:
+    """Testes dos relatórios em arquivo gerados pelo worker"""
+
+    def test_extrato_gerado_pelo_worker(self, client, usuario_teste, monkeypatch):
+        """✅ Teste: Extrato enfileirado, gerado pelo worker e retentado em erro"""
+        import io
+        import zipfile
+        from datetime import datetime
+        import tarefas
+        from models import ParteArquivoRelatorio, TarefaRelatorio
+
+        # Partes pequenas para o arquivo ocupar várias linhas no banco
+        monkeypatch.setattr(tarefas, 'TAMANHO_PARTE', 1024)
+        with app.app_context():
+            usuario = db.session.get(Usuario, usuario_teste)
+            db.session.add(Transacao(
+                usuario_id=usuario_teste, descricao='Aluguel de março', valor=900,
+                categoria='Moradia', tipo='Despesa', forma_pagamento='Pix',
+                data=date(2025, 3, 5)))
+            db.session.commit()
+            client.post('/login', data={'email': usuario.email,
+                                        'senha': 'senha123'})
+
+            client.post('/relatorios/arquivos', data={'ano': 2025, 'formato': 'xlsx'})
+            tarefa = TarefaRelatorio.query.filter_by(usuario_id=usuario_teste).one()
+            assert tarefa.status == 'pendente'
+
+            saida = app.test_cli_runner().invoke(args=['worker', '--uma-vez'])
+            assert 'concluída' in saida.output
+
+            situacao = client.get(f'/api/relatorios/tarefas/{tarefa.id}').get_json()
+            assert situacao['status'] == 'concluida'
+            arquivo = client.get(situacao['download'])
+            with zipfile.ZipFile(io.BytesIO(arquivo.data)) as planilha:
+                assert 'Aluguel de março' in planilha.read(
+                    'xl/worksheets/sheet1.xml').decode()
+            # O arquivo está no banco (visível a qualquer processo), em partes
+            assert ParteArquivoRelatorio.query.filter_by(tarefa_id=tarefa.id).count() > 1
+
+            # Sem o arquivo: 404 e a tarefa volta para a fila
+            ParteArquivoRelatorio.query.filter_by(tarefa_id=tarefa.id).delete()
+            db.session.commit()
+            assert client.get(situacao['download']).status_code == 404
+            db.session.refresh(tarefa)
+            assert tarefa.status == 'pendente'
+            app.test_cli_runner().invoke(args=['worker', '--uma-vez'])
+            assert client.get(situacao['download']).data == arquivo.data
+
+            # Tarefas encerradas há mais de DIAS_RETENCAO dias são apagadas
+            assert tarefas.limpar_antigas() == 0
+            assert tarefas.limpar_antigas(datetime.utcnow() + timedelta(
+                days=tarefas.DIAS_RETENCAO + 1)) == 1
+            assert ParteArquivoRelatorio.query.count() == 0
+            db.session.expunge(tarefa)  # apagada fora do ORM
+
+            # Erro no gerador: volta para a fila com espera, até esgotar as tentativas
+            def quebrar(*args):
+                raise RuntimeError('disco cheio')
+            monkeypatch.setitem(tarefas.GERADORES, 'extrato_anual', quebrar)
+            client.post('/relatorios/arquivos', data={'ano': 2025, 'formato': 'pdf'})
+
+            agora = datetime.utcnow()
+            for tentativa in range(1, tarefas.MAX_TENTATIVAS + 1):
+                reservada = tarefas.reservar_tarefa(agora)
+                assert reservada.tentativas == tentativa
+                assert not tarefas.executar_tarefa(reservada, agora)
+                assert tarefas.reservar_tarefa(agora) is None
+                agora += timedelta(hours=1)
+
+            falhou = db.session.get(TarefaRelatorio, reservada.id)
+            assert falhou.status == 'falhou'
+            assert 'disco cheio' in falhou.erro
+
+        print("✅ Teste PASSOU: Fila de relatórios")
+
+
+# ========== TESTES DE ORÇAMENTOS ==========
+
+class TestOrcamentos:
+    """Testes de orçamentos × gastos"""
+
+    def test_visao_doze_meses(self, client, usuario_teste):
+        """✅ Teste: Limite × gasto de 12 meses numa consulta agrupada"""
+        from decimal import Decimal
+        from sqlalchemy import event
+        from models import Orcamento
+        from orcamentos import visao_orcamentos
+
+        with app.app_context():
+            dados = [('450.00', date(2025, 5, 10)), ('500.00', date(2025, 6, 1)),
+                     ('100.00', date(2024, 7, 31)), ('200.00', date(2024, 6, 30))]
+            db.session.add_all([Transacao(
+                usuario_id=usuario_teste, descricao='Mercado', valor=Decimal(valor),
+                categoria='Alimentação', tipo='Despesa', forma_pagamento='Pix',
+                data=data) for valor, data in dados])
+            db.session.add_all([
+                Orcamento(usuario_id=usuario_teste, categoria='Alimentação',
+                          limite_mensal=Decimal('500.00'), mes=5, ano=2025),
+                Orcamento(usuario_id=usuario_teste, categoria='Alimentação',
+                          limite_mensal=Decimal('400.00'), mes=6, ano=2025),
+                Orcamento(usuario_id=usuario_teste, categoria='Lazer',
+                          limite_mensal=Decimal('150.00'), mes=6, ano=2025)])
+            db.session.commit()
+
+            consultas = []
+            def registrar(conn, cursor, sql, *args):
+                consultas.append(sql)
+            event.listen(db.engine, 'before_cursor_execute', registrar)
+            try:
+                visao = visao_orcamentos(usuario_teste, 2025, 6)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', registrar)
+
+            assert len(consultas) == 1
+            assert visao['meses'][0] == '07/2024' and visao['meses'][-1] == '06/2025'
+
+            alimentacao, lazer = visao['categorias']
+            assert alimentacao['categoria'] == 'Alimentação'
+            assert alimentacao['meses'][0]['status'] == 'sem_orcamento'
+            assert alimentacao['meses'][-2]['status'] == 'alerta'
+            assert alimentacao['meses'][-1]['status'] == 'excedido'
+            assert alimentacao['total_gasto'] == Decimal('1050.00')
+            assert alimentacao['total_limite'] == Decimal('900.00')
+            assert lazer['meses'][-1]['gasto'] == 0
+            assert lazer['meses'][-1]['status'] == 'em_dia'
+
+        print("✅ Teste PASSOU: Visão de 12 meses dos orçamentos")
+
+    def test_alertas_incrementais(self, client, usuario_teste):
+        """✅ Teste: Gasto do orçamento e alertas de 80%/100% a cada escrita"""
+        from decimal import Decimal
+        from types import SimpleNamespace
+        from models import NotificacaoOrcamento, Orcamento
+        from orcamentos import situacao_orcamento
+        from resumos import somar_transacoes_no_resumo
+
+        def despesa(valor, categoria='Alimentação'):
+            transacao = Transacao(
+                usuario_id=usuario_teste, descricao='Mercado', valor=Decimal(valor),
+                categoria=categoria, tipo='Despesa', forma_pagamento='Pix',
+                data=date(2025, 6, 10))
+            db.session.add(transacao)
+            db.session.commit()
+            return transacao
+
+        def estado(orcamento):
+            db.session.refresh(orcamento)
+            return orcamento.gasto, [n.limiar for n in NotificacaoOrcamento.query.filter_by(
+                orcamento_id=orcamento.id).order_by(NotificacaoOrcamento.id)]
+
+        with app.app_context():
+            despesa('30.00', categoria='Lazer')
+            orcamento = Orcamento(usuario_id=usuario_teste, categoria='Alimentação',
+                                  limite_mensal=Decimal('100.00'), mes=6, ano=2025)
+            lazer = Orcamento(usuario_id=usuario_teste, categoria='Lazer',
+                              limite_mensal=Decimal('50.00'), mes=6, ano=2025)
+            db.session.add_all([orcamento, lazer])
+            db.session.commit()
+            # Orçamento criado com o mês em andamento já começa com o gasto
+            assert lazer.gasto == Decimal('30.00')
+
+            primeira = despesa('50.00')
+            assert estado(orcamento) == (Decimal('50.00'), [])
+            segunda = despesa('35.00')
+            assert estado(orcamento) == (Decimal('85.00'), [80])
+
+            # Lote (importação/recorrências) passa pelo mesmo caminho
+            somar_transacoes_no_resumo([SimpleNamespace(
+                usuario_id=usuario_teste, data=date(2025, 6, 11),
+                categoria_id=orcamento.categoria_id, tipo='Despesa',
+                forma_pagamento='Pix', valor=Decimal('20.00'))])
+            db.session.commit()
+            assert estado(orcamento) == (Decimal('105.00'), [80, 100])
+
+            # Edição e exclusão descontam o gasto sem repetir alertas
+            segunda.valor = Decimal('5.00')
+            db.session.delete(primeira)
+            db.session.commit()
+            assert estado(orcamento) == (Decimal('25.00'), [80, 100])
+            despesa('60.00')
+            assert estado(orcamento) == (Decimal('85.00'), [80, 100, 80])
+
+            # Exatamente 80%: notificação e status da página concordam
+            assert situacao_orcamento(Decimal('80.00'), Decimal('100.00'))[1] == 'alerta'
+            assert situacao_orcamento(Decimal('100.00'), Decimal('100.00'))[1] == 'excedido'
+
+            # Mudar o limite (editar ou recriar o orçamento) também cruza limiares
+            usuario = db.session.get(Usuario, usuario_teste)
+            client.post('/login', data={'email': usuario.email, 'senha': 'senha123'})
+            client.post(f'/orcamentos/editar/{orcamento.id}', data={'limite': '80,00'})
+            assert estado(orcamento) == (Decimal('85.00'), [80, 100, 80, 100])
+            for limite in ('200,00', '100,00'):
+                client.post('/orcamentos/criar', data={
+                    'categoria': 'Alimentação', 'limite': limite, 'mes': 6, 'ano': 2025})
+            assert estado(orcamento) == (Decimal('85.00'), [80, 100, 80, 100, 80])
+
+            assert len(client.get('/api/orcamentos/notificacoes').get_json()) == 5
+            assert '🔔 Alertas' in client.get('/orcamentos?mes=6&ano=2025').get_data(as_text=True)
+            client.post('/orcamentos/notificacoes/lidas', data={'mes': 6, 'ano': 2025})
+            assert client.get('/api/orcamentos/notificacoes').get_json() == []
+
+        print("✅ Teste PASSOU: Alertas de orçamento incrementais")
+
+
+# ========== TESTES DO RESUMO MENSAL ==========
+
+class TestResumoMensal:
+    """Testes do resumo mensal (rollup) das transações"""
+
+    def test_resumo_acompanha_transacoes(self, usuario_teste):
+        """✅ Teste: Resumo mensal igual ao recalculado após inserir, editar e apagar"""
+        from decimal import Decimal
+        from models import ResumoMensal
+        from resumos import reconstruir_resumos, totais_por_categoria
+
+        def resumo():
+            return sorted(
+                (r.ano, r.mes, r.categoria_id, r.tipo, r.forma_pagamento,
+                 r.total, r.quantidade)
+                for r in ResumoMensal.query.filter_by(usuario_id=usuario_teste))
+
+        with app.app_context():
+            dados = [('Mercado', '50.25', 'Alimentação', date(2025, 3, 2)),
+                     ('Feira', '19.75', 'Alimentação', date(2025, 3, 9)),
+                     ('Ônibus', '4.40', 'Transporte', date(2025, 4, 1))]
+            transacoes = [Transacao(
+                usuario_id=usuario_teste, descricao=descricao, valor=valor,
+                categoria=categoria, tipo='Despesa', forma_pagamento='Dinheiro',
+                data=data) for descricao, valor, categoria, data in dados]
+            db.session.add_all(transacoes)
+            db.session.commit()
+
+            alimentacao = Categoria.query.filter_by(
+                usuario_id=usuario_teste, nome='Alimentação').one()
+            assert totais_por_categoria(usuario_teste, 2025, 3) == {
+                alimentacao.id: Decimal('70.00')}
+
+            # Editar valor, categoria e mês; apagar outra
+            transacoes[0].valor = Decimal('60.00')
+            transacoes[1].categoria = 'Transporte'
+            transacoes[2].data = date(2025, 3, 30)
+            db.session.commit()
+            db.session.delete(transacoes[0])
+            db.session.commit()
+
+            incremental = resumo()
+            with db.engine.begin() as conexao:
+                reconstruir_resumos(conexao, [usuario_teste])
+            db.session.expire_all()
+            assert incremental == resumo()
+            assert len(incremental) == 1
+            assert incremental[0][5:] == (Decimal('24.15'), 2)
+
+        print("✅ Teste PASSOU: Resumo mensal")
+
+
+# ========== TESTES DA BUSCA TEXTUAL ==========
+
+class TestBusca:
+    """Testes da Busca Textual"""
+
+    def test_busca_em_todas_as_tabelas(self, usuario_teste):
+        """✅ Teste: Busca encontra a descrição nas três tabelas e segue edições"""
+        with app.app_context():
+            from busca import buscar_descricoes
+
+            banco = Banco(usuario_id=usuario_teste, nome='Nubank',
+                          tipo='Corrente', saldo=0.0)
+            cartao = CartaoCredito(usuario_id=usuario_teste, nome='Visa',
+                                   dia_fechamento=10, dia_vencimento=20)
+            db.session.add_all([banco, cartao])
+            db.session.flush()
+
+            transacao = Transacao(
+                usuario_id=usuario_teste, descricao='Assinatura Netflix',
+                valor=39.90, categoria='Lazer', tipo='Despesa',
+                forma_pagamento='Dinheiro', data=date(2025, 3, 1))
+            db.session.add_all([
+                transacao,
+                CompraCartao(
+                    usuario_id=usuario_teste, cartao_id=cartao.id,
+                    descricao='Netflix anual', valor_total=400.00,
+                    quantidade_parcelas=1, data_compra=date(2025, 3, 2),
+                    categoria='Lazer', forma_pagamento='Cartão de Crédito'),
+                MovimentacaoBanco(
+                    banco_id=banco.id, tipo_movimento='saida', valor=39.90,
+                    descricao='Despesa: Netflix', data=date(2025, 3, 3)),
+                Transacao(
+                    usuario_id=usuario_teste, descricao='Padaria',
+                    valor=12.00, categoria='Alimentação', tipo='Despesa',
+                    forma_pagamento='Dinheiro', data=date(2025, 3, 4)),
+            ])
+            db.session.commit()
+
+            resultados = buscar_descricoes(usuario_teste, 'netf')
+            assert sorted(r['origem'] for r in resultados) == [
+                'compra_cartao', 'movimentacao_banco', 'transacao']
+
+            # Sem acento e com operadores digitados também funciona
+            assert len(buscar_descricoes(usuario_teste, 'padária "')) == 1
+
+            # No PostgreSQL as mesmas palavras viram prefixos do to_tsquery
+            from busca import _postgres_termo
+            assert _postgres_termo("netf & 'x") == "'netf':* & 'x':*"
+            assert _postgres_termo('!!') is None
+
+            transacao.descricao = 'Assinatura Spotify'
+            db.session.commit()
+            assert 'transacao' not in [
+                r['origem'] for r in buscar_descricoes(usuario_teste, 'netflix')]
+
+            db.session.delete(transacao)
+            db.session.commit()
+            assert buscar_descricoes(usuario_teste, 'spotify') == []
+
+            # Outro usuário não vê os resultados
+            assert buscar_descricoes(usuario_teste + 1000, 'netflix') == []
+
+        print("✅ Teste PASSOU: Busca textual")
+
+
+# ========== TESTES DAS MIGRAÇÕES ==========
+
+class TestMigracoes:
+    """Testes das Migrações do Esquema"""
+
+    def test_upgrade_aplica_uma_vez(self, tmp_path):
+        """✅ Teste: Migrações criam o esquema e não rodam duas vezes"""
+        from sqlalchemy import create_engine, inspect
+        from migracoes import aplicar_migracoes, MIGRACOES
+
+        engine = create_engine(f"sqlite:///{tmp_path / 'migracoes.db'}")
+        avisos = []
+
+        aplicadas = aplicar_migracoes(engine, avisar=avisos.append)
+        assert aplicadas == [versao for versao, _, _ in MIGRACOES]
+
+        inspetor = inspect(engine)
+        colunas = {c['name'] for c in inspetor.get_columns('transacoes')}
+        assert {'cartao_id', 'recorrencia_id', 'hash_importacao'} <= colunas
+        assert 'uq_transacoes_recorrencia_data' in {
+            i['name'] for i in inspetor.get_indexes('transacoes')}
+
+        assert aplicar_migracoes(engine, avisar=avisos.append) == []
+        assert len(avisos) == len(MIGRACOES)
+        engine.dispose()
+
+        # Banco antigo: tabelas sem nenhum índice secundário. Todo índice
+        # declarado nos modelos precisa ser criado por alguma migração.
+        engine = create_engine(f"sqlite:///{tmp_path / 'antigo.db'}")
+        with engine.begin() as conexao:
+            for tabela in db.metadata.sorted_tables:
+                tabela.create(conexao)
+                for indice in tabela.indexes:
+                    indice.drop(conexao)
+
+        aplicar_migracoes(engine, avisar=avisos.append)
+
+        inspetor = inspect(engine)
+        for tabela in db.metadata.sorted_tables:
+            existentes = {i['name'] for i in inspetor.get_indexes(tabela.name)}
+            for indice in tabela.indexes:
+                assert indice.name in existentes, indice.name
+        engine.dispose()
+
+        print("✅ Teste PASSOU: Migrações")
+
 
 if __name__ == '__main__':
     pytest.main([__file__, '-v', '--tb=short'])